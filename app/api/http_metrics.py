@@ -0,0 +1,39 @@
+"""
+ASGI middleware: время обработки HTTP запросов по маршрутам
+
+Метка route - шаблон пути маршрута (/api/history/export), а не сам путь;
+запросы вне маршрутов (сканеры, опечатки) попадают в одну серию unmatched,
+чтобы число серий не росло. Время считается до конца тела ответа, включая
+потоковую выгрузку.
+"""
+import time
+
+from ..core.metrics import HTTP_REQUEST_SECONDS
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class HttpMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or UNMATCHED_ROUTE
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, status).observe(time.perf_counter() - started)
@@ -0,0 +1,144 @@
+"""
+Кэш сериализованных ответов read-эндпоинтов с ETag/304 и single-flight
+
+Ключ - эндпоинт и параметры запроса, версия - счетчики данных устройства
+и активного профиля (см. DataStorage.data_version). Пока версия не
+изменилась, опрос отдает готовые байты или 304 без пересчета.
+"""
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+RESPONSE_CACHE_SIZE = 1024
+# Шаг версии для ответов, зависящих от текущего времени (окна "1h", агрегаты без "to")
+TIME_SLOT_SEC = 5
+
+# Версии счетчиков локальны для процесса - ETag другого воркера не совпадет
+_BOOT_ID = f"{os.getpid()}-{os.urandom(4).hex()}"
+
+
+class CachedBody(NamedTuple):
+    version: Tuple
+    etag: str
+    body: bytes
+
+
+def make_etag(key: str, version: Tuple) -> str:
+    digest = hashlib.blake2b(f"{_BOOT_ID}|{key}|{version}".encode("utf-8"), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def time_slot(seconds: float = TIME_SLOT_SEC) -> int:
+    return int(time.time() // seconds)
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _serialize(payload: Any) -> bytes:
+    # Так же, как JSONResponse FastAPI
+    return json.dumps(
+        jsonable_encoder(payload),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class ResponseCache:
+    """LRU готовых тел ответов + объединение одинаковых одновременных запросов"""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, CachedBody]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, Tuple], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.shared = 0
+
+    async def get(self, key: str, version: Tuple, compute: Callable[[], Any]) -> CachedBody:
+        """Тело ответа для версии; compute вызывается один раз на (ключ, версию)."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        flight = self._inflight.get((key, version))
+        if flight is not None:
+            self.shared += 1
+            return await asyncio.shield(flight)
+
+        self.misses += 1
+        flight = asyncio.get_running_loop().create_future()
+        self._inflight[(key, version)] = flight
+        try:
+            payload = compute()
+            if inspect.isawaitable(payload):
+                payload = await payload
+            entry = CachedBody(version, make_etag(key, version), _serialize(payload))
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Ошибку получают ждущие; сам future помечаем как прочитанный
+            flight.exception()
+            raise
+        finally:
+            self._inflight.pop((key, version), None)
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        flight.set_result(entry)
+        return entry
+
+    async def respond(
+        self,
+        request: Request,
+        key: str,
+        version: Tuple,
+        compute: Callable[[], Any],
+    ) -> Response:
+        """Ответ с ETag; 304, если у клиента уже эта версия."""
+        etag = make_etag(key, version)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        entry = await self.get(key, version, compute)
+        headers["ETag"] = entry.etag
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "shared": self.shared,
+        }
+
+
+# Глобальный кэш ответов
+response_cache = ResponseCache()
@@ -1,12 +1,20 @@
 """
 API маршруты для климатических данных
 """
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import time
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from ..response_cache import response_cache, time_slot
+from ...core.constants import MAX_HISTORY_SIZE
+from ...core.log import get_logger
+from ...core.ring_buffer import METRIC_COLUMNS
+from ...core.rollups import parse_duration
 from ...core.storage import storage
 from ...services.ai_service import ai_service
-from ...services.websocket_service import websocket_service
+from ...services.forecast_engine import SUPPORTED_MODELS, forecast_engine
+from ...services.websocket_service import encode_json, websocket_service
 
 router = APIRouter(prefix="/api", tags=["climate"])
+log = get_logger("websocket")
 
 SUPPORTED_HORIZONS_MIN = {
     "30m": 30,
@@ -15,20 +23,51 @@ SUPPORTED_HORIZONS_MIN = {
 }
 SAMPLE_PERIOD_MIN = 5
 
+# Имена метрик в ответах API
+PREDICTION_KEYS = {
+    "temp": "temperature",
+    "hum": "humidity",
+    "co2": "co2",
+    "co": "co",
+    "lux": "lux",
+}
+
+
+def _horizon_minutes(label: str) -> int:
+    if label in SUPPORTED_HORIZONS_MIN:
+        return SUPPORTED_HORIZONS_MIN[label]
+    return max(1, parse_duration(label) // 60)
+
 
 @router.get("/now")
-async def get_current_data(forecast: str = "30m", forecast_min: int | None = None):
+async def get_current_data(
+    request: Request,
+    forecast: str = "30m",
+    forecast_min: int | None = None,
+    device_id: str | None = None,
+):
     """
     Получение текущих данных с AI прогнозом
     
     Args:
         forecast: Горизонт прогноза ("30m", "3h", "24h")
         forecast_min: Время прогноза в минутах (приоритетнее forecast)
+        device_id: ID устройства (по умолчанию - последнее приславшее данные)
         
     Returns:
-        Текущие данные и прогнозы
+        Текущие данные и прогнозы (ETag; 304, если данные не менялись)
     """
-    if storage.current_data["timestamp"] is None:
+    return await response_cache.respond(
+        request,
+        f"now|{forecast}|{forecast_min}|{device_id}",
+        storage.data_version(device_id),
+        lambda: _current_payload(forecast, forecast_min, device_id),
+    )
+
+
+def _current_payload(forecast: str, forecast_min: int | None, device_id: str | None) -> dict:
+    current = storage.get_current(device_id)
+    if current["timestamp"] is None:
         return {
             "error": "no_data",
             "message": "Нет данных от ESP32. Проверьте MQTT."
@@ -42,36 +81,31 @@ async def get_current_data(forecast: str = "30m", forecast_min: int | None = Non
 
     steps_ahead = max(1, round(target_minutes / SAMPLE_PERIOD_MIN))
 
-    # AI прогноз для всех параметров
-    temp_history = [float(d.get("temp", d.get("temperature", 0))) for d in storage.data_history]
-    hum_history = [float(d.get("hum", d.get("humidity", 0))) for d in storage.data_history]
-    co2_history = [float(d.get("co2", d.get("co2_ppm", 0))) for d in storage.data_history]
-    co_history = [float(d.get("co", d.get("co_ppm", 0))) for d in storage.data_history]
-    lux_history = [float(d.get("lux", 0)) for d in storage.data_history]
-    
-    predictions = {
-        "temperature": ai_service.predict_linear(temp_history, steps_ahead),
-        "humidity": ai_service.predict_linear(hum_history, steps_ahead),
-        "co2": ai_service.predict_linear(co2_history, steps_ahead),
-        "co": ai_service.predict_linear(co_history, steps_ahead),
-        "lux": ai_service.predict_linear(lux_history, steps_ahead)
-    }
+    # AI прогноз для всех параметров (потоковая регрессия + кэш)
+    states = storage.regression.snapshot(current["device_id"]) or {}
+    forecasts = ai_service.forecast(current["device_id"], states, steps_ahead)
+    predictions = {key: forecasts.get(metric, 0.0) for metric, key in PREDICTION_KEYS.items()}
     
     # MC Score
     mc_score = ai_service.calculate_mc_score(
-        storage.current_data,
+        current,
         storage.active_profile
     )
     
     return {
         "current": {
-            "temp": storage.current_data["temperature"],
-            "hum": storage.current_data["humidity"],
-            "co2": storage.current_data["co2_ppm"],
-            "co": storage.current_data["co_ppm"],
-            "lux": storage.current_data["lux"],
+            "temp": current["temperature"],
+            "hum": current["humidity"],
+            "co2": current["co2_ppm"],
+            "co": current["co_ppm"],
+            "lux": current["lux"],
             "mc_score": mc_score
         },
+        "anomaly": {
+            "flag": current["anomaly"],
+            "anomalies": current["anomalies"],
+            "score": current["anomaly_score"],
+        },
         "predictions": predictions,
         "forecast": {
             "label": forecast if forecast in SUPPORTED_HORIZONS_MIN else f"{target_minutes}m",
@@ -79,56 +113,127 @@ async def get_current_data(forecast: str = "30m", forecast_min: int | None = Non
             "steps_ahead": steps_ahead,
             "sample_period_min": SAMPLE_PERIOD_MIN,
         },
-        "device_id": storage.current_data["device_id"],
-        "timestamp": storage.current_data["timestamp"],
+        "device_id": current["device_id"],
+        "timestamp": current["timestamp"],
         "profile": storage.active_profile["name"]
     }
 
 
 @router.get("/stats")
-async def get_statistics():
-    """Получение статистики по всем параметрам"""
-    if len(storage.data_history) == 0:
+async def get_statistics(request: Request, device_id: str | None = None, window: str | None = None):
+    """
+    Получение статистики по всем параметрам
+
+    Args:
+        device_id: ID устройства (по умолчанию - последнее приславшее данные)
+        window: Окно статистики из STATS_WINDOWS ("100", "1h", "24h")
+    """
+    window = window or storage.window_stats.default_window
+    if window not in storage.window_stats.specs:
+        return {
+            "error": "bad_window",
+            "message": f"Доступные окна: {', '.join(storage.window_stats.specs)}"
+        }
+
+    # Окно по времени меняется и без новых показаний (старые точки выходят)
+    version = storage.data_version(device_id)
+    if storage.window_stats.specs[window][1] is not None:
+        version += (time_slot(),)
+    return await response_cache.respond(
+        request,
+        f"stats|{device_id}|{window}",
+        version,
+        lambda: _stats_payload(device_id, window),
+    )
+
+
+def _stats_payload(device_id: str | None, window: str) -> dict:
+    current = storage.get_current(device_id)
+    count, summary = storage.window_stats.summary(current["device_id"], window, time.time())
+    if not count:
         return {"error": "no_data"}
-    
-    temps = [float(d.get("temp", d.get("temperature", 0))) for d in storage.data_history]
-    hums = [float(d.get("hum", d.get("humidity", 0))) for d in storage.data_history]
-    co2s = [float(d.get("co2", d.get("co2_ppm", 0))) for d in storage.data_history]
-    cos = [float(d.get("co", d.get("co_ppm", 0))) for d in storage.data_history]
-    luxs = [float(d.get("lux", 0)) for d in storage.data_history]
-    
+
+    def _with_current(column: str, current_key: str) -> dict:
+        return {"current": current[current_key], **summary[column]}
+
     return {
-        "measurements": len(storage.data_history),
-        "temperature": {
-            "current": storage.current_data["temperature"],
-            "min": min(temps),
-            "max": max(temps),
-            "avg": round(sum(temps) / len(temps), 1)
-        },
-        "humidity": {
-            "current": storage.current_data["humidity"],
-            "min": min(hums),
-            "max": max(hums),
-            "avg": round(sum(hums) / len(hums), 1)
-        },
-        "co2": {
-            "current": storage.current_data["co2_ppm"],
-            "min": min(co2s),
-            "max": max(co2s),
-            "avg": round(sum(co2s) / len(co2s), 1)
-        },
-        "co": {
-            "current": storage.current_data["co_ppm"],
-            "min": min(cos),
-            "max": max(cos),
-            "avg": round(sum(cos) / len(cos), 1)
-        },
-        "lux": {
-            "current": storage.current_data["lux"],
-            "min": min(luxs),
-            "max": max(luxs),
-            "avg": round(sum(luxs) / len(luxs), 1)
+        "measurements": count,
+        "window": window,
+        "device_id": current["device_id"],
+        "temperature": _with_current("temp", "temperature"),
+        "humidity": _with_current("hum", "humidity"),
+        "co2": _with_current("co2", "co2_ppm"),
+        "co": _with_current("co", "co_ppm"),
+        "lux": _with_current("lux", "lux")
+    }
+
+
+@router.get("/forecast")
+async def get_fleet_forecast(
+    devices: str | None = None,
+    horizons: str = "30m,3h,24h",
+    models: str = "linear",
+):
+    """
+    Пакетный прогноз для нескольких устройств одним векторизованным проходом
+    
+    Args:
+        devices: ID устройств через запятую (по умолчанию - все)
+        horizons: Горизонты через запятую ("30m", "3h", "24h", "90m"...)
+        models: Модели через запятую (linear, ewma, holt)
+        
+    Returns:
+        Прогнозы по устройствам, моделям и горизонтам
+    """
+    model_list = [m.strip() for m in models.split(",") if m.strip()]
+    unknown = [m for m in model_list if m not in SUPPORTED_MODELS]
+    if unknown or not model_list:
+        return {
+            "error": "bad_model",
+            "message": f"Поддерживаются: {', '.join(SUPPORTED_MODELS)}"
         }
+
+    horizon_labels = [h.strip() for h in horizons.split(",") if h.strip()]
+    try:
+        minutes = [_horizon_minutes(h) for h in horizon_labels]
+    except (ValueError, OverflowError):
+        return {"error": "bad_horizon", "message": f"Некорректные горизонты: {horizons}"}
+    steps = [max(1, round(m / SAMPLE_PERIOD_MIN)) for m in minutes]
+
+    if devices:
+        device_ids = [d.strip() for d in devices.split(",") if d.strip()]
+    else:
+        device_ids = list(storage.devices)
+
+    views = {}
+    for device_id in device_ids:
+        view = storage.get_history_view(MAX_HISTORY_SIZE, device_id)
+        if view:
+            views[device_id] = view
+    if not views:
+        return {"error": "no_data"}
+
+    results = forecast_engine.forecast(views, steps, model_list, MAX_HISTORY_SIZE)
+
+    out = {}
+    for d, device_id in enumerate(views):
+        per_model = {}
+        for model, values in results.items():
+            per_model[model] = {
+                label: {
+                    PREDICTION_KEYS[metric]: round(float(values[d, k, h]), 1)
+                    for k, metric in enumerate(METRIC_COLUMNS)
+                }
+                for h, label in enumerate(horizon_labels)
+            }
+        out[device_id] = per_model
+
+    return {
+        "devices": out,
+        "missing": [d for d in device_ids if d not in views],
+        "horizons": {label: {"minutes": m, "steps_ahead": st} for label, m, st in zip(horizon_labels, minutes, steps)},
+        "models": model_list,
+        "sample_period_min": SAMPLE_PERIOD_MIN,
     }
 
 
@@ -136,30 +241,45 @@ async def get_statistics():
 async def websocket_endpoint(websocket: WebSocket):
     """
     WebSocket для real-time обновлений
+
+    Без подписки клиент получает полный JSON каждого показания.
+    Сообщение {"type": "subscribe", ...} включает фильтр устройств/метрик,
+    delta-кадры и формат msgpack (см. websocket_service).
     """
-    await websocket.accept()
-    storage.add_websocket(websocket)
+    client = await websocket_service.connect(websocket)
+    if client is None:
+        log.warning("⚠️ WebSocket отклонен: достигнут лимит клиентов", extra={"max_clients": websocket_service.max_clients})
+        return
     
-    client_id = id(websocket)
-    print(f"✅ WebSocket [{client_id}] подключен. Всего: {len(storage.active_websockets)}")
+    client_id = client.id
+    log.info("✅ WebSocket подключен", extra={"client": client_id, "clients": websocket_service.client_count()})
     
     try:
         # Отправляем текущие данные сразу
         if storage.current_data["timestamp"]:
-            await websocket.send_json(storage.current_data)
+            client.offer(encode_json(storage.current_data))
         
         # Держим соединение
         while True:
             try:
                 message = await websocket.receive_text()
                 if message == "ping":
-                    await websocket.send_text("pong")
+                    client.offer("pong")
+                    continue
+                reply = websocket_service.handle_message(client, message)
+                if reply is None:
+                    continue
+                client.offer(encode_json(reply))
+                # Сразу отдаем текущее состояние подписанных устройств
+                if reply.get("type") == "subscribed":
+                    for device_id, current in list(storage.current_by_device.items()):
+                        client.update(device_id, current)
             except WebSocketDisconnect:
                 break
                 
     except Exception as e:
-        print(f"❌ WebSocket [{client_id}] ошибка: {e}")
+        log.warning("❌ WebSocket ошибка: %s", e, extra={"client": client_id})
         
     finally:
-        storage.remove_websocket(websocket)
-        print(f"❌ WebSocket [{client_id}] отключен. Осталось: {len(storage.active_websockets)}")
+        await websocket_service.disconnect(client)
+        log.info("❌ WebSocket отключен", extra={"client": client_id, "clients": websocket_service.client_count()})
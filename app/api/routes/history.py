@@ -1,60 +1,233 @@
 """
 API маршруты для истории
 """
-from fastapi import APIRouter
+import asyncio
+import csv
+import io
+import json
+import time
+from datetime import datetime
+from typing import Iterator
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+from ..response_cache import response_cache, time_slot
+from ...core.constants import MAX_HISTORY_QUERY_LIMIT
+from ...core.profile_eval import CompiledProfile, evaluator_for, values_matrix
+from ...core.ring_buffer import make_row
+from ...core.rollups import SUPPORTED_AGGS, parse_duration
 from ...core.storage import storage
-from ...services.ai_service import ai_service
 
 router = APIRouter(prefix="/api", tags=["history"])
 
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+EXPORT_CSV_COLUMNS = (
+    "ts", "time", "device_id", "temp", "hum", "co2", "co", "lux",
+    "mc_score", "is_danger", "issues", "status", "profile",
+    "anomaly", "anomalies", "anomaly_score",
+)
+# Строк в одном куске ответа
+EXPORT_CHUNK_ROWS = 500
+
 
 @router.get("/history")
-async def get_history(limit: int = 50):
-    history_data = storage.get_history(limit)
-    profile = storage.active_profile  # активный профиль
+async def get_history(
+    request: Request,
+    limit: int = 50,
+    device_id: str | None = None,
+    from_: datetime | None = Query(None, alias="from"),
+    to: datetime | None = None,
+    bucket: str | None = None,
+    agg: str = "avg",
+):
+    """
+    История показаний устройства
 
-    enriched = []
-    for item in history_data:
-        # поддержка разных ключей (на всякий)
-        temp = float(item.get("temp", item.get("temperature", 0)))
-        hum = float(item.get("hum", item.get("humidity", 0)))
-        co2 = float(item.get("co2", item.get("co2_ppm", 0)))
-        co = float(item.get("co", item.get("co_ppm", 0)))
-        lux = float(item.get("lux", 0))
-
-        issues = []
-
-        if temp < profile["temp_min"] or temp > profile["temp_max"]:
-            issues.append("temperature")
-        if hum > profile["humidity_max"]:
-            issues.append("humidity")
-        if co2 > profile["co2_max"]:
-            issues.append("co2_ppm")
-        co_max = profile.get("co_max")
-        if co_max is not None and co > co_max:
-            issues.append("co_ppm")
-        if lux < profile["lux_min"] or lux > profile["lux_max"]:
-            issues.append("lux")
-
-        mc_score = ai_service.calculate_mc_score(
-            {
-                "temperature": temp,
-                "humidity": hum,
-                "co2_ppm": co2,
-                "co_ppm": co,
-                "lux": lux,
-                "timestamp": item.get("time") or item.get("timestamp") or "ok",
-            },
-            profile,
+    Args:
+        limit: Максимум строк (последние в диапазоне)
+        device_id: ID устройства (по умолчанию - последнее приславшее данные)
+        from: Начало диапазона (ISO 8601 или unix time)
+        to: Конец диапазона (ISO 8601 или unix time)
+        bucket: Размер бакета агрегатов ("1m", "15m", "1h", "1d"...);
+            truncated=true, если хранение уровня начинается позже from
+        agg: Агрегаты через запятую (min, max, avg, count)
+    """
+    limit = max(0, min(limit, MAX_HISTORY_QUERY_LIMIT))
+    version = storage.data_version(device_id)
+    key = f"history|{limit}|{device_id}|{from_}|{to}|{bucket}|{agg}"
+    if bucket is not None:
+        # Без "to" диапазон агрегатов сдвигается со временем
+        if to is None:
+            version += (time_slot(),)
+        return await response_cache.respond(
+            request, key, version, lambda: _get_rollups(limit, device_id, from_, to, bucket, agg)
         )
+    return await response_cache.respond(
+        request, key, version, lambda: _get_raw_history(limit, device_id, from_, to)
+    )
+
+
+@router.get("/history/export")
+async def export_history(
+    format: str = "ndjson",
+    device_id: str | None = None,
+    from_: datetime | None = Query(None, alias="from"),
+    to: datetime | None = None,
+):
+    """
+    Потоковая выгрузка истории за любой диапазон
+
+    Строки читаются из хранилища постранично и обогащаются (MC Score,
+    отклонения) на лету, поэтому память не зависит от длины диапазона.
+
+    Args:
+        format: ndjson или csv
+        device_id: ID устройства (по умолчанию - последнее приславшее данные)
+        from: Начало диапазона (ISO 8601 или unix time)
+        to: Конец диапазона (ISO 8601 или unix time)
+    """
+    if format not in EXPORT_FORMATS:
+        return {"error": "bad_format", "message": f"Поддерживаются: {', '.join(EXPORT_FORMATS)}"}
+    device_id = device_id or storage.current_data.get("device_id")
+    if device_id is None:
+        return {"error": "no_data"}
+    # Проверяем до начала потока: после него статус 200 уже отправлен.
+    # Буферы прогреваются всеми устройствами SQLite при старте
+    if device_id not in storage.devices:
+        return {"error": "no_data", "message": f"Нет данных устройства {device_id}"}
+
+    rows = _export_rows(
+        device_id,
+        from_.timestamp() if from_ else None,
+        to.timestamp() if to else None,
+    )
+    body = _export_csv(rows) if format == "csv" else _export_ndjson(rows)
+    # Синхронный генератор: Starlette читает его в пуле потоков, chunked transfer
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="history_{device_id}.{format}"'},
+    )
+
+
+def _export_rows(device_id: str, ts_from: float | None, ts_to: float | None) -> Iterator[dict]:
+    evaluator = evaluator_for(storage.active_profile)
+    chunk = []
+    for raw in storage.iter_history(device_id, ts_from, ts_to):
+        chunk.append(raw)
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield from _evaluated_rows(chunk, evaluator, device_id)
+            chunk = []
+    yield from _evaluated_rows(chunk, evaluator, device_id)
+
+
+def _evaluated_rows(chunk: list, evaluator: CompiledProfile, device_id: str) -> Iterator[dict]:
+    """Кусок сырых строк с оценкой нормы и MC Score (векторно)."""
+    if not chunk:
+        return
+    mask, score = evaluator.evaluate(values_matrix([raw[1:6] for raw in chunk]))
+    for raw, m, s in zip(chunk, mask.tolist(), score.tolist()):
+        row = make_row(*raw[:6], m, *raw[7:10], mc_score=s)
+        row["ts"] = raw[0]
+        row["device_id"] = device_id
+        yield row
+
+
+def _export_ndjson(rows: Iterator[dict]) -> Iterator[str]:
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(row, ensure_ascii=False))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+def _export_csv(rows: Iterator[dict]) -> Iterator[str]:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    n = 0
+    for row in rows:
+        row["issues"] = ";".join(row["issues"])
+        row["anomalies"] = ";".join(row["anomalies"])
+        writer.writerow([row[c] for c in EXPORT_CSV_COLUMNS])
+        n += 1
+        if n % EXPORT_CHUNK_ROWS == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+
+async def _get_raw_history(
+    limit: int,
+    device_id: str | None,
+    from_: datetime | None,
+    to: datetime | None,
+):
+    """Сырые показания с оценкой нормы и MC Score по активному профилю."""
+    # Запрос может уйти в SQLite - не блокируем event loop
+    # Оценка по активному профилю: из буфера - кэш на версию профиля,
+    # из SQLite - векторно по выборке
+    history_data = await asyncio.to_thread(
+        storage.query_history,
+        limit,
+        device_id,
+        from_.timestamp() if from_ else None,
+        to.timestamp() if to else None,
+        True,
+    )
+    profile = storage.active_profile  # активный профиль
+
+    return {"count": len(history_data), "profile": profile["name"], "data": history_data}
+
+
+def _get_rollups(
+    limit: int,
+    device_id: str | None,
+    from_: datetime | None,
+    to: datetime | None,
+    bucket: str,
+    agg: str,
+):
+    """История из агрегатов: сервер сам выбирает самый грубый подходящий уровень."""
+    try:
+        bucket_sec = parse_duration(bucket)
+    except ValueError:
+        return {"error": "bad_bucket", "message": f"Некорректный bucket: {bucket}"}
 
-        row = dict(item)
-        row["mc_score"] = mc_score
-        row["is_danger"] = len(issues) > 0
-        row["issues"] = issues
-        row["status"] = "out_of_range" if issues else "ok"
-        row["message"] = "Вне нормы" if issues else "Норма"
+    aggs = [a.strip() for a in agg.split(",") if a.strip()]
+    unknown = [a for a in aggs if a not in SUPPORTED_AGGS]
+    if unknown or not aggs:
+        return {
+            "error": "bad_agg",
+            "message": f"Поддерживаются: {', '.join(SUPPORTED_AGGS)}",
+        }
 
-        enriched.append(row)
+    device_id = device_id or storage.current_data.get("device_id")
+    ts_to = to.timestamp() if to else time.time()
+    ts_from = from_.timestamp() if from_ else ts_to - bucket_sec * max(1, limit)
 
-    return {"count": len(enriched), "profile": profile["name"], "data": enriched}
+    tier, rows, available_from = storage.rollups.query(
+        device_id, bucket_sec, ts_from, ts_to, aggs, now_ts=time.time()
+    )
+    if tier is None and device_id in storage.rollups.devices:
+        return {"error": "bad_bucket", "message": f"bucket должен быть кратен 1m: {bucket}"}
+    rows = rows[-limit:] if limit else []
+    # Уровень хранит меньше, чем запрошено: начало диапазона недоступно
+    truncated = available_from is not None and ts_from < available_from
+    return {
+        "count": len(rows),
+        "device_id": device_id,
+        "bucket": bucket,
+        "bucket_sec": bucket_sec,
+        "tier": tier,
+        "aggs": aggs,
+        "truncated": truncated,
+        "available_from": datetime.fromtimestamp(available_from).isoformat() if truncated else None,
+        "data": rows,
+    }
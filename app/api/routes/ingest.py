@@ -0,0 +1,68 @@
+"""
+API маршруты пакетной загрузки показаний
+"""
+import asyncio
+from fastapi import APIRouter, Request
+from ...core.constants import INGEST_MAX_BATCH_ROWS, INGEST_MAX_ERRORS
+from ...core.state_backend import state_backend
+from ...core.storage import CURRENT_FIELDS
+from ...services.ingest_service import BatchDecoder, BatchTooLarge, ingest_service
+from ...services.websocket_service import websocket_service
+
+router = APIRouter(prefix="/api/ingest", tags=["ingest"])
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def _format_of(content_type: str) -> str:
+    media = content_type.split(";", 1)[0].strip().lower()
+    return "msgpack" if media in MSGPACK_TYPES else "ndjson"
+
+
+@router.post("/batch")
+async def ingest_batch(request: Request, device_id: str | None = None):
+    """
+    Пакетная загрузка показаний шлюза (в т.ч. накопленных офлайн)
+
+    Тело - NDJSON (по показанию на строку) или msgpack (массив или поток
+    объектов, Content-Type: application/msgpack). Показание - объект
+    с метриками и необязательными device_id и ts (unix сек/мс или ISO 8601).
+
+    Args:
+        device_id: Устройство для показаний без device_id
+
+    Returns:
+        Итог пакета и ошибки по номерам строк (с 0)
+    """
+    decoder = BatchDecoder(_format_of(request.headers.get("content-type", "")), INGEST_MAX_BATCH_ROWS)
+    try:
+        async for chunk in request.stream():
+            decoder.feed(chunk)
+        decoder.close()
+    except BatchTooLarge as e:
+        return {"error": "batch_too_large", "message": str(e)}
+    except ValueError as e:
+        return {"error": "bad_payload", "message": str(e)}
+
+    errors = decoder.errors
+    readings = await asyncio.to_thread(ingest_service.validate, decoder.records, errors, device_id)
+    latest, backfilled = await asyncio.to_thread(ingest_service.apply, readings)
+    if readings:
+        # Остальные воркеры применяют пакет у себя (лидер - пишет в историю)
+        state_backend.publish({"type": "batch", "readings": readings})
+
+    # Одна рассылка на пакет: последнее состояние каждого устройства
+    for reading in latest.values():
+        await websocket_service.broadcast({k: reading[k] for k in CURRENT_FIELDS})
+
+    rows = sorted(errors)
+    return {
+        "status": "success" if not rows else ("partial" if readings else "error"),
+        "received": len(decoder.records),
+        "accepted": len(readings),
+        "rejected": len(rows),
+        "backfilled": backfilled,
+        "devices": sorted({r["device_id"] for r in readings}),
+        "errors": [{"row": i, "errors": errors[i]} for i in rows[:INGEST_MAX_ERRORS]],
+        "errors_truncated": len(rows) > INGEST_MAX_ERRORS,
+    }
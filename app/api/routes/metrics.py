@@ -0,0 +1,86 @@
+"""
+/metrics - метрики процесса в текстовом формате Prometheus
+"""
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ...core.event_bus import event_bus
+from ...core.metrics import metrics
+from ...core.storage import storage
+from ...services.push_dispatcher import push_dispatcher
+from ...services.websocket_service import websocket_service
+
+router = APIRouter(tags=["metrics"])
+
+# charset=utf-8 добавляет PlainTextResponse
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _websocket_metrics():
+    stats = websocket_service.stats()
+    yield "websocket_clients", "gauge", "Подключенные WebSocket клиенты", [({}, stats["clients"])]
+    yield "websocket_subscribed_clients", "gauge", "Клиенты с подпиской", [({}, stats["subscribed"])]
+    yield "websocket_queued_frames", "gauge", "Кадров в очередях клиентов", [({}, stats["queued_frames"])]
+    yield "websocket_max_lag_seconds", "gauge", "Наибольшее отставание клиента", [({}, stats["max_lag_sec"])]
+    yield "websocket_evicted_total", "counter", "Отключено медленных клиентов", [({}, stats["evicted"])]
+    yield "websocket_rejected_total", "counter", "Отклонено подключений (лимит)", [({}, stats["rejected"])]
+
+
+def _history_metrics():
+    buffers = list(storage.devices.items())
+    yield (
+        "history_buffer_points", "gauge", "Показаний в кольцевом буфере устройства",
+        [({"device_id": device_id}, len(buf)) for device_id, buf in buffers],
+    )
+    yield (
+        "history_buffer_capacity", "gauge", "Емкость кольцевого буфера устройства",
+        [({"device_id": device_id}, buf.capacity) for device_id, buf in buffers],
+    )
+    store = storage.history_store
+    if store is not None:
+        yield "history_db_written_total", "counter", "Записано в SQLite", [({}, store.written)]
+        yield "history_db_dropped_total", "counter", "Потеряно при переполнении очереди SQLite", [({}, store.dropped)]
+
+
+def _anomaly_metrics():
+    stats = storage.anomalies.stats()
+    yield (
+        "anomaly_flags_total", "counter", "Флагов аномалий по видам (метрика x показание)",
+        [({"kind": kind}, n) for kind, n in stats["flagged"].items()],
+    )
+
+
+def _pipeline_metrics():
+    consumers = event_bus.stats()["consumers"]
+    yield "event_bus_published_total", "counter", "Показаний опубликовано в шину", [({}, event_bus.published)]
+    for key, kind, documentation in (
+        ("depth", "gauge", "Глубина очереди потребителя"),
+        ("lag_sec", "gauge", "Возраст самого старого события в очереди, сек"),
+        ("processed", "counter", "Обработано событий"),
+        ("dropped", "counter", "Потеряно при переполнении"),
+        ("blocked", "counter", "Публикаций, ждавших место в очереди"),
+        ("blocked_sec", "counter", "Суммарное ожидание места публикацией, сек"),
+        ("errors", "counter", "Ошибок обработки"),
+    ):
+        name = "event_bus_" + key.replace("_sec", "_seconds")
+        if kind == "counter":
+            name += "_total"
+        yield name, kind, documentation, [({"consumer": c}, s[key]) for c, s in consumers.items()]
+
+    push = push_dispatcher.stats()
+    yield "push_queue_depth", "gauge", "Push в очереди диспетчера", [({}, push["queue_depth"])]
+    yield (
+        "push_jobs_total", "counter", "Итоги push по заданиям",
+        [({"outcome": k}, push[k]) for k in ("sent", "not_delivered", "failed", "expired", "dropped")],
+    )
+
+
+metrics.register_collector(_websocket_metrics)
+metrics.register_collector(_history_metrics)
+metrics.register_collector(_anomaly_metrics)
+metrics.register_collector(_pipeline_metrics)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
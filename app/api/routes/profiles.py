@@ -1,21 +1,28 @@
 """
 API маршруты для профилей
 """
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from ..response_cache import response_cache
 from ...core.storage import storage
 from ...core.constants import PROFILES
+from ...core.state_backend import state_backend
 from ...models.profile import Profile
 
 router = APIRouter(prefix="/api", tags=["profiles"])
 
 
 @router.get("/profiles")
-async def get_profiles():
-    """Получение всех профилей"""
-    return {
-        "presets": PROFILES,
-        "active": storage.active_profile
-    }
+async def get_profiles(request: Request):
+    """Получение всех профилей (ETag; 304, если профиль не менялся)"""
+    return await response_cache.respond(
+        request,
+        "profiles",
+        (storage.profile_version,),
+        lambda: {
+            "presets": PROFILES,
+            "active": storage.active_profile
+        },
+    )
 
 
 @router.post("/profile/update")
@@ -39,6 +46,8 @@ async def update_profile(profile: dict):
             }
     
     storage.update_profile(profile)
+    # Остальные воркеры применяют профиль у себя
+    state_backend.publish({"type": "profile", "profile": storage.active_profile})
     
     return {
         "status": "success",
@@ -1,8 +1,13 @@
+import asyncio
+
 from fastapi import APIRouter
 from pydantic import BaseModel
 
 from ...config import settings
+from ...core.token_store import token_store
 from ...services.firebase_service import firebase_service
+from ...services.alert_service import alert_service
+from ...services.push_dispatcher import push_dispatcher
 
 router = APIRouter(prefix="/api/push", tags=["push-notifications"])
 
@@ -27,7 +32,7 @@ class PushTestRequest(BaseModel):
 @router.post("/register")
 async def register_token(data: TokenRegister):
     user_id = settings.FCM_DEFAULT_USER_ID
-    total = firebase_service.register_token(user_id, data.token)
+    total = firebase_service.register_token(user_id, data.token, data.platform)
     return {"status": "registered", "user_id": user_id, "tokens": total, "platform": data.platform}
 
 
@@ -41,7 +46,9 @@ async def unregister_token(data: TokenUnregister):
 @router.post("/test")
 async def send_test_push(data: PushTestRequest):
     user_id = settings.FCM_DEFAULT_USER_ID
-    sent = firebase_service.send_push_to_user(
+    # Блокирующий вызов FCM - вне event loop
+    sent = await asyncio.to_thread(
+        firebase_service.send_push_to_user,
         user_id=user_id,
         title=data.title,
         body=data.body,
@@ -55,6 +62,9 @@ async def push_stats():
     user_id = settings.FCM_DEFAULT_USER_ID
     return {
         "users": firebase_service.get_users_count(),
+        "tokens": token_store.tokens_count(),
         "default_user_id": user_id,
         "default_user_tokens": firebase_service.get_tokens_count(user_id),
+        "dispatcher": push_dispatcher.stats(),
+        "alerts": alert_service.stats(),
     }
@@ -3,7 +3,7 @@
 Загрузка настроек из .env файла
 """
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -15,6 +15,15 @@ class Settings(BaseSettings):
     MQTT_USER: str
     MQTT_PASSWORD: str
     MQTT_TOPIC: str = "iot/microclimate/data"
+    # Несколько шаблонов (["iot/microclimate/+/data"]); пусто - только MQTT_TOPIC.
+    # device_id берется из уровня первого '+'
+    MQTT_TOPICS: List[str] = []
+    MQTT_QOS: int = 0
+    # Общая подписка $share/<group>/...: экземпляры backend делят поток сообщений
+    MQTT_SHARED_GROUP: Optional[str] = None
+    # Пусто - уникальный ID <prefix>-<host>-<pid>-<rand> на каждый процесс
+    MQTT_CLIENT_ID: Optional[str] = None
+    MQTT_CLIENT_ID_PREFIX: str = "backend_microclimate"
     
     # Server
     SERVER_HOST: str = "0.0.0.0"
@@ -25,12 +34,57 @@ class Settings(BaseSettings):
     APP_VERSION: str = "2.1.0"
     DEBUG: bool = True
 
+    # Несколько worker-процессов: STATE_BACKEND=shared
+    WEB_WORKERS: int = 1
+    STATE_BACKEND: str = "memory"  # memory | shared
+    STATE_LOCK_PATH: str = "app/data/leader.lock"
+    STATE_SOCKET_PATH: str = "app/data/state.sock"
+
+    # История (кольцевой буфер на каждое устройство): около 57 байт на запись,
+    # память растет по мере накопления записей (10 000 записей - ~570 КБ)
+    HISTORY_CAPACITY_PER_DEVICE: int = 10_000
+    HISTORY_CAPACITY_OVERRIDES: Dict[str, int] = {}  # JSON: {"esp32_lab": 50000}
+    # Окна /api/stats: число точек ("100") или длительность ("1h", "24h")
+    STATS_WINDOWS: List[str] = ["100", "1h", "24h"]
+    # Потоковые детекторы аномалий: сглаживание EWMA, пороги z-score и
+    # скачка, сколько одинаковых показаний подряд - залипание, прогрев
+    ANOMALY_ALPHA: float = 0.05
+    ANOMALY_Z_THRESHOLD: float = 4.0
+    ANOMALY_SPIKE_THRESHOLD: float = 6.0
+    ANOMALY_STUCK_COUNT: int = 30
+    ANOMALY_WARMUP: int = 20
+
+    # Постоянная история (SQLite WAL)
+    HISTORY_DB_ENABLED: bool = True
+    HISTORY_DB_PATH: str = "app/data/history.db"
+    HISTORY_DB_BATCH_SIZE: int = 200
+    HISTORY_DB_FLUSH_SEC: float = 1.0
+
     # Firebase / FCM
     FCM_ENABLED: bool = False
     FIREBASE_CREDENTIALS_PATH: Optional[str] = None
-    FCM_DANGER_REMINDER_SEC: int = 300
+    FCM_DANGER_REMINDER_SEC: int = 300  # cooldown каждого правила алерта
+    # Нарушение должно длиться не меньше (сек), чтобы сработал алерт
+    ALERT_DEBOUNCE_SEC: float = 10.0
     FCM_DEFAULT_USER_ID: str = "user_1"
+
+    # Очередь отправки push
+    PUSH_WORKERS: int = 2
+    PUSH_QUEUE_SIZE: int = 1000
+    PUSH_MAX_RETRIES: int = 3
+    PUSH_DEADLINE_SEC: float = 60.0
+    # Параллельные multicast-запросы FCM при рассылке
+    PUSH_FANOUT_WORKERS: int = 8
+    # Постоянный реестр FCM токенов
+    PUSH_TOKENS_DB_PATH: str = "app/data/push_tokens.db"
     
+    # Логирование: уровень, формат (text/json), очередь записи и
+    # прореживание строк показаний (не чаще раза в N сек на устройство, 0 - все)
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"
+    LOG_QUEUE_SIZE: int = 10_000
+    LOG_READING_INTERVAL_SEC: float = 60.0
+
     class Config:
         env_file = ".env"
         case_sensitive = True
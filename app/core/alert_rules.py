@@ -0,0 +1,229 @@
+"""
+Потоковый движок правил алертов
+
+Правила на каждое устройство и метрику: пороги профиля с гистерезисом,
+минимальная длительность нарушения (debounce), скорость роста (например,
+CO растет быстрее X ppm/мин) и собственный cooldown у каждого правила.
+Состояние устройства - заранее выделенные массивы, обновление на показание
+O(1) и без аллокаций (список срабатываний создается, только если что-то сработало).
+"""
+import math
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .ring_buffer import ISSUE_BITS
+
+# Индексы метрик в кортеже значений (temp, hum, co2, co, lux)
+METRIC_INDEX = {name: i for i, name in enumerate(ISSUE_BITS)}
+
+ABOVE = 1
+BELOW = -1
+
+# Каталог правил: (имя, метрика, направление, ключ порога профиля или None для скорости)
+RULE_CATALOG = (
+    ("temperature_high", "temperature", ABOVE, "temp_max"),
+    ("temperature_low", "temperature", BELOW, "temp_min"),
+    ("humidity_high", "humidity", ABOVE, "humidity_max"),
+    ("co2_high", "co2_ppm", ABOVE, "co2_max"),
+    ("co_high", "co_ppm", ABOVE, "co_max"),
+    ("lux_low", "lux", BELOW, "lux_min"),
+    ("lux_high", "lux", ABOVE, "lux_max"),
+    ("co_rising", "co_ppm", ABOVE, None),
+    ("co2_rising", "co2_ppm", ABOVE, None),
+)
+
+# Полоса гистерезиса (в единицах метрики): выход из нарушения - за порогом на эту величину
+DEFAULT_HYSTERESIS = {
+    "temperature": 0.5,
+    "humidity": 2.0,
+    "co2_ppm": 50.0,
+    "co_ppm": 2.0,
+    "lux": 20.0,
+}
+
+# Порог скорости роста, единиц в минуту
+DEFAULT_RATE_LIMITS = {
+    "co_ppm": 5.0,
+    "co2_ppm": 300.0,
+}
+# Гистерезис правил скорости - доля порога
+RATE_HYSTERESIS_RATIO = 0.25
+# Сглаживание мгновенной скорости (EWMA)
+RATE_ALPHA = 0.3
+
+
+class Rule(NamedTuple):
+    name: str
+    metric: str
+    column: int
+    direction: int
+    limit: float
+    hysteresis: float
+    debounce: float
+    cooldown: float
+    rate: bool
+
+
+def compile_rules(profile: Dict, debounce_sec: float, cooldown_sec: float) -> Tuple[Rule, ...]:
+    """
+    Правила из профиля. Необязательный раздел профиля "alerts" переопределяет
+    умолчания: {"debounce_sec", "cooldown_sec", "hysteresis": {...}, "rate": {...}}.
+    Правило без порога отключено (limit = inf).
+    """
+    overrides = profile.get("alerts") or {}
+    debounce = float(overrides.get("debounce_sec", debounce_sec))
+    cooldown = float(overrides.get("cooldown_sec", cooldown_sec))
+    hysteresis = {**DEFAULT_HYSTERESIS, **(overrides.get("hysteresis") or {})}
+    rates = {**DEFAULT_RATE_LIMITS, **(overrides.get("rate") or {})}
+
+    rules = []
+    for name, metric, direction, key in RULE_CATALOG:
+        if key is None:
+            limit = rates.get(metric)
+            band = abs(limit) * RATE_HYSTERESIS_RATIO if limit is not None else 0.0
+        else:
+            limit = profile.get(key)
+            band = float(hysteresis.get(metric, 0.0))
+        if limit is None:
+            limit = math.inf * direction
+        rules.append(Rule(
+            name, metric, METRIC_INDEX[metric], direction, float(limit),
+            band, debounce, cooldown, key is None,
+        ))
+    return tuple(rules)
+
+
+class DeviceAlertState:
+    """Состояние правил одного устройства (массивы по индексу правила)"""
+
+    __slots__ = ("last_ts", "active", "pending_since", "last_fired", "prev_value", "prev_ts", "rate")
+
+    def __init__(self, n_rules: int, n_metrics: int):
+        # Время последнего обработанного показания устройства
+        self.last_ts = -math.inf
+        self.active = array("b", [0]) * n_rules
+        self.pending_since = array("d", [math.nan]) * n_rules
+        self.last_fired = array("d", [-math.inf]) * n_rules
+        # Для правил скорости: предыдущее значение метрики и сглаженная скорость (ед./мин)
+        self.prev_value = array("d", [math.nan]) * n_metrics
+        self.prev_ts = array("d", [math.nan]) * n_metrics
+        self.rate = array("d", [0.0]) * n_metrics
+
+
+class AlertEngine:
+    """Правила для всех устройств; вызывается из одного потока (потребитель alerts)"""
+
+    def __init__(self, debounce_sec: float = 0.0, cooldown_sec: float = 0.0):
+        self.debounce_sec = debounce_sec
+        self.cooldown_sec = cooldown_sec
+        self.rules: Tuple[Rule, ...] = ()
+        self._rate_columns: Tuple[int, ...] = ()
+        self._version: Optional[int] = None
+        self._states: Dict[str, DeviceAlertState] = {}
+
+        self.evaluated = 0
+        self.fired = 0
+        self.suppressed = 0
+        # Показания не новее уже обработанного (запоздавшие, догрузка)
+        self.stale = 0
+
+    def set_profile(self, profile: Dict, version: int) -> None:
+        """Перекомпилирует правила при смене версии профиля (состояние сохраняется)."""
+        if version == self._version:
+            return
+        self.rules = compile_rules(profile, self.debounce_sec, self.cooldown_sec)
+        self._rate_columns = tuple(sorted({r.column for r in self.rules if r.rate}))
+        self._version = version
+
+    def _state(self, device_id: str) -> DeviceAlertState:
+        state = self._states.get(device_id)
+        if state is None:
+            state = DeviceAlertState(len(RULE_CATALOG), len(METRIC_INDEX))
+            self._states[device_id] = state
+        return state
+
+    def process(self, device_id: str, ts: float, values: Tuple[float, ...]) -> Optional[List[Rule]]:
+        """
+        Обновляет состояние правил устройства показанием.
+
+        Показание не новее последнего обработанного пропускается: debounce,
+        cooldown и скорость считаются по времени показаний.
+
+        Returns:
+            Сработавшие правила (вход в нарушение или напоминание) или None
+        """
+        state = self._state(device_id)
+        if ts <= state.last_ts:
+            self.stale += 1
+            return None
+        state.last_ts = ts
+        self.evaluated += 1
+
+        for c in self._rate_columns:
+            prev_ts = state.prev_ts[c]
+            v = values[c]
+            if prev_ts == prev_ts and ts > prev_ts:  # не NaN
+                inst = (v - state.prev_value[c]) * 60.0 / (ts - prev_ts)
+                state.rate[c] += RATE_ALPHA * (inst - state.rate[c])
+            state.prev_value[c] = v
+            state.prev_ts[c] = ts
+
+        fired = None
+        active = state.active
+        pending = state.pending_since
+        last_fired = state.last_fired
+        for r, rule in enumerate(self.rules):
+            v = state.rate[rule.column] if rule.rate else values[rule.column]
+            if rule.direction == ABOVE:
+                breach = v > rule.limit
+                clear = v < rule.limit - rule.hysteresis
+            else:
+                breach = v < rule.limit
+                clear = v > rule.limit + rule.hysteresis
+
+            if not active[r]:
+                if not breach:
+                    pending[r] = math.nan
+                    continue
+                if pending[r] != pending[r]:
+                    pending[r] = ts
+                if ts - pending[r] < rule.debounce:
+                    continue
+                active[r] = 1
+                pending[r] = math.nan
+            elif clear:
+                active[r] = 0
+                continue
+
+            # Нарушение активно: вход или напоминание - не чаще cooldown
+            if ts - last_fired[r] < rule.cooldown:
+                self.suppressed += 1
+                continue
+            last_fired[r] = ts
+            if fired is None:
+                fired = []
+            fired.append(rule)
+
+        if fired:
+            self.fired += len(fired)
+        return fired
+
+    def active_rules(self, device_id: str) -> List[str]:
+        state = self._states.get(device_id)
+        if state is None:
+            return []
+        return [rule.name for r, rule in enumerate(self.rules) if state.active[r]]
+
+    def rate_of(self, device_id: str, metric: str) -> float:
+        state = self._states.get(device_id)
+        return state.rate[METRIC_INDEX[metric]] if state is not None else 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "devices": len(self._states),
+            "rules": [rule.name for rule in self.rules],
+            "evaluated": self.evaluated,
+            "fired": self.fired,
+            "suppressed": self.suppressed,
+            "stale": self.stale,
+        }
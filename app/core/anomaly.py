@@ -0,0 +1,135 @@
+"""
+Потоковое обнаружение аномалий датчиков (внутри допустимого диапазона)
+
+На каждое устройство и метрику - несколько чисел, обновление O(1) без
+пересмотра истории:
+- zscore: отклонение от экспоненциального среднего (EWMA) в единицах
+  экспоненциального стандартного отклонения - дрейф и выбросы;
+- spike: скачок между соседними показаниями намного больше обычного шага;
+- stuck: одно и то же ненулевое значение много показаний подряд
+  (ноль - нормальное состояние для освещенности ночью и CO).
+Оценка точки делается до ее добавления в среднее, поэтому выброс не
+маскирует сам себя. Первые warmup показаний устройства не оцениваются.
+"""
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .ring_buffer import ANOMALY_KINDS, anomaly_bit
+
+_ZSCORE, _SPIKE, _STUCK = (ANOMALY_KINDS.index(k) for k in ("zscore", "spike", "stuck"))
+
+# Шум датчика: нижняя граница std (temp, hum, co2, co, lux), чтобы после
+# долгого ровного участка мелкое колебание не давало огромный z
+NOISE_FLOOR = (0.05, 0.2, 5.0, 0.5, 2.0)
+
+
+class DeviceDetector:
+    """Состояние детекторов одного устройства по пяти метрикам"""
+
+    __slots__ = ("n", "last_ts", "mean", "var", "step_var", "prev", "stuck")
+
+    def __init__(self):
+        k = len(NOISE_FLOOR)
+        self.n = 0
+        self.last_ts: Optional[float] = None
+        self.mean = [0.0] * k
+        self.var = [0.0] * k
+        # EWMA квадрата шага между соседними показаниями
+        self.step_var = [0.0] * k
+        self.prev = [0.0] * k
+        self.stuck = [0] * k
+
+
+class AnomalyStore:
+    """Детекторы аномалий по всем устройствам"""
+
+    def __init__(
+        self,
+        alpha: float = 0.05,
+        z_threshold: float = 4.0,
+        spike_threshold: float = 6.0,
+        stuck_count: int = 30,
+        warmup: int = 20,
+    ):
+        self.alpha = min(1.0, max(1e-4, float(alpha)))
+        self.z_threshold = z_threshold
+        self.spike_threshold = spike_threshold
+        self.stuck_count = max(2, int(stuck_count))
+        self.warmup = max(1, int(warmup))
+        self.devices: Dict[str, DeviceDetector] = {}
+        # Счетчики сработавших флагов по видам
+        self.flagged: List[int] = [0] * len(ANOMALY_KINDS)
+        # update() вызывается из потока paho и из event loop (пакетный прием)
+        self._lock = threading.Lock()
+
+    def update(self, device_id: str, ts: float, values: Tuple[float, ...]) -> Tuple[int, float]:
+        """
+        Оценивает показание и добавляет его в статистику устройства.
+
+        Показание не новее последнего (догрузка истории) не оценивается.
+
+        Returns:
+            (маска аномалий, наибольший |z| по метрикам)
+        """
+        with self._lock:
+            det = self.devices.get(device_id)
+            if det is None:
+                det = DeviceDetector()
+                self.devices[device_id] = det
+            if det.last_ts is not None and ts <= det.last_ts:
+                return 0, 0.0
+            det.last_ts = ts
+            det.n += 1
+            if det.n == 1:
+                det.mean[:] = values
+                det.prev[:] = values
+                return 0, 0.0
+
+            alpha = self.alpha
+            warm = det.n > self.warmup
+            mask = 0
+            score = 0.0
+            for k, x in enumerate(values):
+                floor = NOISE_FLOOR[k]
+                mean = det.mean[k]
+                step = x - det.prev[k]
+                z = (x - mean) / max(math.sqrt(det.var[k]), floor)
+
+                if step == 0.0 and x != 0.0:
+                    det.stuck[k] += 1
+                else:
+                    det.stuck[k] = 0
+
+                if warm:
+                    score = max(score, abs(z))
+                    if abs(z) >= self.z_threshold:
+                        mask |= anomaly_bit(k, _ZSCORE)
+                        self.flagged[_ZSCORE] += 1
+                    if abs(step) / max(math.sqrt(det.step_var[k]), floor) >= self.spike_threshold:
+                        mask |= anomaly_bit(k, _SPIKE)
+                        self.flagged[_SPIKE] += 1
+                    if det.stuck[k] + 1 >= self.stuck_count:
+                        mask |= anomaly_bit(k, _STUCK)
+                        self.flagged[_STUCK] += 1
+
+                # Экспоненциальные среднее и дисперсия (Finch, 2009)
+                d = x - mean
+                inc = alpha * d
+                det.mean[k] = mean + inc
+                det.var[k] = (1.0 - alpha) * (det.var[k] + d * inc)
+                det.step_var[k] = (1.0 - alpha) * det.step_var[k] + alpha * step * step
+                det.prev[k] = x
+            return mask, score
+
+    @property
+    def history_needed(self) -> int:
+        """Сколько последних показаний нужно для прогрева (вес более старых < e^-5)."""
+        return max(self.warmup, int(5 / self.alpha)) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "devices": len(self.devices),
+                "flagged": dict(zip(ANOMALY_KINDS, self.flagged)),
+            }
@@ -57,5 +57,23 @@ PROFILES = [
 ]
 
 # Лимиты
-MAX_HISTORY_SIZE = 100
+MAX_HISTORY_SIZE = 100              # окно последних точек для AI прогноза
+MAX_HISTORY_QUERY_LIMIT = 10_000    # максимум строк в одном ответе /api/history
+DEFAULT_DEVICE_ID = "esp32_main"
 MAX_WEBSOCKET_CLIENTS = 100
+WS_CLIENT_QUEUE_SIZE = 32           # кадров в очереди одного WebSocket клиента
+WS_SLOW_CLIENT_LAG_SEC = 10.0       # отключать клиента, отстающего дольше
+WS_MIN_RATE_HZ = 0.2                # допустимый диапазон max_rate клиента
+WS_MAX_RATE_HZ = 50.0
+INGEST_MAX_BATCH_ROWS = 100_000     # максимум показаний в одном /api/ingest/batch
+INGEST_MAX_ERRORS = 1000            # сколько ошибок строк возвращать в ответе
+INGEST_MAX_FUTURE_SEC = 300         # допустимое опережение часов устройства
+
+# Физически допустимые значения показаний (проверка пакетной загрузки)
+METRIC_LIMITS = {
+    "temperature": (-60.0, 125.0),
+    "humidity": (0.0, 100.0),
+    "co2_ppm": (0.0, 100_000.0),
+    "co_ppm": (0.0, 10_000.0),
+    "lux": (0.0, 200_000.0),
+}
@@ -0,0 +1,217 @@
+"""
+Внутренняя шина событий для пути приема данных
+
+Каждый потребитель читает из собственной ограниченной очереди в своем
+потоке. При полной очереди потребителя с политикой block публикация ждет
+место (обратное давление на прием, счетчики blocked): без ограничения -
+только хранилище в памяти, остальные (история, алерты, репликация) - не
+дольше block_timeout, после чего событие отбрасывается и считается в
+dropped. Рассылке клиентам достаточно последней точки (coalesce).
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+from .log import get_logger
+
+log = get_logger("event_bus")
+
+# Политики переполнения очереди потребителя
+DROP_OLDEST = "drop_oldest"   # вытеснить самое старое событие
+BLOCK = "block"               # подождать место (не дольше block_timeout, None - без потерь), затем отбросить новое
+COALESCE = "coalesce"         # хранить только последнее событие на ключ (например device_id)
+
+POLICIES = (DROP_OLDEST, BLOCK, COALESCE)
+
+
+class Consumer:
+    """Потребитель шины с ограниченной очередью и рабочим потоком"""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Dict], None],
+        maxsize: int = 1000,
+        policy: str = DROP_OLDEST,
+        key: Optional[Callable[[Dict], object]] = None,
+        block_timeout: Optional[float] = 0.05,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Неизвестная политика очереди: {policy}")
+        if policy == COALESCE and key is None:
+            raise ValueError("Для coalesce нужна функция key")
+        self.name = name
+        self.handler = handler
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.key = key
+        self.block_timeout = block_timeout
+
+        self._cond = threading.Condition()
+        # Элементы: (время постановки, событие)
+        self._queue: deque = deque()
+        self._pending: "OrderedDict[object, tuple]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        # Сколько раз публикация ждала место (block) и сколько всего ждала
+        self.blocked = 0
+        self.blocked_sec = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def __len__(self) -> int:
+        return len(self._pending) if self.policy == COALESCE else len(self._queue)
+
+    def put(self, event: Dict) -> None:
+        now = time.monotonic()
+        with self._cond:
+            if self.policy == COALESCE:
+                k = self.key(event)
+                prev = self._pending.get(k)
+                if prev is not None:
+                    # Последнее значение побеждает, позиция и время постановки сохраняются
+                    self._pending[k] = (prev[0], event)
+                    self.coalesced += 1
+                else:
+                    if len(self._pending) >= self.maxsize:
+                        self._pending.popitem(last=False)
+                        self.dropped += 1
+                    self._pending[k] = (now, event)
+            else:
+                if len(self._queue) >= self.maxsize:
+                    if self.policy == BLOCK:
+                        self.blocked += 1
+                        # Остановленный потребитель очередь не разберет - не ждем
+                        self._cond.wait_for(
+                            lambda: len(self._queue) < self.maxsize or not self._running,
+                            self.block_timeout,
+                        )
+                        self.blocked_sec += time.monotonic() - now
+                    if len(self._queue) >= self.maxsize:
+                        if self.policy == BLOCK:
+                            self.dropped += 1
+                            return
+                        self._queue.popleft()
+                        self.dropped += 1
+                self._queue.append((now, event))
+            self._cond.notify_all()
+
+    def _take(self) -> Optional[tuple]:
+        if self.policy == COALESCE:
+            if self._pending:
+                return self._pending.popitem(last=False)[1]
+            return None
+        if self._queue:
+            return self._queue.popleft()
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                item = self._take()
+                while item is None:
+                    if not self._running:
+                        return
+                    self._cond.wait()
+                    item = self._take()
+                # Освободилось место - будим ждущих в put() (политика block)
+                self._cond.notify_all()
+
+            enqueued_at, event = item
+            lag = time.monotonic() - enqueued_at
+            self.last_lag = lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+            try:
+                self.handler(event)
+            except Exception as e:
+                self.errors += 1
+                log.error("❌ Ошибка потребителя: %s", e, extra={"consumer": self.name}, exc_info=True)
+            self.processed += 1
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"bus-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Дорабатывает очередь и останавливает поток."""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def stats(self) -> Dict:
+        with self._cond:
+            depth = len(self)
+            if self.policy == COALESCE:
+                oldest = next(iter(self._pending.values()))[0] if self._pending else None
+            else:
+                oldest = self._queue[0][0] if self._queue else None
+        return {
+            "policy": self.policy,
+            "depth": depth,
+            "maxsize": self.maxsize,
+            "lag_sec": round(time.monotonic() - oldest, 4) if oldest is not None else 0.0,
+            "last_lag_sec": round(self.last_lag, 4),
+            "max_lag_sec": round(self.max_lag, 4),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "blocked": self.blocked,
+            "blocked_sec": round(self.blocked_sec, 4),
+            "errors": self.errors,
+        }
+
+
+class EventBus:
+    """Шина: publish() раздает событие в очереди всех потребителей"""
+
+    def __init__(self):
+        self._consumers: List[Consumer] = []
+        self.published = 0
+
+    def subscribe(self, consumer: Consumer) -> Consumer:
+        self._consumers.append(consumer)
+        return consumer
+
+    def consumer(self, name: str) -> Optional[Consumer]:
+        for c in self._consumers:
+            if c.name == name:
+                return c
+        return None
+
+    def publish(self, event: Dict) -> None:
+        """Не блокирует, пока у потребителей с политикой block есть место в очереди."""
+        self.published += 1
+        for c in self._consumers:
+            c.put(event)
+
+    def start(self) -> None:
+        for c in self._consumers:
+            c.start()
+
+    def stop(self) -> None:
+        for c in self._consumers:
+            c.stop()
+
+    def stats(self) -> Dict:
+        return {
+            "published": self.published,
+            "consumers": {c.name: c.stats() for c in self._consumers},
+        }
+
+
+# Глобальная шина событий показаний
+event_bus = EventBus()
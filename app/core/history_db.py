@@ -0,0 +1,276 @@
+"""
+Постоянное хранилище истории на SQLite (WAL)
+
+Запись идет через ограниченную очередь и отдельный поток-писатель
+пачками, поэтому ни event loop, ни поток paho не ждут диск.
+"""
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..config import settings
+from .log import get_logger
+from .ring_buffer import METRIC_COLUMNS, make_row
+
+log = get_logger("history_db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    device_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    temp REAL NOT NULL,
+    hum REAL NOT NULL,
+    co2 REAL NOT NULL,
+    co REAL NOT NULL,
+    lux REAL NOT NULL,
+    issues INTEGER NOT NULL,
+    profile TEXT,
+    anomaly INTEGER NOT NULL DEFAULT 0,
+    anomaly_score REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_readings_device_ts ON readings (device_id, ts);
+"""
+
+# Колонки, добавленные после первой версии схемы: (имя, определение)
+_MIGRATIONS = (
+    ("anomaly", "INTEGER NOT NULL DEFAULT 0"),
+    ("anomaly_score", "REAL NOT NULL DEFAULT 0"),
+)
+
+_INSERT = (
+    "INSERT INTO readings (device_id, ts, temp, hum, co2, co, lux, issues, profile, anomaly, anomaly_score) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+_COLUMNS = "ts, temp, hum, co2, co, lux, issues, profile, anomaly, anomaly_score"
+
+# (device_id, ts, temp, hum, co2, co, lux, issues_mask, profile, anomaly_mask, anomaly_score)
+Record = Tuple[str, float, float, float, float, float, float, int, Optional[str], int, float]
+
+_STOP = object()
+
+
+class HistoryStore:
+    """SQLite хранилище показаний с пакетной фоновой записью"""
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        queue_size: int = 50_000,
+    ):
+        self.path = Path(path)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.05, float(flush_interval))
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._read_lock = threading.Lock()
+        self._read_conn: Optional[sqlite3.Connection] = None
+        self.dropped = 0
+        self.written = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self, writer: bool = True) -> bool:
+        """
+        Создает схему и открывает соединение для чтения.
+
+        writer=False - только чтение (воркер, который не пишет историю);
+        повторный вызов с writer=True запускает поток-писатель.
+        """
+        if self.running:
+            return True
+        if self._read_conn is None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                conn = self._connect()
+                conn.executescript(_SCHEMA)
+                self._migrate(conn)
+                conn.commit()
+                conn.close()
+                self._read_conn = self._connect()
+            except Exception as e:
+                log.error("❌ Ошибка инициализации истории SQLite: %s", e)
+                return False
+
+        if writer:
+            self._thread = threading.Thread(target=self._writer, name="history-writer", daemon=True)
+            self._thread.start()
+        return True
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        """Добавляет недостающие колонки в таблицу из старой версии."""
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(readings)")}
+        for name, definition in _MIGRATIONS:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE readings ADD COLUMN {name} {definition}")
+
+    def stop(self) -> None:
+        """Дописывает очередь и останавливает поток."""
+        if self.running:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=10)
+            self._thread = None
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
+
+    def append(self, record: Record, wait: bool = False) -> None:
+        """
+        Ставит запись в очередь.
+
+        По умолчанию не блокирует: при полной очереди запись отбрасывается
+        и считается в dropped. wait=True - ждать место, пока писатель
+        работает (поток потребителя persistence, а не поток приема).
+        """
+        if not self.running:
+            return
+        if not wait:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+            return
+        while self.running:
+            try:
+                self._queue.put(record, timeout=self.flush_interval)
+                return
+            except queue.Full:
+                continue
+        self.dropped += 1
+
+    def _writer(self) -> None:
+        conn = self._connect()
+        batch: List[Record] = []
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                    # Добираем все, что уже лежит в очереди, до размера пачки
+                    while len(batch) < self.batch_size:
+                        item = self._queue.get_nowait()
+                        if item is _STOP:
+                            stopping = True
+                            break
+                        batch.append(item)
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    conn.executemany(_INSERT, batch)
+                    conn.commit()
+                    self.written += len(batch)
+                except Exception as e:
+                    log.error("❌ Ошибка записи истории SQLite: %s", e, extra={"batch": len(batch)})
+                batch = []
+        conn.close()
+
+    def _fetch(self, sql: str, params: Iterable) -> List[tuple]:
+        with self._read_lock:
+            if self._read_conn is None:
+                return []
+            return self._read_conn.execute(sql, tuple(params)).fetchall()
+
+    def query(
+        self,
+        device_id: str,
+        ts_from: Optional[float] = None,
+        ts_to: Optional[float] = None,
+        limit: int = 50,
+    ) -> List[Dict]:
+        """Последние `limit` записей устройства в диапазоне [ts_from, ts_to] по возрастанию времени."""
+        rows = self._fetch(
+            f"SELECT {_COLUMNS} FROM readings "
+            "WHERE device_id = ? AND ts >= ? AND ts <= ? "
+            "ORDER BY ts DESC LIMIT ?",
+            (
+                device_id,
+                ts_from if ts_from is not None else float("-inf"),
+                ts_to if ts_to is not None else float("inf"),
+                max(0, int(limit)),
+            ),
+        )
+        rows.reverse()
+        return [make_row(*r) for r in rows]
+
+    def iter_range(
+        self,
+        device_id: str,
+        ts_from: Optional[float] = None,
+        ts_to: Optional[float] = None,
+        page_size: int = 1000,
+    ) -> Iterator[tuple]:
+        """
+        Все записи устройства в диапазоне по возрастанию времени, кортежами.
+
+        Читает страницами по (ts, rowid), поэтому память постоянна, а
+        соединение для чтения не занято между страницами.
+        """
+        last_ts = ts_from if ts_from is not None else float("-inf")
+        last_rowid = -1
+        ts_to = ts_to if ts_to is not None else float("inf")
+        while True:
+            page = self._fetch(
+                f"SELECT rowid, {_COLUMNS} FROM readings "
+                "WHERE device_id = ? AND ts <= ? AND (ts > ? OR (ts = ? AND rowid > ?)) "
+                "ORDER BY ts, rowid LIMIT ?",
+                (device_id, ts_to, last_ts, last_ts, last_rowid, page_size),
+            )
+            for row in page:
+                yield row[1:]
+            if len(page) < page_size:
+                return
+            last_rowid, last_ts = page[-1][0], page[-1][1]
+
+    def aggregate(
+        self, device_id: str, bucket_sec: int, ts_from: float
+    ) -> List[Tuple[int, int, Dict[str, Tuple[float, float, float]]]]:
+        """min/max/sum по бакетам `bucket_sec` начиная с ts_from (для восстановления rollups)."""
+        select = ", ".join(f"MIN({m}), MAX({m}), SUM({m})" for m in METRIC_COLUMNS)
+        rows = self._fetch(
+            f"SELECT CAST(ts / ? AS INTEGER) AS b, COUNT(*), {select} FROM readings "
+            "WHERE device_id = ? AND ts >= ? GROUP BY b ORDER BY b",
+            (bucket_sec, device_id, ts_from),
+        )
+        result = []
+        for row in rows:
+            stats = {m: tuple(row[2 + 3 * k:5 + 3 * k]) for k, m in enumerate(METRIC_COLUMNS)}
+            result.append((row[0], row[1], stats))
+        return result
+
+    def device_ids(self) -> List[str]:
+        return [r[0] for r in self._fetch("SELECT DISTINCT device_id FROM readings", ())]
+
+    def recent_raw(self, device_id: str, limit: int) -> List[tuple]:
+        """Последние записи устройства кортежами (для прогрева буферов при старте)."""
+        rows = self._fetch(
+            f"SELECT {_COLUMNS} FROM readings WHERE device_id = ? ORDER BY ts DESC LIMIT ?",
+            (device_id, max(0, int(limit))),
+        )
+        rows.reverse()
+        return rows
+
+
+history_store = HistoryStore(
+    settings.HISTORY_DB_PATH,
+    batch_size=settings.HISTORY_DB_BATCH_SIZE,
+    flush_interval=settings.HISTORY_DB_FLUSH_SEC,
+)
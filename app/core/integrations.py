@@ -0,0 +1,76 @@
+"""
+Необязательные интеграции с отложенной загрузкой
+
+Тяжелые библиотеки (firebase_admin тянет grpc и клиенты Google Cloud)
+импортируются при первом обращении и только если интеграция включена в
+настройках. Процесс с выключенной интеграцией их не загружает вовсе.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class Integration:
+    """Интеграция: флаг включения и загрузчик модулей"""
+
+    def __init__(self, name: str, enabled: Callable[[], bool], loader: Callable[[], Any]):
+        self.name = name
+        self._enabled = enabled
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._module: Any = None
+        self.load_sec: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._enabled())
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def get(self) -> Any:
+        """Загруженная интеграция или None (выключена или не импортируется)."""
+        if self._module is not None:
+            return self._module
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._module is None and self.error is None:
+                started = time.perf_counter()
+                try:
+                    self._module = self._loader()
+                except ImportError as e:
+                    self.error = str(e)
+                self.load_sec = time.perf_counter() - started
+        return self._module
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "loaded": self.loaded,
+            "load_sec": round(self.load_sec, 4) if self.load_sec is not None else None,
+            "error": self.error,
+        }
+
+
+class IntegrationRegistry:
+    def __init__(self):
+        self._items: Dict[str, Integration] = {}
+
+    def register(self, name: str, enabled: Callable[[], bool], loader: Callable[[], Any]) -> Integration:
+        integration = Integration(name, enabled, loader)
+        self._items[name] = integration
+        return integration
+
+    def get(self, name: str) -> Any:
+        integration = self._items.get(name)
+        return integration.get() if integration is not None else None
+
+    def stats(self) -> Dict:
+        return {name: item.stats() for name, item in self._items.items()}
+
+
+# Глобальный реестр интеграций
+integrations = IntegrationRegistry()
@@ -0,0 +1,180 @@
+"""
+Структурированное логирование через очередь
+
+Вызывающий поток (сетевой поток paho, потребители шины, event loop) только
+кладет запись в ограниченную очередь - без форматирования и записи в stdout;
+пишет отдельный поток QueueListener. При переполнении очереди запись
+отбрасывается и считается, поток приема никогда не ждет лог.
+
+Рутинные строки (показание каждого устройства) прореживаются DeviceSampler:
+не чаще одной строки на устройство за интервал, в строке - сколько пропущено.
+"""
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, TextIO
+
+from ..config import settings
+
+ROOT_LOGGER = "app"
+LOG_FORMATS = ("text", "json")
+
+# Атрибуты LogRecord, которые не являются полями события
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Логгер модуля в иерархии приложения (app.<name>)."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def _fields(record: logging.LogRecord) -> Dict:
+    return {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS}
+
+
+def _exc_text(formatter: logging.Formatter, record: logging.LogRecord) -> Optional[str]:
+    # Исключение форматируется в потоке записи; exc_text - если запись
+    # уже отформатирована другим обработчиком
+    if record.exc_info:
+        return formatter.formatException(record.exc_info)
+    return record.exc_text
+
+
+class TextFormatter(logging.Formatter):
+    """Время, уровень, логгер, сообщение и поля key=value"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        stamp = datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds")
+        line = f"{stamp} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        fields = _fields(record)
+        if fields:
+            line += " | " + " ".join(f"{k}={v}" for k, v in fields.items())
+        exc = _exc_text(self, record)
+        if exc:
+            line += "\n" + exc
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_fields(record),
+        }
+        exc = _exc_text(self, record)
+        if exc:
+            event["exc"] = exc
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Кладет запись в очередь без ожидания; при переполнении - отбрасывает"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Запись уходит в очередь как есть: msg % args и трассировку исключения
+        # собирает поток записи. Аргументы логов приложения - неизменяемые
+        # значения (числа, строки, исключения), их можно отформатировать позже
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DeviceSampler:
+    """Не чаще одной записи на ключ (устройство) за interval секунд"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last: Dict[str, float] = {}
+        self._skipped: Dict[str, int] = {}
+        self.sampled_out = 0
+
+    def allow(self, key: str) -> Optional[int]:
+        """
+        Returns:
+            None - запись пропустить; иначе число пропущенных с прошлой записи
+        """
+        if self.interval <= 0:
+            return 0
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < self.interval:
+            self._skipped[key] = self._skipped.get(key, 0) + 1
+            self.sampled_out += 1
+            return None
+        self._last[key] = now
+        return self._skipped.pop(key, 0)
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(
+    level: Optional[str] = None,
+    fmt: Optional[str] = None,
+    stream: Optional[TextIO] = None,
+) -> None:
+    """Подключает очередь и поток записи к логгеру приложения (один раз)."""
+    global _handler, _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        fmt = (fmt or settings.LOG_FORMAT).lower()
+        if fmt not in LOG_FORMATS:
+            fmt = "text"
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+        _handler = DroppingQueueHandler(queue.Queue(maxsize=max(1, settings.LOG_QUEUE_SIZE)))
+        _listener = QueueListener(_handler.queue, output, respect_handler_level=False)
+        _listener.start()
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel((level or settings.LOG_LEVEL).upper())
+        root.addHandler(_handler)
+        # Не дублировать записи в корневой логгер Python (uvicorn и др.)
+        root.propagate = False
+
+
+def shutdown_logging() -> None:
+    """Дописывает очередь и останавливает поток записи."""
+    global _handler, _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+        _listener = None
+        _handler = None
+
+
+def log_stats() -> Dict:
+    return {
+        "level": logging.getLevelName(logging.getLogger(ROOT_LOGGER).getEffectiveLevel()),
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+        "readings_sampled_out": reading_sampler.sampled_out,
+    }
+
+
+# Прореживание строк "показание получено" по устройствам
+reading_sampler = DeviceSampler(settings.LOG_READING_INTERVAL_SEC)
@@ -0,0 +1,277 @@
+"""
+Метрики в текстовом формате Prometheus (без внешних зависимостей)
+
+Счетчики и гистограммы обновляются на горячем пути (прием MQTT, рассылка
+WebSocket, отправка FCM), поэтому обновление - это поиск корзины и пара
+сложений под коротким локом. Значения, которые и так есть в сервисах
+(клиенты, размеры буферов, очереди), считаются только при запросе /metrics
+через коллекторы. Метрики локальны для процесса (воркера).
+"""
+import asyncio
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Корзины по умолчанию (сек): от 10 мкс до 10 с
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# Период замера лага event loop
+LOOP_LAG_PROBE_SEC = 0.5
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if v == -math.inf:
+        return "-Inf"
+    if v != v:
+        return "NaN"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = "untyped"
+    suffix = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+
+    def labels(self, *values) -> "_Metric":
+        """Дочерняя серия с метками (кэшируется - на горячем пути только поиск в dict)."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}")
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._new_child()
+                    self._children[key] = child
+        return child
+
+    def _new_child(self) -> "_Metric":
+        return type(self)(self.name, self.documentation)
+
+    def _series(self) -> Iterable[Tuple[Dict[str, str], "_Metric"]]:
+        if self.labelnames:
+            for key, child in list(self._children.items()):
+                yield dict(zip(self.labelnames, key)), child
+        else:
+            yield {}, self
+
+    def samples(self) -> List[Sample]:
+        out: List[Sample] = []
+        for labels, child in self._series():
+            out.extend(child._own_samples(labels))
+        return out
+
+    def _own_samples(self, labels: Dict[str, str]) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонный счетчик (серия - с суффиксом _total)"""
+
+    kind = "counter"
+    suffix = "_total"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def _own_samples(self, labels: Dict[str, str]) -> List[Sample]:
+        return [(self.name + "_total", labels, self._value)]
+
+
+class Gauge(_Metric):
+    """Текущее значение"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = float(value)
+
+    def _own_samples(self, labels: Dict[str, str]) -> List[Sample]:
+        return [(self.name, labels, self._value)]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Последняя корзина - +Inf
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def _own_samples(self, labels: Dict[str, str]) -> List[Sample]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        out: List[Sample] = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            cumulative += n
+            out.append((self.name + "_bucket", {**labels, "le": _value(bound)}, cumulative))
+        out.append((self.name + "_sum", labels, total))
+        out.append((self.name + "_count", labels, cumulative))
+        return out
+
+
+# Коллектор: вызывается при каждом запросе /metrics
+# и возвращает (имя, тип, описание, [(метки, значение), ...])
+Collector = Callable[[], Iterable[Tuple[str, str, str, Iterable[Tuple[Dict[str, str], float]]]]]
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def _add(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика уже зарегистрирована: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus 0.0.4."""
+        lines: List[str] = []
+
+        def family(name: str, kind: str, documentation: str, samples: Iterable[Sample]) -> None:
+            lines.append(f"# HELP {name} {_escape(documentation)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_labels(labels)} {_value(value)}")
+
+        for metric in list(self._metrics.values()):
+            family(metric.name + metric.suffix, metric.kind, metric.documentation, metric.samples())
+        for collector in self._collectors:
+            try:
+                for name, kind, documentation, series in collector():
+                    family(name, kind, documentation, ((name, labels, v) for labels, v in series))
+            except Exception as e:
+                lines.append(f"# коллектор {getattr(collector, '__name__', collector)}: ошибка {_escape(str(e))}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+class LoopLagMonitor:
+    """Периодическая задача: насколько event loop опаздывает с пробуждением"""
+
+    def __init__(self, histogram: Histogram, gauge: Gauge, interval: float = LOOP_LAG_PROBE_SEC):
+        self.histogram = histogram
+        self.gauge = gauge
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.histogram.observe(lag)
+            self.gauge.set(lag)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# Глобальный реестр и метрики горячих путей
+metrics = MetricsRegistry()
+
+MQTT_MESSAGES = metrics.counter("mqtt_messages", "Получено MQTT сообщений")
+MQTT_PARSE_FAILURES = metrics.counter("mqtt_parse_failures", "MQTT сообщений, которые не удалось разобрать")
+MQTT_ON_MESSAGE_SECONDS = metrics.histogram(
+    "mqtt_on_message_seconds", "Время обработки MQTT сообщения в _on_message"
+)
+WS_BROADCAST_SECONDS = metrics.histogram(
+    "websocket_broadcast_seconds", "Время раскладки обновления по очередям WebSocket клиентов"
+)
+FCM_SEND_SECONDS = metrics.histogram(
+    "fcm_send_seconds", "Время одного multicast-запроса FCM", ("outcome",)
+)
+FCM_TOKENS = metrics.counter(
+    "fcm_tokens", "Результаты доставки FCM по токенам", ("outcome",)
+)
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Время обработки HTTP запроса", ("method", "route", "status")
+)
+EVENT_LOOP_LAG_SECONDS = metrics.histogram("event_loop_lag_seconds", "Опоздание пробуждения event loop")
+EVENT_LOOP_LAG_LAST = metrics.gauge("event_loop_lag_last_seconds", "Последний замер опоздания event loop")
+
+loop_lag_monitor = LoopLagMonitor(EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_LAG_LAST)
@@ -0,0 +1,107 @@
+"""
+Скомпилированная оценка показаний по профилю
+
+Профиль один раз превращается в массивы порогов; дальше маска отклонений
+и MC Score считаются без обращений к словарю профиля - по одному показанию
+(прием данных) или векторно по массиву показаний (история).
+"""
+from collections import OrderedDict
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from .ring_buffer import ISSUE_BITS, METRIC_COLUMNS
+
+# Пороги профиля по колонкам METRIC_COLUMNS: (ключ минимума, ключ максимума)
+THRESHOLD_KEYS = (
+    ("temp_min", "temp_max"),
+    (None, "humidity_max"),
+    (None, "co2_max"),
+    (None, "co_max"),
+    ("lux_min", "lux_max"),
+)
+
+# Штраф MC Score за отклонение параметра
+ISSUE_PENALTIES = {
+    "temperature": 15,
+    "humidity": 15,
+    "co2_ppm": 20,
+    "co_ppm": 25,
+    "lux": 10,
+}
+
+_COMPILED_CACHE_SIZE = 16
+
+
+def _threshold(profile: Dict, key, default: float) -> float:
+    if key is None or profile.get(key) is None:
+        return default
+    return float(profile[key])
+
+
+class CompiledProfile:
+    """Пороги профиля в виде массивов"""
+
+    def __init__(self, profile: Dict):
+        self.name = profile.get("name")
+        lo = [_threshold(profile, k_min, -np.inf) for k_min, _ in THRESHOLD_KEYS]
+        hi = [_threshold(profile, k_max, np.inf) for _, k_max in THRESHOLD_KEYS]
+        bits = list(ISSUE_BITS.values())
+        penalties = [ISSUE_PENALTIES[name] for name in ISSUE_BITS]
+
+        self._lo = np.array(lo)
+        self._hi = np.array(hi)
+        self._bits = np.array(bits, dtype=np.int64)
+        self._penalties = np.array(penalties, dtype=np.int64)
+        self._scalar = tuple(zip(lo, hi, bits))
+        # MC Score для каждой возможной маски
+        self._scores = tuple(
+            max(0, min(100, 100 - sum(p for bit, p in zip(bits, penalties) if mask & bit)))
+            for mask in range(1 << len(bits))
+        )
+
+    def mask_of(self, values: Sequence[float]) -> int:
+        """Маска отклонений одного показания (temp, hum, co2, co, lux)."""
+        mask = 0
+        for v, (lo, hi, bit) in zip(values, self._scalar):
+            if v < lo or v > hi:
+                mask |= bit
+        return mask
+
+    def score_of_mask(self, mask: int) -> int:
+        return self._scores[mask]
+
+    def evaluate(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Векторная оценка массива показаний.
+
+        Args:
+            values: Матрица (n, 5) в порядке METRIC_COLUMNS
+
+        Returns:
+            (маски отклонений uint8, MC Score uint8)
+        """
+        out = (values < self._lo) | (values > self._hi)
+        mask = out @ self._bits
+        score = np.clip(100 - out @ self._penalties, 0, 100)
+        return mask.astype(np.uint8), score.astype(np.uint8)
+
+
+_compiled: "OrderedDict[int, Tuple[Dict, CompiledProfile]]" = OrderedDict()
+
+
+def evaluator_for(profile: Dict) -> CompiledProfile:
+    """Скомпилированный профиль (кэш по объекту профиля - он заменяется, а не меняется)."""
+    hit = _compiled.get(id(profile))
+    if hit is not None and hit[0] is profile:
+        return hit[1]
+    compiled = CompiledProfile(profile)
+    _compiled[id(profile)] = (profile, compiled)
+    while len(_compiled) > _COMPILED_CACHE_SIZE:
+        _compiled.popitem(last=False)
+    return compiled
+
+
+def values_matrix(rows: Sequence[Sequence[float]]) -> np.ndarray:
+    """Матрица (n, 5) из строк (temp, hum, co2, co, lux)."""
+    return np.array(rows, dtype=np.float64).reshape(-1, len(METRIC_COLUMNS))
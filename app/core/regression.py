@@ -0,0 +1,86 @@
+"""
+Потоковое состояние линейной регрессии по последним N точкам
+
+Суммы sum_y и sum_xy обновляются при добавлении и вытеснении точки,
+sum_x и sum_xx зависят только от n и считаются по формуле.
+"""
+import threading
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional, Tuple
+
+from .ring_buffer import METRIC_COLUMNS
+
+
+class RegressionSnapshot(NamedTuple):
+    n: int
+    sum_y: float
+    sum_xy: float
+    last: float
+    version: int
+
+
+class RegressionState:
+    """Скользящее окно регрессии y(x), x = 0..n-1 для одной метрики"""
+
+    def __init__(self, window: int):
+        self.window = max(1, int(window))
+        self._values: Deque[float] = deque()
+        self.sum_y = 0.0
+        self.sum_xy = 0.0
+        self.version = 0
+        self._evictions = 0
+
+    def add(self, y: float) -> None:
+        values = self._values
+        if len(values) == self.window:
+            oldest = values.popleft()
+            # Оставшиеся точки сдвигаются на x-1
+            self.sum_y -= oldest
+            self.sum_xy -= self.sum_y
+            self._evictions += 1
+        self.sum_xy += len(values) * y
+        self.sum_y += y
+        values.append(y)
+
+        # Периодический пересчет убирает накопленную ошибку округления
+        if self._evictions >= self.window:
+            self._evictions = 0
+            self.sum_y = sum(values)
+            self.sum_xy = sum(i * v for i, v in enumerate(values))
+        self.version += 1
+
+    def snapshot(self) -> RegressionSnapshot:
+        values = self._values
+        return RegressionSnapshot(
+            len(values),
+            self.sum_y,
+            self.sum_xy,
+            values[-1] if values else 0.0,
+            self.version,
+        )
+
+
+class RegressionStore:
+    """Состояния регрессии по устройствам и метрикам"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self.devices: Dict[str, Tuple[RegressionState, ...]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, device_id: str, values: Tuple[float, ...]) -> None:
+        with self._lock:
+            states = self.devices.get(device_id)
+            if states is None:
+                states = tuple(RegressionState(self.window) for _ in METRIC_COLUMNS)
+                self.devices[device_id] = states
+            for state, v in zip(states, values):
+                state.add(v)
+
+    def snapshot(self, device_id: str) -> Optional[Dict[str, RegressionSnapshot]]:
+        """Согласованный срез сумм всех метрик устройства."""
+        with self._lock:
+            states = self.devices.get(device_id)
+            if states is None:
+                return None
+            return {m: s.snapshot() for m, s in zip(METRIC_COLUMNS, states)}
@@ -0,0 +1,331 @@
+"""
+Колоночный кольцевой буфер истории для одного устройства
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Колонки метрик: ключ в строке истории -> имя колонки
+METRIC_COLUMNS = ("temp", "hum", "co2", "co", "lux")
+
+# Начальное число слотов буфера устройства (дальше - удвоение до емкости)
+INITIAL_SLOTS = 64
+
+# Колонки буфера: имя -> typecode массива
+COLUMN_TYPES = {
+    "ts": "d",
+    **{name: "d" for name in METRIC_COLUMNS},
+    "issues": "B",
+    "profile": "H",
+    "anomaly": "H",
+    "anomaly_score": "f",
+}
+
+# Битовая маска отклонений (issues) вместо списка строк в каждой строке
+ISSUE_BITS = {
+    "temperature": 1 << 0,
+    "humidity": 1 << 1,
+    "co2_ppm": 1 << 2,
+    "co_ppm": 1 << 3,
+    "lux": 1 << 4,
+}
+
+
+# Виды аномалий (core.anomaly): бит = 1 << (индекс метрики * 3 + индекс вида)
+ANOMALY_KINDS = ("zscore", "spike", "stuck")
+
+
+def anomaly_bit(metric_idx: int, kind_idx: int) -> int:
+    return 1 << (metric_idx * len(ANOMALY_KINDS) + kind_idx)
+
+
+def issues_to_mask(issues: List[str]) -> int:
+    mask = 0
+    for name in issues:
+        mask |= ISSUE_BITS.get(name, 0)
+    return mask
+
+
+def mask_to_issues(mask: int) -> List[str]:
+    return [name for name, bit in ISSUE_BITS.items() if mask & bit]
+
+
+def mask_fields(mask: int) -> Dict:
+    """Поля оценки нормы строки истории по маске отклонений."""
+    is_danger = mask != 0
+    return {
+        "is_danger": is_danger,
+        "issues": mask_to_issues(mask),
+        "status": "out_of_range" if is_danger else "ok",
+        "message": "Вне нормы" if is_danger else "Норма",
+    }
+
+
+def anomaly_fields(mask: int, score: float) -> Dict:
+    """Поля аномалий строки: флаг, список "метрика:вид" и наибольший |z|."""
+    anomalies = []
+    if mask:
+        for m, name in enumerate(ISSUE_BITS):
+            for k, kind in enumerate(ANOMALY_KINDS):
+                if mask & anomaly_bit(m, k):
+                    anomalies.append(f"{name}:{kind}")
+    return {"anomaly": mask != 0, "anomalies": anomalies, "anomaly_score": round(score, 2)}
+
+
+def _allocate(slots: int) -> Dict[str, array]:
+    return {name: array(code, bytes(array(code).itemsize * slots)) for name, code in COLUMN_TYPES.items()}
+
+
+def make_row(
+    ts: float,
+    temp: float,
+    hum: float,
+    co2: float,
+    co: float,
+    lux: float,
+    mask: int,
+    profile: Optional[str],
+    anomaly: int = 0,
+    anomaly_score: float = 0.0,
+    mc_score: Optional[int] = None,
+) -> Dict:
+    """Строка истории в формате API из колоночных значений."""
+    row = {
+        "temp": temp,
+        "hum": hum,
+        "co2": co2,
+        "co": co,
+        "lux": lux,
+        "time": datetime.fromtimestamp(ts).isoformat(),
+        "profile": profile,
+        **mask_fields(mask),
+        **anomaly_fields(anomaly, anomaly_score),
+    }
+    if mc_score is not None:
+        row["mc_score"] = mc_score
+    return row
+
+
+class HistoryView:
+    """
+    Представление последних N записей буфера без копирования.
+
+    Каждая колонка отдается как один или два memoryview-сегмента
+    (второй появляется, когда окно пересекает границу кольца).
+    """
+
+    def __init__(self, buffer: "DeviceRingBuffer", start: int, count: int):
+        self._buffer = buffer
+        self._start = start
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _segments(self) -> Tuple[Tuple[int, int], ...]:
+        cap = self._buffer.slots
+        end = self._start + self._count
+        if end <= cap:
+            return ((self._start, end),)
+        return ((self._start, cap), (0, end - cap))
+
+    def between(self, ts_from: Optional[float] = None, ts_to: Optional[float] = None) -> "HistoryView":
+        """Подвид с записями в диапазоне [ts_from, ts_to] (бинарный поиск по ts)."""
+        ts = self._buffer.columns["ts"]
+        cap = self._buffer.slots
+        start = self._start
+
+        def key(p: int) -> float:
+            return ts[(start + p) % cap]
+
+        positions = range(self._count)
+        lo = 0 if ts_from is None else bisect_left(positions, ts_from, key=key)
+        hi = self._count if ts_to is None else bisect_right(positions, ts_to, key=key)
+        hi = max(lo, hi)
+        return HistoryView(self._buffer, (start + lo) % cap, hi - lo)
+
+    def last(self, limit: int) -> "HistoryView":
+        count = max(0, min(int(limit), self._count))
+        skip = self._count - count
+        return HistoryView(self._buffer, (self._start + skip) % self._buffer.slots, count)
+
+    def first_ts(self) -> Optional[float]:
+        return self._buffer.columns["ts"][self._start] if self._count else None
+
+    def column(self, name: str) -> List[memoryview]:
+        """Сегменты колонки (memoryview) в хронологическом порядке."""
+        col = memoryview(self._buffer.columns[name])
+        return [col[a:b] for a, b in self._segments()]
+
+    def iter_column(self, name: str) -> Iterator:
+        for segment in self.column(name):
+            yield from segment
+
+    def rows(self, evaluated: Optional[Tuple[array, array]] = None) -> Iterator[Dict]:
+        """
+        Ленивая материализация строк в формате старой истории.
+
+        evaluated - (маски, MC Score) по слотам буфера для оценки
+        по другому профилю вместо сохраненной при приеме.
+        """
+        buf = self._buffer
+        cols = buf.columns
+        for a, b in self._segments():
+            for i in range(a, b):
+                yield buf.row_at(i, cols, evaluated)
+
+    def raw_rows(self) -> Iterator[tuple]:
+        """
+        Строки кортежами, как в SQLite:
+        (ts, temp, hum, co2, co, lux, issues, profile, anomaly, anomaly_score).
+        """
+        cols = self._buffer.columns
+        names = self._buffer.profile_names
+        ts, temp, hum, co2, co, lux = (cols[c] for c in ("ts",) + METRIC_COLUMNS)
+        issues, profile = cols["issues"], cols["profile"]
+        anomaly, anomaly_score = cols["anomaly"], cols["anomaly_score"]
+        for a, b in self._segments():
+            for i in range(a, b):
+                yield (
+                    ts[i], temp[i], hum[i], co2[i], co[i], lux[i], issues[i],
+                    names[profile[i]] if names else None,
+                    anomaly[i], anomaly_score[i],
+                )
+
+
+class DeviceRingBuffer:
+    """
+    История одного устройства: метка времени, пять float-колонок,
+    маска отклонений, индекс профиля, маска и оценка аномалий. Добавление - O(1).
+
+    Колонки растут удвоением до capacity (около 57 байт на запись), поэтому
+    новое устройство не занимает память под всю емкость сразу. Пока буфер
+    не заполнен до capacity, кольцо не заворачивается: записи лежат в
+    слотах [0, len) и при росте не сдвигаются.
+    """
+
+    def __init__(self, capacity: int, profile_names: Optional[List[str]] = None):
+        self.capacity = max(1, int(capacity))
+        self.columns: Dict[str, array] = _allocate(min(self.capacity, INITIAL_SLOTS))
+        self._head = 0      # индекс следующей записи
+        self._size = 0
+        # (версия профиля, маски, MC Score) - оценка всех слотов по профилю
+        self.eval_cache: Optional[Tuple[int, array, array]] = None
+        # Общая таблица имен профилей (в строке хранится только индекс)
+        self.profile_names: List[str] = profile_names if profile_names is not None else []
+
+    @property
+    def slots(self) -> int:
+        """Выделено слотов (модуль кольца); не больше capacity."""
+        return len(self.columns["ts"])
+
+    def _grow(self) -> None:
+        # Новые массивы вместо расширения на месте: у старых могут быть
+        # живые memoryview (HistoryView в другом потоке)
+        slots = min(self.capacity, self.slots * 2)
+        grown: Dict[str, array] = {}
+        for name, col in self.columns.items():
+            fresh = array(col.typecode, col)
+            fresh.frombytes(bytes(col.itemsize * (slots - len(col))))
+            grown[name] = fresh
+        self.columns = grown
+        self.eval_cache = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(
+        self,
+        ts: float,
+        temp: float,
+        hum: float,
+        co2: float,
+        co: float,
+        lux: float,
+        issues_mask: int,
+        profile_idx: int,
+        anomaly: int = 0,
+        anomaly_score: float = 0.0,
+    ) -> None:
+        i = self._head
+        if i == self.slots:
+            self._grow()
+        cols = self.columns
+        cols["ts"][i] = ts
+        cols["temp"][i] = temp
+        cols["hum"][i] = hum
+        cols["co2"][i] = co2
+        cols["co"][i] = co
+        cols["lux"][i] = lux
+        cols["issues"][i] = issues_mask
+        cols["profile"][i] = profile_idx
+        cols["anomaly"][i] = anomaly
+        cols["anomaly_score"][i] = anomaly_score
+
+        # До заполнения capacity голова доходит до конца выделенных слотов
+        # (следующая запись их удвоит), дальше - кольцо
+        self._head = i + 1 if i + 1 < self.capacity else 0
+        if self._size < self.capacity:
+            self._size += 1
+
+    def last_index(self) -> Optional[int]:
+        if self._size == 0:
+            return None
+        return (self._head - 1) % self.slots
+
+    def tail(self, limit: Optional[int] = None) -> HistoryView:
+        """Последние `limit` записей (все, если limit не задан)."""
+        count = self._size if limit is None else max(0, min(int(limit), self._size))
+        start = (self._head - count) % self.slots
+        return HistoryView(self, start, count)
+
+    def row_at(
+        self,
+        i: int,
+        cols: Optional[Dict[str, array]] = None,
+        evaluated: Optional[Tuple[array, array]] = None,
+    ) -> Dict:
+        cols = cols or self.columns
+        return make_row(
+            cols["ts"][i],
+            cols["temp"][i],
+            cols["hum"][i],
+            cols["co2"][i],
+            cols["co"][i],
+            cols["lux"][i],
+            evaluated[0][i] if evaluated else cols["issues"][i],
+            self.profile_names[cols["profile"][i]] if self.profile_names else None,
+            cols["anomaly"][i],
+            cols["anomaly_score"][i],
+            evaluated[1][i] if evaluated else None,
+        )
+
+    def last_row(self) -> Optional[Dict]:
+        i = self.last_index()
+        return None if i is None else self.row_at(i)
+
+    def resize(self, capacity: int) -> None:
+        """Меняет емкость, сохраняя последние записи."""
+        capacity = max(1, int(capacity))
+        if capacity == self.capacity:
+            return
+        view = self.tail(min(self._size, capacity))
+        slots = min(capacity, max(INITIAL_SLOTS, len(view)))
+        new_columns: Dict[str, array] = {}
+        for name, col in self.columns.items():
+            fresh = array(col.typecode, bytes(col.itemsize * slots))
+            pos = 0
+            for segment in view.column(name):
+                n = len(segment)
+                fresh[pos:pos + n] = array(col.typecode, segment)
+                pos += n
+            new_columns[name] = fresh
+        self._size = len(view)
+        self.columns = new_columns
+        self.capacity = capacity
+        self._head = self._size if self._size < capacity else 0
+        self.eval_cache = None
+
+    def memory_bytes(self) -> int:
+        return sum(col.itemsize * len(col) for col in self.columns.values())
@@ -0,0 +1,279 @@
+"""
+Многоуровневые агрегаты (rollups) истории: 1m / 5m / 1h / 1d
+
+Каждый уровень - кольцо бакетов с прямой адресацией
+(слот = номер бакета % емкость), поэтому обновление при каждом
+показании - O(1), в том числе для запоздавших данных. Кольцо выделяется
+страницами по ROLLUP_PAGE бакетов при первой записи в страницу: новое
+устройство не занимает память под год агрегатов сразу.
+
+Уровень выбирается самый грубый из тех, чьи бакеты укладываются в
+запрошенный; если его хранение не покрывает начало диапазона, ответ
+помечается как усеченный (более старых бакетов нет ни на одном уровне,
+из которого можно собрать запрошенный бакет).
+"""
+import math
+import threading
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .ring_buffer import METRIC_COLUMNS
+
+# (имя, размер бакета в секундах, емкость в бакетах)
+ROLLUP_TIERS: Tuple[Tuple[str, int, int], ...] = (
+    ("1m", 60, 360),          # 6 часов
+    ("5m", 300, 576),         # 48 часов
+    ("1h", 3600, 744),        # 31 день
+    ("1d", 86400, 366),       # 1 год
+)
+
+# Бакетов в странице кольца (страница ~6 КБ)
+ROLLUP_PAGE = 64
+
+SUPPORTED_AGGS = ("min", "max", "avg", "count")
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value: str) -> int:
+    """'15m' -> 900. Поддерживаются суффиксы s/m/h/d."""
+    value = (value or "").strip().lower()
+    if not value:
+        raise ValueError("пустая длительность")
+    unit = value[-1]
+    if unit in _DURATION_UNITS:
+        amount = float(value[:-1])
+    else:
+        unit, amount = "s", float(value)
+    # float() принимает "inf" и "nan" - в int их не перевести
+    if not math.isfinite(amount):
+        raise ValueError(f"некорректная длительность: {value}")
+    seconds = int(amount * _DURATION_UNITS[unit])
+    if seconds <= 0:
+        raise ValueError(f"некорректная длительность: {value}")
+    return seconds
+
+
+class RollupPage:
+    """Страница кольца: ROLLUP_PAGE подряд идущих слотов"""
+
+    __slots__ = ("bucket_no", "count", "mins", "maxs", "sums")
+
+    def __init__(self, size: int = ROLLUP_PAGE):
+        self.bucket_no = array("q", [-1]) * size   # номер бакета в слоте (-1 - пусто)
+        self.count = array("L", [0]) * size
+        self.mins: Dict[str, array] = {m: array("f", [0.0]) * size for m in METRIC_COLUMNS}
+        self.maxs: Dict[str, array] = {m: array("f", [0.0]) * size for m in METRIC_COLUMNS}
+        self.sums: Dict[str, array] = {m: array("d", [0.0]) * size for m in METRIC_COLUMNS}
+
+
+# Слот бакета: (страница, индекс в странице)
+Slot = Tuple[RollupPage, int]
+
+
+class RollupTier:
+    """Кольцо бакетов одного уровня для одного устройства"""
+
+    def __init__(self, name: str, size: int, capacity: int):
+        self.name = name
+        self.size = size
+        self.capacity = capacity
+        self.pages: List[Optional[RollupPage]] = [None] * -(-capacity // ROLLUP_PAGE)
+
+    def _slot(self, bucket_no: int) -> Optional[Slot]:
+        """Слот бакета; сбрасывает слот, если в нем лежал более старый бакет."""
+        p, j = divmod(bucket_no % self.capacity, ROLLUP_PAGE)
+        page = self.pages[p]
+        if page is None:
+            page = self.pages[p] = RollupPage()
+        current = page.bucket_no[j]
+        if current == bucket_no:
+            return page, j
+        if current > bucket_no:
+            return None  # слишком старые данные - бакет уже перезаписан
+        page.bucket_no[j] = bucket_no
+        page.count[j] = 0
+        return page, j
+
+    def add(self, ts: float, values: Tuple[float, ...]) -> None:
+        slot = self._slot(int(ts // self.size))
+        if slot is None:
+            return
+        page, i = slot
+        first = page.count[i] == 0
+        page.count[i] += 1
+        for m, v in zip(METRIC_COLUMNS, values):
+            if first:
+                page.mins[m][i] = v
+                page.maxs[m][i] = v
+                page.sums[m][i] = v
+            else:
+                if v < page.mins[m][i]:
+                    page.mins[m][i] = v
+                if v > page.maxs[m][i]:
+                    page.maxs[m][i] = v
+                page.sums[m][i] += v
+
+    def set_bucket(self, bucket_no: int, count: int, stats: Dict[str, Tuple[float, float, float]]) -> None:
+        """Записывает готовый агрегат бакета (при восстановлении из БД)."""
+        slot = self._slot(bucket_no)
+        if slot is None:
+            return
+        page, i = slot
+        page.count[i] = count
+        for m, (vmin, vmax, vsum) in stats.items():
+            page.mins[m][i] = vmin
+            page.maxs[m][i] = vmax
+            page.sums[m][i] = vsum
+
+    def oldest_ts(self, now_ts: float) -> float:
+        return (int(now_ts // self.size) - self.capacity + 1) * self.size
+
+    def iter_buckets(self, ts_from: float, ts_to: float) -> Iterable[Tuple[int, RollupPage, int]]:
+        """(номер бакета, страница, индекс) с данными в диапазоне [ts_from, ts_to], по возрастанию времени."""
+        first = int(ts_from // self.size)
+        last = int(ts_to // self.size)
+        first = max(first, last - self.capacity + 1)
+        for b in range(first, last + 1):
+            p, j = divmod(b % self.capacity, ROLLUP_PAGE)
+            page = self.pages[p]
+            if page is not None and page.bucket_no[j] == b and page.count[j]:
+                yield b, page, j
+
+    def memory_bytes(self) -> int:
+        return sum(
+            sum(col.itemsize * len(col) for cols in (page.mins, page.maxs, page.sums) for col in cols.values())
+            + page.bucket_no.itemsize * len(page.bucket_no)
+            + page.count.itemsize * len(page.count)
+            for page in self.pages if page is not None
+        )
+
+
+class DeviceRollups:
+    """Все уровни агрегатов одного устройства"""
+
+    def __init__(self):
+        self.tiers = [RollupTier(name, size, cap) for name, size, cap in ROLLUP_TIERS]
+
+    def add(self, ts: float, values: Tuple[float, ...]) -> None:
+        for tier in self.tiers:
+            tier.add(ts, values)
+
+    def choose_tier(self, bucket_sec: int) -> Optional[RollupTier]:
+        """
+        Самый грубый уровень, бакеты которого укладываются в запрошенный
+        бакет целиком - у него и самое долгое хранение среди подходящих.
+        """
+        best = None
+        for tier in self.tiers:
+            if tier.size <= bucket_sec and bucket_sec % tier.size == 0:
+                best = tier
+        return best
+
+
+class RollupStore:
+    """Агрегаты по всем устройствам"""
+
+    def __init__(self):
+        self.devices: Dict[str, DeviceRollups] = {}
+        # add() вызывается из потоков приема, query() - из event loop
+        self._lock = threading.Lock()
+
+    def get(self, device_id: str) -> DeviceRollups:
+        rollups = self.devices.get(device_id)
+        if rollups is None:
+            rollups = DeviceRollups()
+            self.devices[device_id] = rollups
+        return rollups
+
+    def add(self, device_id: str, ts: float, values: Tuple[float, ...]) -> None:
+        with self._lock:
+            self.get(device_id).add(ts, values)
+
+    def load_from(self, history_store, now_ts: float) -> None:
+        """Восстанавливает агрегаты из постоянного хранилища (по одному GROUP BY на уровень)."""
+        for device_id in history_store.device_ids():
+            for name, size, capacity in ROLLUP_TIERS:
+                oldest = (int(now_ts // size) - capacity + 1) * size
+                buckets = history_store.aggregate(device_id, size, oldest)
+                with self._lock:
+                    tier = next(t for t in self.get(device_id).tiers if t.name == name)
+                    for bucket_no, count, stats in buckets:
+                        tier.set_bucket(bucket_no, count, stats)
+
+    def query(
+        self,
+        device_id: str,
+        bucket_sec: int,
+        ts_from: float,
+        ts_to: float,
+        aggs: List[str],
+        now_ts: Optional[float] = None,
+    ) -> Tuple[Optional[str], List[Dict], Optional[float]]:
+        """
+        Агрегаты устройства по бакетам `bucket_sec` в диапазоне.
+
+        Returns:
+            (имя использованного уровня, строки по возрастанию времени,
+             начало хранения уровня - раньше него данных нет)
+        """
+        with self._lock:
+            rollups = self.devices.get(device_id)
+            if rollups is None:
+                return None, [], None
+            tier = rollups.choose_tier(bucket_sec)
+            if tier is None:
+                return None, [], None
+            available_from = tier.oldest_ts(max(ts_to, now_ts or 0.0))
+            rows = self._collect(tier, bucket_sec, ts_from, ts_to, aggs)
+        return tier.name, rows, available_from
+
+    @staticmethod
+    def _collect(tier: RollupTier, bucket_sec: int, ts_from: float, ts_to: float, aggs: List[str]) -> List[Dict]:
+
+        rows: List[Dict] = []
+        acc_start: Optional[int] = None
+        acc_count = 0
+        acc: Dict[str, List[float]] = {}
+
+        def flush() -> None:
+            row: Dict = {
+                "time": datetime.fromtimestamp(acc_start).isoformat(),
+                "ts": acc_start,
+            }
+            if "count" in aggs:
+                row["count"] = acc_count
+            for m in METRIC_COLUMNS:
+                vmin, vmax, vsum = acc[m]
+                stats = {}
+                if "min" in aggs:
+                    stats["min"] = round(vmin, 2)
+                if "max" in aggs:
+                    stats["max"] = round(vmax, 2)
+                if "avg" in aggs:
+                    stats["avg"] = round(vsum / acc_count, 2)
+                row[m] = stats
+            rows.append(row)
+
+        for bucket_no, page, i in tier.iter_buckets(ts_from, ts_to):
+            start = bucket_no * tier.size
+            out_start = start - start % bucket_sec
+            n = page.count[i]
+            if out_start != acc_start:
+                if acc_start is not None:
+                    flush()
+                acc_start = out_start
+                acc_count = 0
+                acc = {m: [float("inf"), float("-inf"), 0.0] for m in METRIC_COLUMNS}
+            acc_count += n
+            for m in METRIC_COLUMNS:
+                a = acc[m]
+                if page.mins[m][i] < a[0]:
+                    a[0] = page.mins[m][i]
+                if page.maxs[m][i] > a[1]:
+                    a[1] = page.maxs[m][i]
+                a[2] += page.sums[m][i]
+        if acc_start is not None:
+            flush()
+        return rows
@@ -0,0 +1,52 @@
+"""
+Профиль запуска: сколько времени ушло на каждую фазу старта
+
+Модуль не зависит от остального приложения, поэтому main.py импортирует его
+первым и замеряет импорт настроек и остальных модулей отдельными фазами.
+Отсчет - от импорта этого модуля (начала загрузки приложения).
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+
+class StartupProfiler:
+    """Фазы запуска в порядке выполнения: (имя, секунды)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.ready_sec: float | None = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases.append((name, seconds))
+
+    def mark_ready(self) -> None:
+        """Приложение готово: фиксирует полное время от начала загрузки."""
+        self.ready_sec = time.perf_counter() - self.started
+
+    def report(self) -> Dict:
+        phases = {name: round(sec, 4) for name, sec in self.phases}
+        return {
+            "phases": phases,
+            "total_sec": round(self.ready_sec, 4) if self.ready_sec is not None else None,
+        }
+
+    def summary(self) -> str:
+        """Одна строка для лога: фазы по убыванию времени."""
+        parts = [f"{name}={sec * 1000:.0f}ms" for name, sec in sorted(self.phases, key=lambda p: -p[1])]
+        if self.ready_sec is not None:
+            parts.append(f"total={self.ready_sec * 1000:.0f}ms")
+        return " ".join(parts)
+
+
+# Профиль текущего процесса
+startup_profile = StartupProfiler()
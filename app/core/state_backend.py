@@ -0,0 +1,271 @@
+"""
+Общее состояние для нескольких worker-процессов uvicorn
+
+MemoryBackend - один процесс (поведение по умолчанию).
+SharedBackend - несколько процессов на одной машине: лидер (владелец
+файловой блокировки) держит подписку MQTT, пишет историю и шлет алерты,
+а события рассылает остальным воркерам через Unix-сокет (локальный pub/sub).
+Каждый воркер держит свою копию состояния в памяти и сам обслуживает
+чтения и WebSocket-клиентов; глубокая история читается из общей SQLite (WAL).
+Если лидер завершился, блокировку забирает один из оставшихся воркеров.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from ..config import settings
+from .log import get_logger
+
+log = get_logger("cluster")
+
+# on_event(event) - событие от другого воркера; on_leader() - процесс стал лидером
+EventHandler = Callable[[Dict], None]
+LeaderHandler = Callable[[], None]
+
+BACKENDS = ("memory", "shared")
+
+# Сколько ждать отправки одному воркеру, прежде чем отключить его
+PEER_SEND_TIMEOUT_SEC = 1.0
+# Пауза между попытками подключиться к лидеру / захватить блокировку
+RECONNECT_DELAY_SEC = 0.5
+
+
+class StateBackend:
+    """Интерфейс синхронизации состояния между процессами"""
+
+    name = "base"
+
+    def __init__(self):
+        self.is_leader = False
+        self._on_event: Optional[EventHandler] = None
+        self._on_leader: Optional[LeaderHandler] = None
+
+    def start(self, on_event: EventHandler, on_leader: LeaderHandler) -> None:
+        raise NotImplementedError
+
+    def publish(self, event: Dict) -> None:
+        """Отправляет событие остальным воркерам (локально не применяется)."""
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        pass
+
+    def stats(self) -> Dict:
+        return {"backend": self.name, "pid": os.getpid(), "leader": self.is_leader}
+
+
+class MemoryBackend(StateBackend):
+    """Один процесс: он же лидер, рассылать некому"""
+
+    name = "memory"
+
+    def start(self, on_event: EventHandler, on_leader: LeaderHandler) -> None:
+        self._on_event = on_event
+        self.is_leader = True
+        on_leader()
+
+    def publish(self, event: Dict) -> None:
+        pass
+
+
+class SharedBackend(StateBackend):
+    """Несколько процессов: выборы лидера по flock и рассылка через Unix-сокет"""
+
+    name = "shared"
+
+    def __init__(self, lock_path: str, socket_path: str):
+        super().__init__()
+        self.lock_path = Path(lock_path)
+        self.socket_path = Path(socket_path)
+        self._lock_file = None
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._server: Optional[socket.socket] = None
+        # У лидера - подключенные воркеры, у остальных - соединение с лидером
+        self._peers: List[socket.socket] = []
+        self._leader_conn: Optional[socket.socket] = None
+        self._send_lock = threading.Lock()
+
+        self.sent = 0
+        self.received = 0
+        self.dropped_peers = 0
+
+    def start(self, on_event: EventHandler, on_leader: LeaderHandler) -> None:
+        if self._thread is not None:
+            return
+        self._on_event = on_event
+        self._on_leader = on_leader
+        self._running = True
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        # Первая попытка синхронно: лидер должен подняться до приема запросов
+        if not self._try_lock():
+            log.info("👥 Воркер %s: данные от лидера через %s", os.getpid(), self.socket_path)
+        self._thread = threading.Thread(target=self._run, name="state-backend", daemon=True)
+        self._thread.start()
+
+    def _try_lock(self) -> bool:
+        import fcntl
+
+        if self.is_leader:
+            return True
+        f = open(self.lock_path, "a+")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._lock_file = f
+        self._become_leader()
+        return True
+
+    def _become_leader(self) -> None:
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(self.socket_path))
+        server.listen(64)
+        server.settimeout(RECONNECT_DELAY_SEC)
+        self._server = server
+        self.is_leader = True
+        log.info("👑 Воркер %s - лидер (MQTT, история, алерты)", os.getpid())
+        self._on_leader()
+
+    def _run(self) -> None:
+        while self._running:
+            if self.is_leader:
+                self._accept_loop()
+                return
+            try:
+                conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                conn.connect(str(self.socket_path))
+            except OSError:
+                # Лидера нет или он еще не открыл сокет
+                conn.close()
+                if not self._try_lock():
+                    time.sleep(RECONNECT_DELAY_SEC)
+                continue
+            conn.settimeout(PEER_SEND_TIMEOUT_SEC)
+            self._leader_conn = conn
+            self._read_loop(conn)
+            self._leader_conn = None
+            conn.close()
+            if self._running:
+                log.warning("⚠️ Воркер %s: соединение с лидером потеряно", os.getpid())
+
+    def _accept_loop(self) -> None:
+        while self._running:
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            conn.settimeout(PEER_SEND_TIMEOUT_SEC)
+            with self._send_lock:
+                self._peers.append(conn)
+            threading.Thread(target=self._serve_peer, args=(conn,), name="state-peer", daemon=True).start()
+
+    def _serve_peer(self, conn: socket.socket) -> None:
+        self._read_loop(conn)
+        self._drop_peer(conn)
+
+    def _read_loop(self, conn: socket.socket) -> None:
+        buf = b""
+        while self._running:
+            try:
+                chunk = conn.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if not chunk:
+                return
+            buf += chunk
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                self.received += 1
+                if self.is_leader:
+                    # Лидер пересылает событие воркера всем остальным
+                    self._send(line + b"\n", exclude=conn)
+                try:
+                    self._on_event(event)
+                except Exception as e:
+                    log.error("❌ Ошибка обработки события воркера: %s", e)
+
+    def _send(self, frame: bytes, exclude: Optional[socket.socket] = None) -> None:
+        with self._send_lock:
+            targets = list(self._peers) if self.is_leader else [self._leader_conn]
+            for conn in targets:
+                if conn is None or conn is exclude:
+                    continue
+                try:
+                    conn.sendall(frame)
+                    self.sent += 1
+                except OSError:
+                    if self.is_leader:
+                        self._peers.remove(conn)
+                        self.dropped_peers += 1
+                        conn.close()
+
+    def _drop_peer(self, conn: socket.socket) -> None:
+        with self._send_lock:
+            if conn in self._peers:
+                self._peers.remove(conn)
+        conn.close()
+
+    def publish(self, event: Dict) -> None:
+        self._send(json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+
+    def stop(self) -> None:
+        self._running = False
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if self.socket_path.exists():
+                self.socket_path.unlink()
+        with self._send_lock:
+            for conn in self._peers:
+                conn.close()
+            self._peers = []
+        if self._leader_conn is not None:
+            self._leader_conn.close()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self._lock_file is not None:
+            # Закрытие файла снимает flock - лидером станет другой воркер
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_leader = False
+
+    def stats(self) -> Dict:
+        return {
+            **super().stats(),
+            "peers": len(self._peers) if self.is_leader else None,
+            "connected": self.is_leader or self._leader_conn is not None,
+            "sent": self.sent,
+            "received": self.received,
+            "dropped_peers": self.dropped_peers,
+        }
+
+
+def create_state_backend() -> StateBackend:
+    if settings.STATE_BACKEND not in BACKENDS:
+        raise ValueError(f"Неизвестный STATE_BACKEND: {settings.STATE_BACKEND}")
+    if settings.STATE_BACKEND == "shared":
+        return SharedBackend(settings.STATE_LOCK_PATH, settings.STATE_SOCKET_PATH)
+    return MemoryBackend()
+
+
+# Глобальный backend синхронизации воркеров
+state_backend = create_state_backend()
@@ -1,13 +1,55 @@
 """
 Хранилище данных в памяти
 """
-from collections import deque
 import json
+import threading
+import time
+from array import array
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
-from fastapi import WebSocket
-from .constants import MAX_HISTORY_SIZE, PROFILES
+
+import numpy as np
+
+from ..config import settings
+from .anomaly import AnomalyStore
+from .constants import DEFAULT_DEVICE_ID, MAX_HISTORY_SIZE, PROFILES
+from .log import get_logger
+from .profile_eval import evaluator_for, values_matrix
+from .regression import RegressionStore
+from .ring_buffer import (
+    METRIC_COLUMNS,
+    DeviceRingBuffer,
+    HistoryView,
+    anomaly_fields,
+    issues_to_mask,
+    mask_fields,
+    mask_to_issues,
+)
+from .rollups import RollupStore
+from .window_stats import WindowStatsStore
+
+log = get_logger("storage")
+
+# Поля current_data (и сообщений WebSocket)
+CURRENT_FIELDS = (
+    "temperature", "humidity", "co2_ppm", "co_ppm", "lux", "timestamp", "device_id",
+    "anomaly", "anomalies", "anomaly_score",
+)
+
+
+def _empty_current(device_id: Optional[str]) -> Dict:
+    """Текущие данные устройства, от которого еще ничего не пришло."""
+    return {
+        "temperature": 0.0,
+        "humidity": 0.0,
+        "co2_ppm": 0.0,
+        "co_ppm": 0.0,
+        "lux": 0.0,
+        "timestamp": None,
+        "device_id": device_id,
+        **anomaly_fields(0, 0.0),
+    }
 
 
 class DataStorage:
@@ -15,18 +57,38 @@ class DataStorage:
 
     def __init__(self):
         self._active_profile_path = Path("app/data/active_profile.json")
-        self.current_data: Dict = {
-            "temperature": 0.0,
-            "humidity": 0.0,
-            "co2_ppm": 0.0,
-            "co_ppm": 0.0,
-            "lux": 0.0,
-            "timestamp": None,
-            "device_id": None
-        }
+        self.current_data: Dict = _empty_current(None)
+        # Время current_data: догрузка нового устройства не откатывает его назад
+        self._current_ts: Optional[float] = None
+
+        # Последние данные и история по каждому device_id
+        self.current_by_device: Dict[str, Dict] = {}
+        self.devices: Dict[str, DeviceRingBuffer] = {}
+        self._profile_names: List[str] = []
+        self._profile_index: Dict[str, int] = {}
+        # Агрегаты 1m/5m/1h/1d для длинных графиков
+        self.rollups = RollupStore()
+        # Скользящая статистика для /api/stats
+        self.window_stats = WindowStatsStore(settings.STATS_WINDOWS)
+        # Потоковая регрессия для AI прогноза (последние MAX_HISTORY_SIZE точек)
+        self.regression = RegressionStore(MAX_HISTORY_SIZE)
+        # Потоковые детекторы аномалий (дрейф, скачок, залипание)
+        self.anomalies = AnomalyStore(
+            alpha=settings.ANOMALY_ALPHA,
+            z_threshold=settings.ANOMALY_Z_THRESHOLD,
+            spike_threshold=settings.ANOMALY_SPIKE_THRESHOLD,
+            stuck_count=settings.ANOMALY_STUCK_COUNT,
+            warmup=settings.ANOMALY_WARMUP,
+        )
+        # Постоянное хранилище (SQLite), подключается при старте приложения
+        self.history_store = None
+        # Счетчики изменений (версии для кэша ответов)
+        self._versions: Dict[str, int] = {}
+        self.profile_version = 0
+        # Изменения буферов и агрегатов приходят из потока хранилища (MQTT),
+        # пакетного приема (пул потоков) и событий кластера - один замок на все
+        self.lock = threading.RLock()
 
-        self.data_history = deque(maxlen=MAX_HISTORY_SIZE)
-        self.active_websockets: List[WebSocket] = []
         self.active_profile = self._load_active_profile()
 
     def _load_active_profile(self) -> Dict:
@@ -40,7 +102,7 @@ class DataStorage:
                     base.update(profile)
                     return base
         except Exception as e:
-            print(f"⚠️ Не удалось загрузить active_profile.json: {e}")
+            log.warning("⚠️ Не удалось загрузить active_profile.json: %s", e)
         return dict(PROFILES[0])
 
     def _save_active_profile(self) -> None:
@@ -52,7 +114,7 @@ class DataStorage:
                 encoding="utf-8",
             )
         except Exception as e:
-            print(f"⚠️ Не удалось сохранить active_profile.json: {e}")
+            log.warning("⚠️ Не удалось сохранить active_profile.json: %s", e)
 
     def _to_float(self, v, default=0.0) -> float:
         try:
@@ -69,35 +131,8 @@ class DataStorage:
         lux: float,
     ) -> Dict:
         """Проверка 'норма/вне нормы' по активному профилю"""
-        p = self.active_profile or {}
-        issues = []
-
-        tmin = p.get("temp_min")
-        tmax = p.get("temp_max")
-        if tmin is not None and temperature < tmin:
-            issues.append("temperature")
-        if tmax is not None and temperature > tmax:
-            issues.append("temperature")
-
-        hmax = p.get("humidity_max")
-        if hmax is not None and humidity > hmax:
-            issues.append("humidity")
-
-        cmax = p.get("co2_max")
-        if cmax is not None and co2_ppm > cmax:
-            issues.append("co2_ppm")
-
-        comax = p.get("co_max")
-        if comax is not None and co_ppm > comax:
-            issues.append("co_ppm")
-
-        # lux может быть в профиле как lux_max/lux_min (если есть)
-        lmin = p.get("lux_min")
-        lmax = p.get("lux_max")
-        if lmin is not None and lux < lmin:
-            issues.append("lux")
-        if lmax is not None and lux > lmax:
-            issues.append("lux")
+        mask = evaluator_for(self.active_profile).mask_of((temperature, humidity, co2_ppm, co_ppm, lux))
+        issues = mask_to_issues(mask)
 
         is_danger = len(issues) > 0
         return {
@@ -107,54 +142,338 @@ class DataStorage:
             "message": "Вне нормы" if is_danger else "Норма",
         }
 
-    def update_current_data(self, data: Dict):
-        """Обновить текущие данные"""
+    def _capacity_for(self, device_id: str) -> int:
+        overrides = settings.HISTORY_CAPACITY_OVERRIDES or {}
+        return int(overrides.get(device_id, settings.HISTORY_CAPACITY_PER_DEVICE))
+
+    def _profile_idx(self, name: Optional[str]) -> int:
+        key = name or ""
+        idx = self._profile_index.get(key)
+        if idx is None:
+            idx = len(self._profile_names)
+            self._profile_names.append(key)
+            self._profile_index[key] = idx
+        return idx
+
+    def get_device_buffer(self, device_id: str) -> DeviceRingBuffer:
+        """Буфер истории устройства (создается при первом обращении)."""
+        buf = self.devices.get(device_id)
+        if buf is None:
+            buf = DeviceRingBuffer(self._capacity_for(device_id), self._profile_names)
+            self.devices[device_id] = buf
+        return buf
+
+    def set_device_capacity(self, device_id: str, capacity: int) -> None:
+        """Меняет емкость истории конкретного устройства."""
+        with self.lock:
+            self.get_device_buffer(device_id).resize(capacity)
+            self._bump(device_id)
+
+    def _evaluated(self, buf: DeviceRingBuffer) -> Tuple[array, array]:
+        """
+        Маски и MC Score всех строк буфера по активному профилю.
+
+        Векторный пересчет - один раз после смены профиля, дальше
+        новые строки дооцениваются при добавлении. Только под self.lock:
+        кэш должен совпадать со слотами буфера, которые меняет прием.
+        """
+        cache = buf.eval_cache
+        if cache is None or cache[0] != self.profile_version:
+            cols = buf.columns
+            matrix = np.column_stack([np.frombuffer(cols[c], dtype=np.float64) for c in METRIC_COLUMNS])
+            mask, score = evaluator_for(self.active_profile).evaluate(matrix)
+            cache = (self.profile_version, array("B", mask.tobytes()), array("B", score.tobytes()))
+            buf.eval_cache = cache
+        return cache[1], cache[2]
+
+    def _evaluate_last(self, buf: DeviceRingBuffer, values: tuple) -> None:
+        cache = buf.eval_cache
+        if cache is None or cache[0] != self.profile_version:
+            return
+        evaluator = evaluator_for(self.active_profile)
+        i = buf.last_index()
+        mask = evaluator.mask_of(values)
+        cache[1][i] = mask
+        cache[2][i] = evaluator.score_of_mask(mask)
+
+    def evaluate_rows(self, rows: List[Dict]) -> List[Dict]:
+        """Оценка строк истории (из SQLite) по активному профилю, векторно."""
+        if not rows:
+            return rows
+        matrix = values_matrix([[row[c] for c in METRIC_COLUMNS] for row in rows])
+        mask, score = evaluator_for(self.active_profile).evaluate(matrix)
+        for row, m, s in zip(rows, mask.tolist(), score.tolist()):
+            row.update(mask_fields(m))
+            row["mc_score"] = s
+        return rows
+
+    def _bump(self, device_id: str) -> None:
+        self._versions[device_id] = self._versions.get(device_id, 0) + 1
+
+    def data_version(self, device_id: Optional[str] = None) -> Tuple:
+        """Версия данных устройства и активного профиля (ключ кэша ответов)."""
+        device_id = self._resolve_device(device_id)
+        return (device_id, self._versions.get(device_id, 0), self.profile_version)
+
+    def build_reading(self, data: Dict, ts: Optional[float] = None) -> Dict:
+        """
+        Нормализованное показание с оценкой 'норма/вне нормы' и аномалий.
+
+        Это событие, которое публикуется в шину и потребляется
+        хранилищем, алертами, рассылкой и постоянной историей.
+        """
         temperature = self._to_float(data.get("temperature", 0))
         humidity = self._to_float(data.get("humidity", 0))
         co2_ppm = self._to_float(data.get("co2_ppm", 0))
         co_ppm = self._to_float(data.get("co_ppm", data.get("co", 0)))
         lux = self._to_float(data.get("lux", 0))
 
-        now_iso = datetime.now().isoformat()
+        now_ts = time.time() if ts is None else ts
+        norm = self._evaluate_norm(temperature, humidity, co2_ppm, co_ppm, lux)
+        device_id = data.get("device_id") or DEFAULT_DEVICE_ID
+        anomaly, anomaly_score = self.anomalies.update(
+            device_id, now_ts, (temperature, humidity, co2_ppm, co_ppm, lux)
+        )
 
-        self.current_data = {
+        return {
             "temperature": temperature,
             "humidity": humidity,
             "co2_ppm": co2_ppm,
             "co_ppm": co_ppm,
             "lux": lux,
-            "timestamp": now_iso,
-            "device_id": data.get("device_id", "esp32_main")
+            "timestamp": datetime.fromtimestamp(now_ts).isoformat(),
+            "device_id": device_id,
+            "ts": now_ts,
+            "profile": self.active_profile.get("name"),
+            **norm,
+            "anomaly_mask": anomaly,
+            **anomaly_fields(anomaly, anomaly_score),
         }
 
-        norm = self._evaluate_norm(temperature, humidity, co2_ppm, co_ppm, lux)
+    def apply_reading(self, reading: Dict) -> bool:
+        """
+        Обновляет текущие данные, буфер истории и агрегаты в памяти.
 
-        # ✅ Добавить в историю уже с "Норма/Вне нормы"
-        self.data_history.append({
-            "temp": temperature,
-            "hum": humidity,
-            "co2": co2_ppm,
-            "co": co_ppm,
-            "lux": lux,
-            "time": now_iso,
-            "profile": self.active_profile.get("name"),
-            **norm
-        })
+        Показание не новее последнего в буфере устройства (догрузка шлюза,
+        запоздавшее сообщение) идет только в агрегаты: буфер остается
+        упорядоченным по времени.
+
+        Returns:
+            True, если показание добавлено в буфер
+        """
+        device_id = reading["device_id"]
+        now_ts = reading["ts"]
+        values = (
+            reading["temperature"],
+            reading["humidity"],
+            reading["co2_ppm"],
+            reading["co_ppm"],
+            reading["lux"],
+        )
+
+        with self.lock:
+            last = self.last_ts(device_id)
+            if last is not None and now_ts <= last:
+                self.rollups.add(device_id, now_ts, values)
+                self._bump(device_id)
+                return False
+
+            current = {k: reading[k] for k in CURRENT_FIELDS}
+            self.current_by_device[device_id] = current
+            if self._current_ts is None or now_ts >= self._current_ts:
+                self._current_ts = now_ts
+                self.current_data = current
+
+            # ✅ Добавить в историю устройства уже с "Норма/Вне нормы" (маска)
+            buf = self.get_device_buffer(device_id)
+            buf.append(
+                now_ts,
+                *values,
+                issues_to_mask(reading["issues"]),
+                self._profile_idx(reading["profile"]),
+                reading["anomaly_mask"],
+                reading["anomaly_score"],
+            )
+            self._evaluate_last(buf, values)
+            self.rollups.add(device_id, now_ts, values)
+            self._observe(device_id, now_ts, values)
+            self._bump(device_id)
+        return True
+
+    def persist_reading(self, reading: Dict, wait: bool = False) -> None:
+        """Ставит показание в очередь постоянного хранилища (wait - см. HistoryStore.append)."""
+        if self.history_store is None:
+            return
+        self.history_store.append((
+            reading["device_id"],
+            reading["ts"],
+            reading["temperature"],
+            reading["humidity"],
+            reading["co2_ppm"],
+            reading["co_ppm"],
+            reading["lux"],
+            issues_to_mask(reading["issues"]),
+            reading["profile"],
+            reading["anomaly_mask"],
+            reading["anomaly_score"],
+        ), wait=wait)
+
+    def last_ts(self, device_id: str) -> Optional[float]:
+        """Время последней записи в буфере устройства."""
+        buf = self.devices.get(device_id)
+        if buf is None:
+            return None
+        i = buf.last_index()
+        return None if i is None else buf.columns["ts"][i]
+
+    def update_current_data(self, data: Dict) -> Dict:
+        """Обновить текущие данные синхронно, возвращает показание с оценкой нормы"""
+        reading = self.build_reading(data)
+        self.apply_reading(reading)
+        self.persist_reading(reading)
+        return reading
+
+    def _observe(self, device_id: str, ts: float, values: tuple) -> None:
+        """Обновляет инкрементальные агрегаты, которые восстанавливаются из буфера."""
+        self.window_stats.add(device_id, ts, values)
+        self.regression.add(device_id, values)
+
+    def attach_history_store(self, history_store) -> None:
+        """Подключает постоянное хранилище и прогревает буферы последними записями."""
+        with self.lock:
+            for device_id in history_store.device_ids():
+                rows = history_store.recent_raw(device_id, self._capacity_for(device_id))
+                if not rows:
+                    continue
+                buf = self.get_device_buffer(device_id)
+                warm_from = len(rows) - self.anomalies.history_needed
+                for i, (ts, temp, hum, co2, co, lux, mask, profile, anomaly, score) in enumerate(rows):
+                    buf.append(ts, temp, hum, co2, co, lux, mask, self._profile_idx(profile), anomaly, score)
+                    self._observe(device_id, ts, (temp, hum, co2, co, lux))
+                    # Детекторам хватает хвоста: вклад старых точек в EWMA ничтожен
+                    if i >= warm_from:
+                        self.anomalies.update(device_id, ts, (temp, hum, co2, co, lux))
+                ts, temp, hum, co2, co, lux, _, _, anomaly, score = rows[-1]
+                self.current_by_device[device_id] = {
+                    "temperature": temp,
+                    "humidity": hum,
+                    "co2_ppm": co2,
+                    "co_ppm": co,
+                    "lux": lux,
+                    "timestamp": datetime.fromtimestamp(ts).isoformat(),
+                    "device_id": device_id,
+                    **anomaly_fields(anomaly, score),
+                }
+                if self._current_ts is None or ts > self._current_ts:
+                    self._current_ts = ts
+                    self.current_data = self.current_by_device[device_id]
+            self.rollups.load_from(history_store, time.time())
+            self.history_store = history_store
 
-    def get_history(self, limit: int = 50) -> List[Dict]:
-        limit = min(limit, MAX_HISTORY_SIZE)
-        return list(self.data_history)[-limit:]
+    def _resolve_device(self, device_id: Optional[str]) -> Optional[str]:
+        return device_id or self.current_data.get("device_id")
 
-    def add_websocket(self, websocket: WebSocket):
-        self.active_websockets.append(websocket)
+    def get_current(self, device_id: Optional[str] = None) -> Dict:
+        """
+        Текущие данные устройства (по умолчанию - последнего приславшего).
+
+        Для неизвестного устройства - пустая запись (timestamp=None), а не
+        данные другого устройства.
+        """
+        if device_id is None:
+            return self.current_data
+        current = self.current_by_device.get(device_id)
+        return current if current is not None else _empty_current(device_id)
+
+    def get_history_view(self, limit: Optional[int] = None, device_id: Optional[str] = None) -> Optional[HistoryView]:
+        """Представление последних записей устройства без копирования."""
+        buf = self.devices.get(self._resolve_device(device_id))
+        if buf is None:
+            return None
+        return buf.tail(limit)
+
+    def get_history(self, limit: int = 50, device_id: Optional[str] = None) -> List[Dict]:
+        view = self.get_history_view(limit, device_id)
+        return list(view.rows()) if view is not None else []
+
+    def query_history(
+        self,
+        limit: int = 50,
+        device_id: Optional[str] = None,
+        ts_from: Optional[float] = None,
+        ts_to: Optional[float] = None,
+        evaluate: bool = False,
+    ) -> List[Dict]:
+        """
+        История устройства за диапазон времени.
+
+        Отвечает из кольцевого буфера, если он покрывает запрос,
+        иначе - из постоянного хранилища (может обращаться к диску).
+        evaluate=True - оценка нормы и MC Score по активному профилю.
+        """
+        device_id = self._resolve_device(device_id)
+        # Строки и оценка собираются под замком: прием не сдвинет кольцо
+        # и не заменит колонки (рост буфера) посреди чтения
+        with self.lock:
+            buf = self.devices.get(device_id)
+            if buf is not None:
+                view = buf.tail()
+                selected = view.between(ts_from, ts_to)
+                # Буфер еще не переполнялся - в нем вся история устройства
+                covers = len(view) < buf.capacity or (
+                    ts_from is not None and view.first_ts() <= ts_from
+                )
+                if len(selected) >= limit or covers or self.history_store is None:
+                    return list(selected.last(limit).rows(self._evaluated(buf) if evaluate else None))
+        if self.history_store is None or device_id is None:
+            return []
+        rows = self.history_store.query(device_id, ts_from, ts_to, limit)
+        return self.evaluate_rows(rows) if evaluate else rows
+
+    def iter_history(
+        self,
+        device_id: str,
+        ts_from: Optional[float] = None,
+        ts_to: Optional[float] = None,
+    ) -> Iterator[tuple]:
+        """
+        Вся история устройства за диапазон кортежами, по возрастанию времени.
+
+        Сначала постоянное хранилище (постранично), затем хвост буфера,
+        который писатель SQLite еще не сбросил на диск. Хвост копируется
+        под замком при вызове: пока выгрузка идет к медленному клиенту,
+        кольцо может завернуться и перезаписать слоты.
+        """
+        with self.lock:
+            buf = self.devices.get(device_id)
+            tail = list(buf.tail().between(ts_from, ts_to).raw_rows()) if buf is not None else []
+        return self._iter_history(device_id, ts_from, ts_to, tail)
+
+    def _iter_history(
+        self,
+        device_id: str,
+        ts_from: Optional[float],
+        ts_to: Optional[float],
+        tail: List[tuple],
+    ) -> Iterator[tuple]:
+        last_ts = None
+        if self.history_store is not None:
+            for row in self.history_store.iter_range(device_id, ts_from, ts_to):
+                last_ts = row[0]
+                yield row
+        for row in tail:
+            if last_ts is None or row[0] > last_ts:
+                yield row
 
-    def remove_websocket(self, websocket: WebSocket):
-        if websocket in self.active_websockets:
-            self.active_websockets.remove(websocket)
+    def measurements_count(self) -> int:
+        return sum(len(buf) for buf in self.devices.values())
 
-    def update_profile(self, profile: Dict):
+    def update_profile(self, profile: Dict, persist: bool = True):
         self.active_profile = dict(profile)
-        self._save_active_profile()
+        self.profile_version += 1
+        # Профиль, полученный от другого воркера, тот уже сохранил в файл
+        if persist:
+            self._save_active_profile()
 
 
 storage = DataStorage()
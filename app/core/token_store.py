@@ -0,0 +1,145 @@
+"""
+Реестр FCM токенов: SQLite + индексы в памяти
+
+В памяти два индекса - пользователь -> токены и токен -> пользователь,
+поэтому выборка при отправке и очистка недействительных токенов не
+обращаются к диску. Изменения пишутся в SQLite сразу (они редкие).
+"""
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from ..config import settings
+from .log import get_logger
+
+log = get_logger("tokens")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS push_tokens (
+    token TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    platform TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_push_tokens_user ON push_tokens (user_id);
+"""
+
+
+class TokenStore:
+    """Постоянный реестр токенов с индексами пользователь <-> токен"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._by_user: Dict[str, Set[str]] = {}
+        self._user_of: Dict[str, str] = {}
+
+    def start(self) -> bool:
+        """Открывает БД и загружает токены в память."""
+        if self._conn is not None:
+            return True
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            rows = conn.execute("SELECT token, user_id FROM push_tokens").fetchall()
+        except Exception as e:
+            log.error("❌ Ошибка открытия реестра токенов: %s", e)
+            return False
+        with self._lock:
+            self._conn = conn
+            for token, user_id in rows:
+                self._index(user_id, token)
+        return True
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _index(self, user_id: str, token: str) -> None:
+        prev = self._user_of.get(token)
+        if prev is not None and prev != user_id:
+            self._unindex(token)
+        self._by_user.setdefault(user_id, set()).add(token)
+        self._user_of[token] = user_id
+
+    def _unindex(self, token: str) -> Optional[str]:
+        user_id = self._user_of.pop(token, None)
+        if user_id is None:
+            return None
+        tokens = self._by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                self._by_user.pop(user_id, None)
+        return user_id
+
+    def _write(self, sql: str, params: Iterable) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.executemany(sql, params)
+            self._conn.commit()
+        except Exception as e:
+            log.error("❌ Ошибка записи реестра токенов: %s", e)
+
+    def add(self, user_id: str, token: str, platform: str = "android", persist: bool = True) -> int:
+        """Регистрирует токен (переносит его, если он был у другого пользователя)."""
+        with self._lock:
+            self._index(user_id, token)
+            if persist:
+                self._write(
+                    "INSERT OR REPLACE INTO push_tokens (token, user_id, platform, updated_at) VALUES (?, ?, ?, ?)",
+                    [(token, user_id, platform, time.time())],
+                )
+            return len(self._by_user.get(user_id, ()))
+
+    def remove(self, user_id: str, token: str, persist: bool = True) -> int:
+        """Удаляет токен пользователя и возвращает оставшееся количество."""
+        with self._lock:
+            if self._user_of.get(token) == user_id:
+                self._unindex(token)
+                if persist:
+                    self._write("DELETE FROM push_tokens WHERE token = ?", [(token,)])
+            return len(self._by_user.get(user_id, ()))
+
+    def remove_many(self, tokens: Iterable[str], persist: bool = True) -> int:
+        """Пакетное удаление (недействительные токены после рассылки)."""
+        with self._lock:
+            removed = [t for t in tokens if self._unindex(t) is not None]
+            if removed and persist:
+                self._write("DELETE FROM push_tokens WHERE token = ?", [(t,) for t in removed])
+            return len(removed)
+
+    def tokens_of(self, user_id: str) -> List[str]:
+        with self._lock:
+            return list(self._by_user.get(user_id, ()))
+
+    def user_of(self, token: str) -> Optional[str]:
+        return self._user_of.get(token)
+
+    def all_tokens(self) -> List[str]:
+        with self._lock:
+            return list(self._user_of)
+
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            return len(self._by_user.get(user_id, ()))
+
+    def users_count(self) -> int:
+        with self._lock:
+            return len(self._by_user)
+
+    def tokens_count(self) -> int:
+        with self._lock:
+            return len(self._user_of)
+
+
+# Глобальный реестр токенов
+token_store = TokenStore(settings.PUSH_TOKENS_DB_PATH)
@@ -0,0 +1,136 @@
+"""
+Скользящая статистика по окнам (последние N точек, последний час, сутки)
+
+Обновляется при каждом показании за амортизированное O(1):
+min/max - монотонные очереди, среднее и дисперсия - скользящий Уэлфорд.
+"""
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .ring_buffer import METRIC_COLUMNS
+from .rollups import parse_duration
+
+
+def parse_window(spec: str) -> Tuple[Optional[int], Optional[float]]:
+    """'100' -> последние 100 точек, '1h' -> последний час."""
+    spec = spec.strip()
+    if spec.isdigit():
+        return max(1, int(spec)), None
+    return None, float(parse_duration(spec))
+
+
+class SlidingWindow:
+    """Окно по пяти метрикам одного устройства"""
+
+    def __init__(self, max_count: Optional[int] = None, max_age: Optional[float] = None):
+        self.max_count = max_count
+        self.max_age = max_age
+        self._seq = 0
+        self._items: Deque[Tuple[int, float, Tuple[float, ...]]] = deque()
+        k = len(METRIC_COLUMNS)
+        self._mins: List[Deque[Tuple[int, float]]] = [deque() for _ in range(k)]
+        self._maxs: List[Deque[Tuple[int, float]]] = [deque() for _ in range(k)]
+        self._mean = [0.0] * k
+        self._m2 = [0.0] * k
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, ts: float, values: Tuple[float, ...]) -> None:
+        seq = self._seq
+        self._seq += 1
+        self._items.append((seq, ts, values))
+        n = len(self._items)
+        for k, v in enumerate(values):
+            mins = self._mins[k]
+            while mins and mins[-1][1] >= v:
+                mins.pop()
+            mins.append((seq, v))
+            maxs = self._maxs[k]
+            while maxs and maxs[-1][1] <= v:
+                maxs.pop()
+            maxs.append((seq, v))
+
+            d = v - self._mean[k]
+            self._mean[k] += d / n
+            self._m2[k] += d * (v - self._mean[k])
+        self.evict(ts)
+
+    def _pop_oldest(self) -> None:
+        seq, _, values = self._items.popleft()
+        n = len(self._items)
+        for k, v in enumerate(values):
+            if self._mins[k][0][0] == seq:
+                self._mins[k].popleft()
+            if self._maxs[k][0][0] == seq:
+                self._maxs[k].popleft()
+            if n == 0:
+                self._mean[k] = 0.0
+                self._m2[k] = 0.0
+                continue
+            d = v - self._mean[k]
+            self._mean[k] -= d / n
+            self._m2[k] -= d * (v - self._mean[k])
+
+    def evict(self, now_ts: float) -> None:
+        if self.max_count is not None:
+            while len(self._items) > self.max_count:
+                self._pop_oldest()
+        if self.max_age is not None:
+            cutoff = now_ts - self.max_age
+            while self._items and self._items[0][1] < cutoff:
+                self._pop_oldest()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """min/max/avg/std по каждой метрике (окно должно быть непустым)."""
+        n = len(self._items)
+        result = {}
+        for k, name in enumerate(METRIC_COLUMNS):
+            variance = max(0.0, self._m2[k] / n)
+            result[name] = {
+                "min": self._mins[k][0][1],
+                "max": self._maxs[k][0][1],
+                "avg": round(self._mean[k], 1),
+                "std": round(math.sqrt(variance), 2),
+            }
+        return result
+
+
+class WindowStatsStore:
+    """Окна статистики по всем устройствам"""
+
+    def __init__(self, specs: List[str]):
+        self.specs = {spec: parse_window(spec) for spec in specs}
+        self.default_window = specs[0] if specs else None
+        self.devices: Dict[str, Dict[str, SlidingWindow]] = {}
+        # add() вызывается из потока paho, summary() - из event loop
+        self._lock = threading.Lock()
+
+    def _device(self, device_id: str) -> Dict[str, SlidingWindow]:
+        windows = self.devices.get(device_id)
+        if windows is None:
+            windows = {
+                spec: SlidingWindow(max_count, max_age)
+                for spec, (max_count, max_age) in self.specs.items()
+            }
+            self.devices[device_id] = windows
+        return windows
+
+    def add(self, device_id: str, ts: float, values: Tuple[float, ...]) -> None:
+        with self._lock:
+            for window in self._device(device_id).values():
+                window.add(ts, values)
+
+    def summary(self, device_id: str, spec: str, now_ts: float) -> Tuple[int, Optional[Dict]]:
+        """(число точек, статистика) окна на момент now_ts."""
+        with self._lock:
+            windows = self.devices.get(device_id)
+            if windows is None or spec not in windows:
+                return 0, None
+            window = windows[spec]
+            window.evict(now_ts)
+            if not len(window):
+                return 0, None
+            return len(window), window.summary()
@@ -0,0 +1,532 @@
+"""
+Нагрузочный тест конвейера приема без брокера и сети
+
+Парк ESP32 имитируется вызовами MQTTService._on_message с фейковым
+paho-клиентом и сообщениями (как из сетевого потока paho), к WebSocket
+подключаются фейковые клиенты (часть - медленные), FCM подменяется
+фейковым транспортом messaging. В конце - отчет: пропускная способность
+приема, задержка прием -> WebSocket (перцентили), лаг event loop и рост памяти.
+
+Запуск (воспроизводимый при одинаковых параметрах и --seed):
+    python -m app.loadtest --devices 1000 --rate 1 --duration 30 --clients 50 --slow-clients 5
+    python -m app.loadtest --devices 200 --rate 5 --subscribed 10 --json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import msgpack
+import numpy as np
+
+from .config import settings
+from .core.event_bus import event_bus
+from .core.history_db import HistoryStore
+from .core.log import log_stats, setup_logging, shutdown_logging
+from .core.state_backend import state_backend
+from .core.storage import storage
+from .services.alert_service import alert_service
+from .services.firebase_service import firebase_service
+from .services.mqtt_service import mqtt_service
+from .services.payload_decoders import BINARY_V1, BINARY_V2, encode_binary
+from .services.pipeline import enable_leader_consumers, handle_cluster_event, setup_pipeline, shutdown_pipeline
+from .services.push_dispatcher import push_dispatcher
+from .services.websocket_service import websocket_service
+
+# Период замера лага event loop
+LOOP_PROBE_SEC = 0.05
+# Сколько ждать опустошения очередей после остановки нагрузки
+DRAIN_TIMEOUT_SEC = 10.0
+# Значение CO у "аварийных" устройств (выше порога любого профиля)
+ALERT_CO_PPM = 150.0
+
+
+def _rss_bytes() -> int:
+    """Текущий RSS процесса (Linux: /proc, иначе - пиковый из getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _percentiles(samples, scale: float = 1000.0) -> Dict:
+    """p50/p90/p99/max в миллисекундах."""
+    if len(samples) == 0:
+        return {"count": 0}
+    values = np.frombuffer(samples, dtype=np.float64) if isinstance(samples, array) else np.asarray(samples)
+    p50, p90, p99 = np.percentile(values, (50, 90, 99)) * scale
+    return {
+        "count": int(values.size),
+        "p50_ms": round(float(p50), 2),
+        "p90_ms": round(float(p90), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(values.max()) * scale, 2),
+    }
+
+
+# --- Фейковый MQTT -----------------------------------------------------------
+
+class FakeMQTTMessage:
+    """То, что paho передает в on_message"""
+
+    __slots__ = ("topic", "payload", "qos", "retain")
+
+    def __init__(self, topic: str, payload: bytes, qos: int = 0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = False
+
+
+class FakePahoClient:
+    """Минимум API paho.mqtt.client.Client, который трогает backend"""
+
+    def __init__(self):
+        self.subscriptions: List[str] = []
+
+    def is_connected(self) -> bool:
+        return True
+
+    def subscribe(self, topic, qos: int = 0):
+        self.subscriptions.append(topic)
+        return 0, 1
+
+    def publish(self, topic, payload=None, qos: int = 0, retain: bool = False):
+        return SimpleNamespace(rc=0)
+
+    def loop_stop(self) -> None:
+        pass
+
+    def disconnect(self) -> None:
+        pass
+
+
+class DeviceFleet:
+    """Парк устройств со случайным блужданием показаний (детерминированным по seed)"""
+
+    def __init__(self, devices: int, alert_ratio: float, seed: int, fmt: str = "json"):
+        self.rng = random.Random(seed)
+        self.fmt = fmt
+        self.ids = [f"esp32_load_{i:04d}" for i in range(devices)]
+        alerting = int(round(devices * alert_ratio))
+        self.state = [
+            {
+                "temperature": self.rng.uniform(19.0, 25.0),
+                "humidity": self.rng.uniform(35.0, 55.0),
+                "co2_ppm": self.rng.uniform(450.0, 900.0),
+                "co_ppm": ALERT_CO_PPM if i < alerting else self.rng.uniform(0.0, 5.0),
+                "illuminance": self.rng.uniform(200.0, 600.0),
+            }
+            for i in range(devices)
+        ]
+
+    def payload(self, index: int) -> bytes:
+        s = self.state[index]
+        rng = self.rng
+        s["temperature"] += rng.uniform(-0.05, 0.05)
+        s["humidity"] += rng.uniform(-0.2, 0.2)
+        s["co2_ppm"] = max(400.0, s["co2_ppm"] + rng.uniform(-5.0, 5.0))
+        s["illuminance"] = max(0.0, s["illuminance"] + rng.uniform(-3.0, 3.0))
+        device_id = self.ids[index]
+        if self.fmt == "msgpack":
+            return msgpack.packb({**s, "device_id": device_id})
+        if self.fmt in ("binary", "binary-v2"):
+            data = {**s, "lux": s["illuminance"]}
+            return encode_binary(data, BINARY_V2 if self.fmt == "binary-v2" else BINARY_V1, device_id)
+        return json.dumps({**s, "device_id": device_id}).encode("utf-8")
+
+
+class MQTTDriver(threading.Thread):
+    """Один поток, как сетевой поток paho: равномерный поток сообщений всего парка"""
+
+    def __init__(self, fleet: DeviceFleet, rate_hz: float, duration: float):
+        super().__init__(name="loadtest-mqtt", daemon=True)
+        self.fleet = fleet
+        self.total_rate = rate_hz * len(fleet.ids)
+        self.duration = duration
+        # Топик каждого устройства по первому шаблону подписки (iot/microclimate/<id>/data)
+        pattern = mqtt_service.patterns[0]
+        self.topics = [pattern.topic_for(device_id) for device_id in fleet.ids]
+        self.client = FakePahoClient()
+        self.sent = 0
+        self.elapsed = 0.0
+        # Время обработки одного сообщения в _on_message (сек)
+        self.handle_times = array("d")
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        fleet = self.fleet
+        n = len(fleet.ids)
+        interval = 1.0 / self.total_rate
+        on_message = mqtt_service._on_message
+        start = time.perf_counter()
+        deadline = start + self.duration
+        i = 0
+        while not self._halt.is_set():
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            due = start + i * interval
+            if due > now:
+                # Спим только ощутимые паузы, мелкие - набираем пачкой
+                if due - now > 0.002:
+                    time.sleep(due - now)
+                continue
+            msg = FakeMQTTMessage(self.topics[i % n], fleet.payload(i % n))
+            t0 = time.perf_counter()
+            on_message(self.client, None, msg)
+            self.handle_times.append(time.perf_counter() - t0)
+            i += 1
+        self.sent = i
+        self.elapsed = time.perf_counter() - start
+
+    def stop(self) -> None:
+        self._halt.set()
+
+
+# --- Фейковый WebSocket ------------------------------------------------------
+
+class LatencyRecorder:
+    """Задержка от приема показания (timestamp показания) до отправки клиенту"""
+
+    def __init__(self):
+        self.samples = array("d")
+        # Кадр без подписки один на всех клиентов - разбираем его один раз
+        self._frame_ts: Dict[str, float] = {}
+
+    def _ts_of(self, frame) -> Optional[float]:
+        if isinstance(frame, bytes):
+            data = msgpack.unpackb(frame, raw=False)
+        else:
+            ts = self._frame_ts.get(frame)
+            if ts is not None:
+                return ts
+            data = json.loads(frame)
+        stamp = data.get("timestamp") if isinstance(data, dict) else None
+        if stamp is None:
+            return None
+        ts = datetime.fromisoformat(stamp).timestamp()
+        if isinstance(frame, str):
+            if len(self._frame_ts) > 10_000:
+                self._frame_ts.clear()
+            self._frame_ts[frame] = ts
+        return ts
+
+    def record(self, frame) -> None:
+        ts = self._ts_of(frame)
+        if ts is not None:
+            self.samples.append(time.time() - ts)
+
+
+class FakeWebSocket:
+    """Клиент с API starlette WebSocket; медленный ждет send_delay на каждом кадре"""
+
+    def __init__(self, recorder: LatencyRecorder, send_delay: float = 0.0):
+        self.recorder = recorder
+        self.send_delay = send_delay
+        self.received = 0
+        self.closed_code: Optional[int] = None
+
+    async def accept(self) -> None:
+        pass
+
+    async def _deliver(self, frame) -> None:
+        if self.closed_code is not None:
+            raise RuntimeError("websocket closed")
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.received += 1
+        self.recorder.record(frame)
+
+    async def send_text(self, data: str) -> None:
+        await self._deliver(data)
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self._deliver(data)
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        self.closed_code = code
+
+
+# --- Фейковый FCM ------------------------------------------------------------
+
+class FakeMessaging:
+    """Транспорт firebase_admin.messaging: все токены доставлены за latency секунд"""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.calls = 0
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _message(**kwargs):
+        return SimpleNamespace(**kwargs)
+
+    MulticastMessage = Notification = AndroidConfig = AndroidNotification = _message
+    APNSConfig = APNSPayload = Aps = _message
+
+    def send_each_for_multicast(self, message):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            self.tokens += len(message.tokens)
+        responses = [SimpleNamespace(success=True, exception=None) for _ in message.tokens]
+        return SimpleNamespace(
+            responses=responses,
+            success_count=len(responses),
+            failure_count=0,
+        )
+
+
+# --- Прогон ------------------------------------------------------------------
+
+class LoopProbe:
+    """Лаг event loop и пиковый RSS, замеряемые периодической задачей"""
+
+    def __init__(self):
+        self.lags = array("d")
+        self.peak_rss = _rss_bytes()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        expected = loop.time() + LOOP_PROBE_SEC
+        while True:
+            await asyncio.sleep(LOOP_PROBE_SEC)
+            now = loop.time()
+            self.lags.append(max(0.0, now - expected))
+            expected = now + LOOP_PROBE_SEC
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+
+def _dispatcher_idle() -> bool:
+    stats = push_dispatcher.stats()
+    return stats["queue_depth"] == 0 and stats["in_flight"] == 0
+
+
+def _queues_empty() -> bool:
+    consumers = event_bus.stats()["consumers"].values()
+    return all(c["depth"] == 0 for c in consumers) and _dispatcher_idle()
+
+
+async def run_load_test(args: argparse.Namespace) -> Dict:
+    loop = asyncio.get_running_loop()
+    rss_start = _rss_bytes()
+
+    # FCM: фейковый транспорт и токены получателя алертов (только в памяти)
+    fake_fcm = FakeMessaging(latency=args.fcm_latency)
+    firebase_service.messaging = fake_fcm
+    firebase_service._initialized = True
+    for k in range(args.fcm_tokens):
+        firebase_service.tokens.add(settings.FCM_DEFAULT_USER_ID, f"loadtest-token-{k}", persist=False)
+
+    history = None
+    if args.history_db:
+        history = HistoryStore(args.history_db, settings.HISTORY_DB_BATCH_SIZE, settings.HISTORY_DB_FLUSH_SEC)
+        if history.start():
+            storage.attach_history_store(history)
+
+    # Как startup в main.py, но без брокера: этот процесс - лидер
+    setup_pipeline(loop)
+    state_backend.start(handle_cluster_event, lambda: (push_dispatcher.start(), enable_leader_consumers()))
+
+    recorder = LatencyRecorder()
+    sockets: List[FakeWebSocket] = []
+    for i in range(args.clients):
+        slow = i < args.slow_clients
+        ws = FakeWebSocket(recorder, args.slow_delay if slow else 0.0)
+        client = await websocket_service.connect(ws)
+        if client is None:
+            continue
+        if i >= args.clients - args.subscribed:
+            websocket_service.handle_message(client, json.dumps({
+                "type": "subscribe", "format": "msgpack", "delta": True, "max_rate": args.subscribed_rate,
+            }))
+        sockets.append(ws)
+
+    fleet = DeviceFleet(args.devices, args.alert_ratio, args.seed, args.payload)
+    driver = MQTTDriver(fleet, args.rate, args.duration)
+    mqtt_service.client = driver.client
+    mqtt_service.event_loop = loop
+
+    probe = LoopProbe()
+    probe.start()
+    driver.start()
+    await asyncio.to_thread(driver.join)
+
+    drain_start = time.perf_counter()
+    while not _queues_empty() and time.perf_counter() - drain_start < DRAIN_TIMEOUT_SEC:
+        await asyncio.sleep(0.05)
+    drain_sec = time.perf_counter() - drain_start
+    # Последние кадры клиентов
+    await asyncio.sleep(0.2)
+    await probe.stop()
+
+    bus = event_bus.stats()
+    ws_stats = websocket_service.stats()
+    report = {
+        "params": {
+            "devices": args.devices,
+            "rate_hz": args.rate,
+            "duration_sec": args.duration,
+            "clients": args.clients,
+            "slow_clients": args.slow_clients,
+            "subscribed": args.subscribed,
+            "payload": args.payload,
+            "seed": args.seed,
+        },
+        "ingest": {
+            "target_msg_per_sec": round(driver.total_rate, 1),
+            "sent": driver.sent,
+            "msg_per_sec": round(driver.sent / driver.elapsed, 1) if driver.elapsed else 0.0,
+            "on_message": _percentiles(driver.handle_times),
+            "drain_sec": round(drain_sec, 3),
+            "published": bus["published"],
+            "consumers": {
+                name: {k: c[k] for k in ("processed", "dropped", "coalesced", "blocked", "max_lag_sec", "errors")}
+                for name, c in bus["consumers"].items()
+            },
+        },
+        "websocket": {
+            "latency": _percentiles(recorder.samples),
+            "frames": sum(ws.received for ws in sockets),
+            "connected": ws_stats["clients"],
+            "evicted": websocket_service.evicted,
+        },
+        "event_loop_lag": _percentiles(probe.lags),
+        "memory": {
+            "rss_start_mb": round(rss_start / 2**20, 1),
+            "rss_peak_mb": round(probe.peak_rss / 2**20, 1),
+            "rss_end_mb": round(_rss_bytes() / 2**20, 1),
+            "measurements": storage.measurements_count(),
+        },
+        "alerts": alert_service.stats(),
+        "push": {
+            "dispatcher": push_dispatcher.stats(),
+            "fcm_calls": fake_fcm.calls,
+            "fcm_tokens": fake_fcm.tokens,
+        },
+        "logging": log_stats(),
+    }
+
+    for client in list(websocket_service.clients.values()):
+        await websocket_service.disconnect(client)
+    state_backend.stop()
+    shutdown_pipeline()
+    push_dispatcher.stop()
+    firebase_service.stop()
+    if history is not None:
+        history.stop()
+    return report
+
+
+def _print_report(report: Dict) -> None:
+    ingest = report["ingest"]
+    ws = report["websocket"]
+    lag = report["event_loop_lag"]
+    mem = report["memory"]
+    print("=" * 70)
+    print(f"📊 Нагрузочный тест: {report['params']}")
+    print("=" * 70)
+    print(
+        f"📥 Прием: {ingest['msg_per_sec']} msg/s (цель {ingest['target_msg_per_sec']}), "
+        f"отправлено {ingest['sent']}, очереди опустели за {ingest['drain_sec']} с"
+    )
+    print(f"   _on_message: {ingest['on_message']}")
+    for name, c in ingest["consumers"].items():
+        print(f"   {name}: {c}")
+    print(
+        f"📡 WebSocket: кадров {ws['frames']}, клиентов {ws['connected']}, отключено медленных {ws['evicted']}"
+    )
+    print(f"   задержка прием -> клиент: {ws['latency']}")
+    print(f"⏱️ Лаг event loop: {lag}")
+    print(
+        f"💾 Память: RSS {mem['rss_start_mb']} -> {mem['rss_end_mb']} МБ "
+        f"(пик {mem['rss_peak_mb']}), показаний в памяти {mem['measurements']}"
+    )
+    push = report["push"]
+    print(f"📝 Логи: {report['logging']}")
+    print(
+        f"🔔 Алерты: сработало {report['alerts']['fired']}, "
+        f"FCM вызовов {push['fcm_calls']}, токенов {push['fcm_tokens']}"
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест конвейера приема (без брокера и сети)")
+    parser.add_argument("--devices", type=int, default=1000, help="число устройств")
+    parser.add_argument("--rate", type=float, default=1.0, help="показаний в секунду на устройство")
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность нагрузки, сек")
+    parser.add_argument("--clients", type=int, default=50, help="WebSocket клиентов")
+    parser.add_argument("--slow-clients", type=int, default=5, help="из них медленных")
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="задержка медленного клиента на кадр, сек")
+    parser.add_argument("--subscribed", type=int, default=0, help="клиентов с подпиской msgpack/delta")
+    parser.add_argument("--subscribed-rate", type=float, default=2.0, help="max_rate подписанных клиентов, Гц")
+    parser.add_argument("--alert-ratio", type=float, default=0.01, help="доля устройств вне нормы (CO)")
+    parser.add_argument("--fcm-tokens", type=int, default=3, help="токенов у получателя алертов")
+    parser.add_argument("--fcm-latency", type=float, default=0.05, help="задержка фейкового FCM, сек")
+    parser.add_argument("--history-db", nargs="?", const="", default=None,
+                        help="писать историю в SQLite (без пути - временный файл)")
+    parser.add_argument("--payload", choices=("json", "msgpack", "binary", "binary-v2"), default="json",
+                        help="формат сообщений устройств")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="отчет в JSON")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи сервиса")
+    args = parser.parse_args(argv)
+    if args.devices < 1 or args.rate <= 0 or args.duration <= 0:
+        parser.error("--devices, --rate и --duration должны быть положительными")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    args = parse_args(argv)
+    tmp_dir = None
+    if args.history_db == "":
+        tmp_dir = tempfile.TemporaryDirectory(prefix="loadtest-")
+        args.history_db = os.path.join(tmp_dir.name, "history.db")
+
+    # Логи сервиса пишутся как в проде (очередь + поток записи), но в /dev/null:
+    # их стоимость остается в замерах, а отчет не тонет в строках
+    sink = None if args.verbose else open(os.devnull, "w")
+    setup_logging(stream=sink)
+    try:
+        report = asyncio.run(run_load_test(args))
+    finally:
+        shutdown_logging()
+        if sink is not None:
+            sink.close()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,43 @@
 Главный файл FastAPI приложения
 """
 import asyncio
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
 
-from .config import settings
-from .services.mqtt_service import mqtt_service
-from .services.firebase_service import firebase_service
-from .core.storage import storage
+# Профиль запуска импортируется первым: дальше замеряются фазы импорта
+from .core.startup_profile import startup_profile
+
+with startup_profile.phase("settings"):
+    from .config import settings
+
+with startup_profile.phase("imports"):
+    from fastapi import FastAPI
+    from fastapi.middleware.cors import CORSMiddleware
+
+    from .services.mqtt_service import mqtt_service
+    from .services.firebase_service import firebase_service
+    from .core.storage import storage
+    from .core.history_db import history_store
+    from .core.event_bus import event_bus
+    from .core.integrations import integrations
+    from .core.log import get_logger, log_stats, setup_logging, shutdown_logging
+    from .core.metrics import loop_lag_monitor
+    from .core.state_backend import state_backend
+    from .core.token_store import token_store
+    from .services.pipeline import (
+        enable_leader_consumers,
+        handle_cluster_event,
+        setup_pipeline,
+        shutdown_pipeline,
+    )
+    from .services.push_dispatcher import push_dispatcher
+    from .services.websocket_service import websocket_service
+    from .services.ingest_service import ingest_service
+    from .api.response_cache import response_cache
+    from .api.http_metrics import HttpMetricsMiddleware
 
-# Импорт роутеров
-from .api.routes import climate, profiles, history, test, push
+    # Импорт роутеров
+    from .api.routes import climate, profiles, history, test, push, ingest, metrics
 
+log = get_logger("main")
 
 app = FastAPI(
     title=settings.APP_NAME,
@@ -30,6 +55,7 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],
 )
+app.add_middleware(HttpMetricsMiddleware)
 
 
 # Подключение роутеров
@@ -38,36 +64,77 @@ app.include_router(profiles.router)
 app.include_router(history.router)
 app.include_router(test.router)
 app.include_router(push.router)
+app.include_router(ingest.router)
+app.include_router(metrics.router)
+
+
+def _start_leader(loop: asyncio.AbstractEventLoop) -> None:
+    """Этот процесс стал лидером: запись истории, алерты и подписка MQTT."""
+    if settings.HISTORY_DB_ENABLED:
+        history_store.start()
+    push_dispatcher.start()
+    enable_leader_consumers()
+
+    # Настройка и запуск MQTT
+    mqtt_service.setup(loop)
+
+    with startup_profile.phase("mqtt_connect"):
+        connected = mqtt_service.connect()
+    if connected:
+        log.info("✅ MQTT клиент запущен")
+        log.info("📡 HiveMQ Cloud: %s:%s", settings.MQTT_HOST, settings.MQTT_PORT)
+        log.info("📬 Топики: %s", ", ".join(mqtt_service.subscriptions()), extra={"qos": mqtt_service.qos})
+    else:
+        log.warning("⚠️ Backend работает без MQTT")
 
 
 @app.on_event("startup")
 async def startup_event():
-    print("\n" + "=" * 70)
-    print(f"🚀 {settings.APP_NAME} v{settings.APP_VERSION}")
-    print("=" * 70)
+    setup_logging()
+    log.info("🚀 %s v%s", settings.APP_NAME, settings.APP_VERSION)
 
-    # Инициализация Firebase/FCM
-    firebase_service.init_firebase()
+    # Постоянная история (SQLite): читают все воркеры, пишет только лидер
+    with startup_profile.phase("history"):
+        if settings.HISTORY_DB_ENABLED and history_store.start(writer=False):
+            storage.attach_history_store(history_store)
+            log.info("💾 История: %s (%s записей загружено)", settings.HISTORY_DB_PATH, storage.measurements_count())
 
-    # Настройка и запуск MQTT
+    # Реестр FCM токенов (общий файл для всех воркеров)
+    with startup_profile.phase("push_tokens"):
+        if token_store.start():
+            log.info("🔑 FCM токены: %s (%s пользователей)", token_store.tokens_count(), token_store.users_count())
+
+    # Инициализация Firebase/FCM (SDK загружается только при FCM_ENABLED)
+    with startup_profile.phase("init_firebase"):
+        firebase_service.init_firebase()
+
+    # Конвейер приема: шина событий и ее потребители
     loop = asyncio.get_event_loop()
-    mqtt_service.setup(loop)
+    with startup_profile.phase("pipeline"):
+        setup_pipeline(loop)
+    loop_lag_monitor.start()
 
-    if mqtt_service.connect():
-        print("✅ MQTT клиент запущен")
-        print(f"📡 HiveMQ Cloud: {settings.MQTT_HOST}:{settings.MQTT_PORT}")
-        print(f"📬 Топик: {settings.MQTT_TOPIC}")
-    else:
-        print("⚠️ Backend работает без MQTT")
+    # Выборы лидера (для memory - сразу этот процесс, включая подключение MQTT)
+    with startup_profile.phase("cluster"):
+        state_backend.start(handle_cluster_event, lambda: _start_leader(loop))
 
-    print("=" * 70 + "\n")
+    startup_profile.mark_ready()
+    log.info("⏱️ Запуск: %s", startup_profile.summary(), extra=startup_profile.report())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    print("\n🛑 Остановка сервиса...")
+    log.info("🛑 Остановка сервиса...")
     mqtt_service.disconnect()
-    print("✅ Сервис остановлен")
+    state_backend.stop()
+    loop_lag_monitor.stop()
+    shutdown_pipeline()
+    push_dispatcher.stop()
+    firebase_service.stop()
+    token_store.stop()
+    history_store.stop()
+    log.info("✅ Сервис остановлен")
+    shutdown_logging()
 
 
 @app.get("/")
@@ -77,24 +144,31 @@ async def root():
         "version": settings.APP_VERSION,
         "status": "online",
         "parameters": ["temperature", "humidity", "co2_ppm", "co_ppm", "lux"],
-        "mqtt": {
-            "broker": settings.MQTT_HOST,
-            "port": settings.MQTT_PORT,
-            "topic": settings.MQTT_TOPIC,
-            "connected": mqtt_service.client.is_connected() if mqtt_service.client else False
-        },
-        "websockets": len(storage.active_websockets),
+        "mqtt": mqtt_service.describe(),
+        "websockets": websocket_service.stats(),
         "last_update": storage.current_data.get("timestamp"),
-        "measurements": len(storage.data_history)
+        "measurements": storage.measurements_count(),
+        "devices": len(storage.devices),
+        "anomalies": storage.anomalies.stats(),
+        "pipeline": event_bus.stats(),
+        "ingest": ingest_service.stats(),
+        "response_cache": response_cache.stats(),
+        "cluster": state_backend.stats(),
+        "logging": log_stats(),
+        "integrations": integrations.stats(),
+        "startup": startup_profile.report()
     }
 
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(
         "app.main:app",
         host=settings.SERVER_HOST,     # совет: поставь 0.0.0.0 если нужно с телефона
         port=settings.SERVER_PORT,
-        reload=settings.DEBUG,
+        reload=settings.DEBUG and settings.WEB_WORKERS == 1,
+        workers=settings.WEB_WORKERS,
         log_level="info",
         ws_ping_interval=30,
         ws_ping_timeout=60,
@@ -1,11 +1,21 @@
 """
 AI сервис для прогнозирования
 """
-from typing import List
+from typing import Dict, List, Tuple
+
+from ..core.profile_eval import evaluator_for
+from ..core.regression import RegressionSnapshot
+
+# Ограничение кэша прогнозов (ключей device/metric/steps)
+FORECAST_CACHE_SIZE = 10_000
 
 
 class AIService:
     """Сервис AI прогнозов"""
+
+    def __init__(self):
+        # (device_id, metric, steps_ahead) -> (версия данных, прогноз)
+        self._forecast_cache: Dict[Tuple[str, str, int], Tuple[int, float]] = {}
     
     @staticmethod
     def predict_linear(data_points: List[float], steps_ahead: int = 1) -> float:
@@ -43,6 +53,65 @@ class AIService:
         prediction = slope * (n + steps) + intercept
         
         return round(prediction, 1)
+
+    @staticmethod
+    def predict_from_state(state: RegressionSnapshot, steps_ahead: int = 1) -> float:
+        """
+        Тот же прогноз, что и predict_linear, но по готовым суммам окна за O(1)
+        
+        Args:
+            state: Срез потокового состояния регрессии
+            steps_ahead: На сколько шагов вперед прогноз
+            
+        Returns:
+            Прогнозируемое значение
+        """
+        n = state.n
+        if n < 5:
+            return state.last if n else 0.0
+
+        sum_x = n * (n - 1) // 2
+        sum_xx = (n - 1) * n * (2 * n - 1) // 6
+
+        denominator = (n * sum_xx - sum_x * sum_x)
+        if denominator == 0:
+            return round(state.last, 1)
+
+        slope = (n * state.sum_xy - sum_x * state.sum_y) / denominator
+        intercept = (state.sum_y - slope * sum_x) / n
+
+        steps = max(1, int(steps_ahead))
+        prediction = slope * (n + steps) + intercept
+
+        return round(prediction, 1)
+
+    def forecast(
+        self,
+        device_id: str,
+        states: Dict[str, RegressionSnapshot],
+        steps_ahead: int,
+    ) -> Dict[str, float]:
+        """
+        Прогнозы по всем метрикам устройства с кэшированием
+        
+        Результат для (device, metric, steps_ahead) пересчитывается,
+        только когда с устройства пришло новое показание.
+        """
+        cache = self._forecast_cache
+        if len(cache) > FORECAST_CACHE_SIZE:
+            cache.clear()
+
+        result = {}
+        for metric, state in states.items():
+            key = (device_id, metric, steps_ahead)
+            cached = cache.get(key)
+            if cached is not None and cached[0] == state.version:
+                result[metric] = cached[1]
+                continue
+            value = self.predict_from_state(state, steps_ahead)
+            cache[key] = (state.version, value)
+            result[metric] = value
+        return result
     
     @staticmethod
     def calculate_mc_score(current_data: dict, profile: dict) -> int:
@@ -59,27 +128,16 @@ class AIService:
         if current_data["timestamp"] is None:
             return 0
         
-        score = 100
-        temp = current_data["temperature"]
-        hum = current_data["humidity"]
-        co2 = current_data["co2_ppm"]
-        co = current_data["co_ppm"]
-        lux = current_data["lux"]
-        
-        # Штрафы за выход из нормы
-        if temp < profile["temp_min"] or temp > profile["temp_max"]:
-            score -= 15
-        if hum > profile["humidity_max"]:
-            score -= 15
-        if co2 > profile["co2_max"]:
-            score -= 20
-        co_max = profile.get("co_max")
-        if co_max is not None and co > co_max:
-            score -= 25
-        if lux < profile["lux_min"] or lux > profile["lux_max"]:
-            score -= 10
-        
-        return max(0, min(100, score))
+        # Штрафы за выход из нормы - по скомпилированному профилю
+        evaluator = evaluator_for(profile)
+        mask = evaluator.mask_of((
+            current_data["temperature"],
+            current_data["humidity"],
+            current_data["co2_ppm"],
+            current_data["co_ppm"],
+            current_data["lux"],
+        ))
+        return evaluator.score_of_mask(mask)
 
 
 # Глобальный экземпляр сервиса
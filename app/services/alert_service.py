@@ -0,0 +1,121 @@
+"""
+Сервис алертов: решает, когда отправлять push при выходе из нормы
+"""
+from ..config import settings
+from ..core.alert_rules import AlertEngine, Rule
+from ..core.log import get_logger
+from ..core.ring_buffer import ISSUE_BITS
+from ..core.storage import storage
+from .push_dispatcher import push_dispatcher
+
+log = get_logger("alerts")
+
+RATE_LABELS = {
+    "co_ppm": ("CO", "ppm"),
+    "co2_ppm": ("CO2", "ppm"),
+}
+
+
+class AlertService:
+    """Push-алерты по правилам профиля (гистерезис, debounce, скорость роста, cooldown)"""
+
+    def __init__(self):
+        self.engine = AlertEngine(
+            debounce_sec=settings.ALERT_DEBOUNCE_SEC,
+            cooldown_sec=max(0, int(settings.FCM_DANGER_REMINDER_SEC)),
+        )
+
+    def _build_alert_message(
+        self,
+        data: dict,
+        profile: dict,
+        issues: list[str],
+        rising: list[tuple[str, float, float]] = (),
+    ) -> str:
+        """Формирует понятный текст уведомления по профилю и отклонениям."""
+        profile_name = profile.get("name", "Профиль")
+        parts: list[str] = []
+
+        temp = float(data.get("temperature", 0))
+        hum = float(data.get("humidity", 0))
+        co2 = float(data.get("co2_ppm", 0))
+        co = float(data.get("co_ppm", data.get("co", 0)))
+        lux = float(data.get("lux", 0))
+
+        if "temperature" in issues:
+            tmin = profile.get("temp_min")
+            tmax = profile.get("temp_max")
+            parts.append(f"температура {temp:.1f}°C (норма {tmin}-{tmax}°C)")
+        if "humidity" in issues:
+            hmax = profile.get("humidity_max")
+            parts.append(f"влажность {hum:.0f}% (макс {hmax}%)")
+        if "co2_ppm" in issues:
+            cmax = profile.get("co2_max")
+            parts.append(f"CO2 {co2:.0f} ppm (макс {cmax})")
+        if "co_ppm" in issues:
+            comax = profile.get("co_max")
+            parts.append(f"CO {co:.1f} ppm (макс {comax})")
+        if "lux" in issues:
+            lmin = profile.get("lux_min")
+            lmax = profile.get("lux_max")
+            parts.append(f"освещенность {lux:.0f} lx (норма {lmin}-{lmax})")
+        for metric, rate, limit in rising:
+            label, unit = RATE_LABELS.get(metric, (metric, ""))
+            parts.append(f"{label} растет на {rate:.1f} {unit}/мин (порог {limit:g})")
+
+        if not parts:
+            parts.append("есть отклонение параметров")
+
+        return f"{profile_name}: {', '.join(parts)}. Проверьте помещение."
+
+    def handle_reading(self, data: dict) -> None:
+        """Потребитель шины: push в FCM, когда срабатывает правило алерта."""
+        device_id = data["device_id"]
+        self.engine.set_profile(storage.active_profile, storage.profile_version)
+        fired = self.engine.process(
+            device_id,
+            data["ts"],
+            (data["temperature"], data["humidity"], data["co2_ppm"], data["co_ppm"], data["lux"]),
+        )
+        if not fired:
+            return
+
+        profile = storage.active_profile or {}
+        issues = [m for m in ISSUE_BITS if any(not r.rate and r.metric == m for r in fired)]
+        rising = [
+            (r.metric, self.engine.rate_of(device_id, r.metric), r.limit)
+            for r in fired if r.rate
+        ]
+        rules_text = ", ".join(r.name for r in fired)
+        issues_text = ", ".join(issues) if issues else "параметры"
+        message_body = self._build_alert_message(data, profile, issues, rising)
+        target_user_id = settings.FCM_DEFAULT_USER_ID
+        # Отправка - в пуле диспетчера, здесь только постановка в очередь
+        queued = push_dispatcher.submit(
+            user_id=target_user_id,
+            title="Микроклимат: вне нормы",
+            body=message_body,
+            data={
+                "type": "danger",
+                "device_id": device_id,
+                "profile_name": str(profile.get("name", "")),
+                "issues": issues_text,
+                "rules": rules_text,
+                "temperature": f"{data['temperature']:.1f}",
+                "humidity": f"{data['humidity']:.0f}",
+                "co2_ppm": f"{data['co2_ppm']:.0f}",
+                "co_ppm": f"{data['co_ppm']:.1f}",
+                "lux": f"{data['lux']:.0f}",
+            },
+        )
+        log.info(
+            "🔔 FCM alert",
+            extra={"device_id": device_id, "user_id": target_user_id, "queued": queued, "rules": rules_text},
+        )
+
+    def stats(self) -> dict:
+        return self.engine.stats()
+
+
+# Глобальный экземпляр сервиса
+alert_service = AlertService()
@@ -1,15 +1,46 @@
 """
 FCM сервис: регистрация device token и отправка push-уведомлений.
+
+Токены хранятся в постоянном реестре (core.token_store). Отправка режется
+на multicast-пакеты по FCM_MULTICAST_LIMIT токенов, пакеты уходят
+параллельно (не больше PUSH_FANOUT_WORKERS одновременно), недействительные
+токены удаляются одним пакетом после рассылки.
+
+Firebase Admin SDK (вместе с grpc и клиентами Google Cloud) импортируется
+интеграцией "firebase" только при FCM_ENABLED и первом обращении.
 """
-from collections import defaultdict
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from threading import Lock
-from typing import Dict, List, Set
-
-import firebase_admin
-from firebase_admin import credentials, messaging
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
 
 from ..config import settings
+from ..core.integrations import integrations
+from ..core.log import get_logger
+from ..core.metrics import FCM_SEND_SECONDS, FCM_TOKENS
+from ..core.state_backend import state_backend
+from ..core.token_store import token_store
+
+log = get_logger("fcm")
+
+# Предел FCM на один multicast-запрос
+FCM_MULTICAST_LIMIT = 500
+
+
+def _load_firebase_sdk() -> SimpleNamespace:
+    import firebase_admin
+    from firebase_admin import credentials, messaging
+
+    return SimpleNamespace(app=firebase_admin, credentials=credentials, messaging=messaging)
+
+
+firebase_sdk = integrations.register("firebase", lambda: settings.FCM_ENABLED, _load_firebase_sdk)
+
+
+def _chunks(tokens: List[str], size: int = FCM_MULTICAST_LIMIT) -> List[List[str]]:
+    return [tokens[i:i + size] for i in range(0, len(tokens), size)]
 
 
 class FirebaseService:
@@ -17,96 +48,107 @@ class FirebaseService:
 
     def __init__(self):
         self._lock = Lock()
-        self._user_tokens: Dict[str, Set[str]] = defaultdict(set)
         self._initialized = False
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.tokens = token_store
+        self._messaging: Any = None
+
+    @property
+    def messaging(self) -> Any:
+        """Транспорт FCM (в тестах можно подменить фейком с тем же API)."""
+        if self._messaging is None:
+            sdk = firebase_sdk.get()
+            if sdk is None:
+                raise RuntimeError("Firebase Admin SDK не загружен")
+            self._messaging = sdk.messaging
+        return self._messaging
+
+    @messaging.setter
+    def messaging(self, value: Any) -> None:
+        self._messaging = value
 
     def init_firebase(self) -> bool:
         """Инициализирует Firebase Admin SDK (один раз)."""
         if not settings.FCM_ENABLED:
-            print("ℹ️ FCM отключен (FCM_ENABLED=False)")
+            log.info("ℹ️ FCM отключен (FCM_ENABLED=False)")
             return False
 
         credentials_path = settings.FIREBASE_CREDENTIALS_PATH
         if not credentials_path:
-            print("⚠️ FCM включен, но FIREBASE_CREDENTIALS_PATH не задан")
+            log.warning("⚠️ FCM включен, но FIREBASE_CREDENTIALS_PATH не задан")
+            return False
+
+        sdk = firebase_sdk.get()
+        if sdk is None:
+            log.error("❌ Firebase Admin SDK не установлен: %s", firebase_sdk.error)
             return False
 
         try:
-            firebase_admin.get_app()
+            sdk.app.get_app()
             self._initialized = True
-            print("✅ Firebase уже инициализирован")
+            log.info("✅ Firebase уже инициализирован")
             return True
         except ValueError:
             pass
 
         cred_file = Path(credentials_path)
         if not cred_file.exists():
-            print(f"⚠️ Файл Firebase credentials не найден: {cred_file}")
+            log.warning("⚠️ Файл Firebase credentials не найден: %s", cred_file)
             return False
 
         try:
-            cred = credentials.Certificate(str(cred_file))
-            firebase_admin.initialize_app(cred)
+            cred = sdk.credentials.Certificate(str(cred_file))
+            sdk.app.initialize_app(cred)
             self._initialized = True
-            print("✅ Firebase инициализирован")
+            log.info("✅ Firebase инициализирован")
             return True
         except Exception as e:
-            print(f"❌ Ошибка инициализации Firebase: {e}")
+            log.error("❌ Ошибка инициализации Firebase: %s", e)
             return False
 
-    def register_token(self, user_id: str, token: str) -> int:
+    def register_token(self, user_id: str, token: str, platform: str = "android") -> int:
         """Регистрирует FCM токен и возвращает текущее количество токенов пользователя."""
-        with self._lock:
-            self._user_tokens[user_id].add(token)
-            return len(self._user_tokens[user_id])
+        total = self.tokens.add(user_id, token, platform)
+        state_backend.publish({"type": "push_token", "action": "register", "user_id": user_id, "token": token})
+        return total
 
     def unregister_token(self, user_id: str, token: str) -> int:
         """Удаляет FCM токен пользователя и возвращает оставшееся количество."""
-        with self._lock:
-            tokens = self._user_tokens.get(user_id)
-            if not tokens:
-                return 0
-            tokens.discard(token)
-            if not tokens:
-                self._user_tokens.pop(user_id, None)
-                return 0
-            return len(tokens)
+        total = self.tokens.remove(user_id, token)
+        state_backend.publish({"type": "push_token", "action": "unregister", "user_id": user_id, "token": token})
+        return total
 
     def get_tokens_count(self, user_id: str) -> int:
-        with self._lock:
-            return len(self._user_tokens.get(user_id, set()))
+        return self.tokens.count(user_id)
 
     def get_users_count(self) -> int:
-        with self._lock:
-            return len(self._user_tokens)
+        return self.tokens.users_count()
 
-    def _remove_invalid_tokens(self, user_id: str, invalid_tokens: List[str]) -> None:
+    def _remove_invalid_tokens(self, invalid_tokens: List[str]) -> None:
         if not invalid_tokens:
             return
-        with self._lock:
-            tokens = self._user_tokens.get(user_id)
-            if not tokens:
-                return
-            for token in invalid_tokens:
-                tokens.discard(token)
-            if not tokens:
-                self._user_tokens.pop(user_id, None)
-
-    def send_push_to_user(self, user_id: str, title: str, body: str, data: Dict[str, str] | None = None) -> bool:
-        """Отправляет push указанному пользователю."""
-        if not self._initialized:
-            if not self.init_firebase():
-                print(f"⚠️ FCM не отправлен: Firebase не инициализирован (user_id={user_id})")
-                return False
+        removed = self.tokens.remove_many(invalid_tokens)
+        if removed:
+            log.info("🧹 FCM: удалены недействительные токены", extra={"removed": removed})
+            state_backend.publish({"type": "push_tokens_removed", "tokens": invalid_tokens})
 
+    def _pool(self) -> ThreadPoolExecutor:
         with self._lock:
-            tokens = list(self._user_tokens.get(user_id, set()))
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=max(1, settings.PUSH_FANOUT_WORKERS),
+                    thread_name_prefix="fcm-send",
+                )
+            return self._executor
 
-        if not tokens:
-            print(f"⚠️ FCM не отправлен: нет токенов для user_id={user_id}")
-            return False
+    def _ensure_initialized(self) -> bool:
+        if self._initialized:
+            return True
+        return self.init_firebase()
 
-        message = messaging.MulticastMessage(
+    def _build_message(self, title: str, body: str, data: Dict[str, str] | None, tokens: List[str]):
+        messaging = self.messaging
+        return messaging.MulticastMessage(
             notification=messaging.Notification(title=title, body=body),
             data=data or {},
             tokens=tokens,
@@ -125,38 +167,166 @@ class FirebaseService:
             ),
         )
 
+    def _send_chunk(
+        self,
+        tokens: List[str],
+        title: str,
+        body: str,
+        data: Dict[str, str] | None,
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Один multicast-запрос (не больше FCM_MULTICAST_LIMIT токенов).
+
+        Returns:
+            (доставленные токены, недействительные токены)
+        """
+        started = time.perf_counter()
         try:
-            response = messaging.send_each_for_multicast(message)
-            invalid_tokens: List[str] = []
-            for idx, resp in enumerate(response.responses):
-                if resp.success:
-                    continue
-                code = getattr(resp.exception, "code", "") if resp.exception else ""
+            response = self.messaging.send_each_for_multicast(self._build_message(title, body, data, tokens))
+        except Exception:
+            FCM_SEND_SECONDS.labels("error").observe(time.perf_counter() - started)
+            FCM_TOKENS.labels("error").inc(len(tokens))
+            raise
+        FCM_SEND_SECONDS.labels("ok").observe(time.perf_counter() - started)
+        delivered: List[str] = []
+        invalid: List[str] = []
+        for idx, resp in enumerate(response.responses):
+            if resp.success:
+                delivered.append(tokens[idx])
+                continue
+            code = getattr(resp.exception, "code", "") if resp.exception else ""
+            # Удаляем токен только при явном признаке, что он более не существует.
+            if code == "registration-token-not-registered":
+                invalid.append(tokens[idx])
+            else:
                 detail = str(resp.exception) if resp.exception else "unknown error"
-                print(f"⚠️ FCM token send failed: user_id={user_id}, idx={idx}, code={code}, detail={detail}")
-                # Удаляем токен только при явном признаке, что он более не существует.
-                if code == "registration-token-not-registered":
-                    invalid_tokens.append(tokens[idx])
-            self._remove_invalid_tokens(user_id, invalid_tokens)
-            print(
-                f"📨 FCM send result: user_id={user_id}, success={response.success_count}, "
-                f"failed={response.failure_count}, tokens={len(tokens)}"
-            )
-            return response.success_count > 0
-        except Exception as e:
-            print(f"❌ Ошибка отправки push для {user_id}: {e}")
+                log.warning(
+                    "⚠️ FCM token send failed: %s", detail,
+                    extra={"user_id": self.tokens.user_of(tokens[idx]), "code": code},
+                )
+        failed = len(tokens) - len(delivered) - len(invalid)
+        FCM_TOKENS.labels("delivered").inc(len(delivered))
+        if invalid:
+            FCM_TOKENS.labels("invalid").inc(len(invalid))
+        if failed:
+            FCM_TOKENS.labels("failed").inc(failed)
+        return delivered, invalid
+
+    def _send_tokens(
+        self,
+        tokens: List[str],
+        title: str,
+        body: str,
+        data: Dict[str, str] | None,
+    ) -> Tuple[List[str], List[Exception]]:
+        """
+        Рассылает одно сообщение по токенам пакетами параллельно.
+
+        Returns:
+            (доставленные токены, ошибки транспорта по пакетам)
+        """
+        chunks = _chunks(tokens)
+        if len(chunks) == 1:
+            calls = [lambda: self._send_chunk(chunks[0], title, body, data)]
+        else:
+            pool = self._pool()
+            futures = [pool.submit(self._send_chunk, chunk, title, body, data) for chunk in chunks]
+            calls = [future.result for future in futures]
+
+        results = []
+        for call in calls:
+            try:
+                results.append(call())
+            except Exception as e:
+                results.append(e)
+
+        delivered: List[str] = []
+        invalid: List[str] = []
+        errors: List[Exception] = []
+        for result in results:
+            if isinstance(result, Exception):
+                errors.append(result)
+                continue
+            delivered.extend(result[0])
+            invalid.extend(result[1])
+        self._remove_invalid_tokens(invalid)
+        return delivered, errors
+
+    def send_push_to_user(
+        self,
+        user_id: str,
+        title: str,
+        body: str,
+        data: Dict[str, str] | None = None,
+        raise_errors: bool = False,
+    ) -> bool:
+        """
+        Отправляет push указанному пользователю.
+
+        При raise_errors=True ошибка транспорта пробрасывается наружу,
+        чтобы диспетчер мог повторить отправку (если не доставлено ни одного).
+        """
+        if not self._ensure_initialized():
+            log.warning("⚠️ FCM не отправлен: Firebase не инициализирован", extra={"user_id": user_id})
             return False
 
+        tokens = self.tokens.tokens_of(user_id)
+        if not tokens:
+            log.warning("⚠️ FCM не отправлен: нет токенов", extra={"user_id": user_id})
+            return False
+
+        delivered, errors = self._send_tokens(tokens, title, body, data)
+        for e in errors:
+            log.error("❌ Ошибка отправки push: %s", e, extra={"user_id": user_id})
+        log.info(
+            "📨 FCM send result",
+            extra={
+                "user_id": user_id,
+                "success": len(delivered),
+                "failed": len(tokens) - len(delivered),
+                "tokens": len(tokens),
+            },
+        )
+        if errors and not delivered and raise_errors:
+            raise errors[0]
+        return len(delivered) > 0
+
     def send_push_to_all_users(self, title: str, body: str, data: Dict[str, str] | None = None) -> int:
-        """Отправляет push всем зарегистрированным пользователям."""
-        with self._lock:
-            user_ids = list(self._user_tokens.keys())
+        """
+        Отправляет push всем зарегистрированным пользователям.
+
+        Сообщение одно и то же, поэтому токены разных пользователей идут
+        общими multicast-пакетами; возвращает число пользователей, получивших push.
+        """
+        if not self._ensure_initialized():
+            log.warning("⚠️ FCM не отправлен: Firebase не инициализирован")
+            return 0
 
-        success_users = 0
-        for user_id in user_ids:
-            if self.send_push_to_user(user_id, title, body, data):
-                success_users += 1
-        return success_users
+        tokens = self.tokens.all_tokens()
+        if not tokens:
+            return 0
+
+        # Владельцев запоминаем до отправки: недействительные токены удаляются по ходу
+        owners = {token: self.tokens.user_of(token) for token in tokens}
+        delivered, errors = self._send_tokens(tokens, title, body, data)
+        success_users = {owners[token] for token in delivered}
+        log.info(
+            "📨 FCM broadcast",
+            extra={
+                "users": len(success_users),
+                "users_total": len(set(owners.values())),
+                "success": len(delivered),
+                "tokens": len(tokens),
+                "failed_batches": len(errors),
+            },
+        )
+        return len(success_users)
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
 
 
 firebase_service = FirebaseService()
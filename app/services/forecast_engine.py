@@ -0,0 +1,129 @@
+"""
+Пакетный (векторизованный) прогноз для многих устройств сразу
+
+Все пять метрик всех запрошенных устройств укладываются в одну матрицу
+(устройства x метрики x окно) и считаются одним проходом NumPy.
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from ..core.ring_buffer import METRIC_COLUMNS, HistoryView
+
+SUPPORTED_MODELS = ("linear", "ewma", "holt")
+
+EWMA_ALPHA = 0.3
+HOLT_ALPHA = 0.5
+HOLT_BETA = 0.1
+
+
+class ForecastEngine:
+    """Векторизованные модели прогноза: линейная, EWMA, Холт (тренд)"""
+
+    @staticmethod
+    def build_matrix(views: Sequence[HistoryView], window: int):
+        """
+        Складывает историю устройств в матрицу, выровненную по правому краю
+
+        Returns:
+            Y: (D, M, W) значения; начало коротких рядов заполнено первым значением
+            mask: (D, W) True там, где есть реальная точка
+            n: (D,) длины рядов
+        """
+        d = len(views)
+        m = len(METRIC_COLUMNS)
+        y = np.zeros((d, m, window), dtype=np.float64)
+        n = np.zeros(d, dtype=np.int64)
+        for row, view in enumerate(views):
+            count = min(len(view), window)
+            n[row] = count
+            if not count:
+                continue
+            for k, name in enumerate(METRIC_COLUMNS):
+                series = np.concatenate([np.frombuffer(seg, dtype=np.float64) for seg in view.column(name)])
+                y[row, k, window - count:] = series[-count:]
+                y[row, k, :window - count] = series[-count]
+        mask = np.arange(window)[None, :] >= (window - n)[:, None]
+        return y, mask, n
+
+    @staticmethod
+    def linear(y: np.ndarray, mask: np.ndarray, n: np.ndarray, steps: np.ndarray) -> np.ndarray:
+        """МНК-прямая по реальным точкам, как AIService.predict_linear. Возвращает (D, M, H)."""
+        window = y.shape[-1]
+        # x = 0..n-1 для реальных точек каждого ряда
+        x = (np.arange(window)[None, :] - (window - n)[:, None]).astype(np.float64)
+        w = mask.astype(np.float64)
+        nf = n.astype(np.float64)[:, None]
+
+        sum_x = (x * w).sum(-1)[:, None]
+        sum_xx = (x * x * w).sum(-1)[:, None]
+        sum_y = (y * w[:, None, :]).sum(-1)
+        sum_xy = (y * (x * w)[:, None, :]).sum(-1)
+
+        denominator = nf * sum_xx - sum_x * sum_x
+        safe = np.where(denominator == 0, 1.0, denominator)
+        slope = np.where(denominator == 0, 0.0, (nf * sum_xy - sum_x * sum_y) / safe)
+        intercept = (sum_y - slope * sum_x) / np.maximum(nf, 1.0)
+
+        pred = slope[..., None] * (nf[..., None] + steps[None, None, :]) + intercept[..., None]
+        last = y[:, :, -1:]
+        # Меньше 5 точек - повторяем последнее значение
+        short = (n < 5)[:, None, None]
+        return np.where(short, last, pred)
+
+    @staticmethod
+    def ewma(y: np.ndarray, steps: np.ndarray, alpha: float = EWMA_ALPHA) -> np.ndarray:
+        """Экспоненциальное сглаживание: прогноз - последний уровень."""
+        level = y[:, :, 0].copy()
+        for t in range(1, y.shape[-1]):
+            level += alpha * (y[:, :, t] - level)
+        return np.repeat(level[..., None], len(steps), axis=-1)
+
+    @staticmethod
+    def holt(
+        y: np.ndarray,
+        steps: np.ndarray,
+        alpha: float = HOLT_ALPHA,
+        beta: float = HOLT_BETA,
+    ) -> np.ndarray:
+        """Двойное сглаживание Холта: уровень + h * тренд."""
+        level = y[:, :, 0].copy()
+        trend = np.zeros_like(level)
+        for t in range(1, y.shape[-1]):
+            prev_level = level
+            level = alpha * y[:, :, t] + (1 - alpha) * (prev_level + trend)
+            trend = beta * (level - prev_level) + (1 - beta) * trend
+        return level[..., None] + trend[..., None] * steps[None, None, :]
+
+    def forecast(
+        self,
+        views: Dict[str, HistoryView],
+        steps: List[int],
+        models: Sequence[str],
+        window: int,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Прогноз всех метрик для всех устройств одним пакетом
+
+        Returns:
+            {модель: массив (D, M, H)} - D устройств в порядке views,
+            M метрик в порядке METRIC_COLUMNS, H горизонтов в порядке steps;
+            неизвестные модели пропускаются
+        """
+        device_views = list(views.values())
+        y, mask, n = self.build_matrix(device_views, window)
+        steps_arr = np.asarray([max(1, int(s)) for s in steps], dtype=np.float64)
+
+        result = {}
+        for model in models:
+            if model == "linear":
+                result[model] = self.linear(y, mask, n, steps_arr)
+            elif model == "ewma":
+                result[model] = self.ewma(y, steps_arr)
+            elif model == "holt":
+                result[model] = self.holt(y, steps_arr)
+        return result
+
+
+# Глобальный экземпляр движка
+forecast_engine = ForecastEngine()
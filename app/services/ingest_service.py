@@ -0,0 +1,265 @@
+"""
+Пакетная загрузка показаний (шлюзы, догрузка после офлайна)
+
+Тело запроса разбирается потоково (NDJSON или msgpack), пакет проверяется
+и нормализуется целиком векторно (NumPy), показания вставляются с исходными
+временными метками устройства.
+"""
+import json
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import msgpack
+import numpy as np
+
+from ..core.constants import DEFAULT_DEVICE_ID, INGEST_MAX_FUTURE_SEC, METRIC_LIMITS
+from ..core.event_bus import event_bus
+from ..core.storage import storage
+
+SUPPORTED_FORMATS = ("ndjson", "msgpack")
+
+# Поле показания -> допустимые ключи во входных данных
+FIELD_ALIASES = {
+    "temperature": ("temperature", "temp"),
+    "humidity": ("humidity", "hum"),
+    "co2_ppm": ("co2_ppm", "co2"),
+    "co_ppm": ("co_ppm", "co"),
+    "lux": ("lux", "illuminance"),
+}
+METRICS = tuple(FIELD_ALIASES)
+
+# Биты маски ошибок строки: метрики по порядку, затем время и устройство
+_TS_BIT = len(METRICS)
+_DEVICE_BIT = _TS_BIT + 1
+
+# Метки времени больше этого - в миллисекундах
+_MS_THRESHOLD = 1e11
+
+
+class BatchTooLarge(ValueError):
+    """В пакете больше строк, чем разрешено"""
+
+
+class BatchDecoder:
+    """Потоковый разбор тела: NDJSON или msgpack (массив или поток объектов)"""
+
+    def __init__(self, fmt: str, max_rows: int):
+        if fmt not in SUPPORTED_FORMATS:
+            raise ValueError(f"Неизвестный формат: {fmt}")
+        self.max_rows = max_rows
+        # Разобранные строки; None - строку разобрать не удалось
+        self.records: List[Optional[Dict]] = []
+        self.errors: Dict[int, List[str]] = {}
+        self._buf = b""
+        self._unpacker = msgpack.Unpacker(raw=False) if fmt == "msgpack" else None
+
+    def _add(self, item, error: Optional[str] = None) -> None:
+        if isinstance(item, list):
+            for x in item:
+                self._add(x)
+            return
+        if len(self.records) >= self.max_rows:
+            raise BatchTooLarge(f"Больше {self.max_rows} показаний в пакете")
+        if not isinstance(item, dict):
+            self.errors[len(self.records)] = [error or "ожидался объект показания"]
+            item = None
+        self.records.append(item)
+
+    def _line(self, line: bytes) -> None:
+        line = line.strip()
+        if not line:
+            return
+        try:
+            item = json.loads(line)
+        except ValueError:
+            self._add(None, "некорректный JSON")
+            return
+        self._add(item)
+
+    def feed(self, chunk: bytes) -> None:
+        if self._unpacker is not None:
+            self._unpacker.feed(chunk)
+            try:
+                for item in self._unpacker:
+                    self._add(item)
+            except BatchTooLarge:
+                raise
+            except Exception as e:
+                raise ValueError(f"Некорректный msgpack: {e}")
+            return
+        self._buf += chunk
+        *lines, self._buf = self._buf.split(b"\n")
+        for line in lines:
+            self._line(line)
+
+    def close(self) -> None:
+        if self._buf:
+            self._line(self._buf)
+            self._buf = b""
+
+
+def _pick(record: Optional[Dict], keys: Tuple[str, ...]):
+    if record is None:
+        return None
+    for k in keys:
+        v = record.get(k)
+        if v is not None:
+            return v
+    return None
+
+
+def _to_float(v) -> float:
+    if v is None or isinstance(v, bool):
+        return np.nan
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _to_ts(record: Optional[Dict], now: float) -> float:
+    """Unix time (сек или мс) из ts/timestamp; без метки - время приема."""
+    if record is None:
+        return np.nan
+    v = record.get("ts", record.get("timestamp"))
+    if v is None:
+        return now
+    if isinstance(v, str):
+        try:
+            return datetime.fromisoformat(v).timestamp()
+        except ValueError:
+            return _to_float(v)
+    return _to_float(v)
+
+
+class IngestService:
+    """Проверка и вставка пакетов показаний"""
+
+    def __init__(self):
+        self.batches = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.backfilled = 0
+
+    def validate(
+        self,
+        records: List[Optional[Dict]],
+        errors: Dict[int, List[str]],
+        device_id: Optional[str] = None,
+    ) -> List[Dict]:
+        """
+        Векторная проверка пакета.
+
+        Args:
+            records: Разобранные строки (None - ошибка разбора)
+            errors: Ошибки по номеру строки (дополняется)
+            device_id: Устройство для строк без device_id
+
+        Returns:
+            Корректные показания, отсортированные по времени
+        """
+        n = len(records)
+        if n == 0:
+            return []
+        now = time.time()
+        default_device = device_id or DEFAULT_DEVICE_ID
+
+        columns = {
+            m: np.fromiter((_to_float(_pick(r, keys)) for r in records), dtype=np.float64, count=n)
+            for m, keys in FIELD_ALIASES.items()
+        }
+        ts = np.fromiter((_to_ts(r, now) for r in records), dtype=np.float64, count=n)
+        ts = np.where(ts > _MS_THRESHOLD, ts / 1000.0, ts)
+        devices = [
+            (r.get("device_id") or default_device) if r is not None else None
+            for r in records
+        ]
+
+        bad = np.zeros(n, dtype=np.int64)
+        for bit, m in enumerate(METRICS):
+            lo, hi = METRIC_LIMITS[m]
+            col = columns[m]
+            with np.errstate(invalid="ignore"):
+                out = ~np.isfinite(col) | (col < lo) | (col > hi)
+            bad |= out.astype(np.int64) << bit
+        with np.errstate(invalid="ignore"):
+            ts_bad = ~np.isfinite(ts) | (ts <= 0) | (ts > now + INGEST_MAX_FUTURE_SEC)
+        bad |= ts_bad.astype(np.int64) << _TS_BIT
+        dev_bad = np.fromiter((not isinstance(d, str) for d in devices), dtype=bool, count=n)
+        bad |= dev_bad.astype(np.int64) << _DEVICE_BIT
+
+        parsed = np.fromiter((r is not None for r in records), dtype=bool, count=n)
+        for i in np.nonzero((bad != 0) & parsed)[0].tolist():
+            errors[i] = self._describe(int(bad[i]))
+        self.rejected += len(errors)
+
+        ok = np.nonzero((bad == 0) & parsed)[0]
+        # Сортировка по времени: в буферы устройств строки идут по возрастанию
+        ok = ok[np.argsort(ts[ok], kind="stable")]
+
+        readings = []
+        for i in ok.tolist():
+            data = {m: float(columns[m][i]) for m in METRICS}
+            data["device_id"] = devices[i]
+            readings.append(storage.build_reading(data, ts=float(ts[i])))
+        return readings
+
+    def _describe(self, mask: int) -> List[str]:
+        messages = []
+        for bit, m in enumerate(METRICS):
+            if mask & (1 << bit):
+                lo, hi = METRIC_LIMITS[m]
+                messages.append(f"{m}: нет значения или вне диапазона [{lo:g}, {hi:g}]")
+        if mask & (1 << _TS_BIT):
+            messages.append("ts: некорректная метка времени")
+        if mask & (1 << _DEVICE_BIT):
+            messages.append("device_id: ожидалась строка")
+        return messages
+
+    def apply(self, readings: List[Dict]) -> Tuple[Dict[str, Dict], int]:
+        """
+        Вставляет показания (отсортированные по времени).
+
+        Показания новее последнего в буфере устройства идут обычным путем,
+        более старые (догрузка) - только в агрегаты и постоянную историю.
+        Пакет применяется под замком хранилища целиком, поэтому показания
+        из MQTT не вклиниваются между проверкой времени и вставкой.
+
+        Returns:
+            (последнее новое показание каждого устройства, число догруженных)
+        """
+        latest: Dict[str, Dict] = {}
+        backfilled = 0
+        with storage.lock:
+            for reading in readings:
+                if not storage.apply_reading(reading):
+                    backfilled += 1
+                else:
+                    latest[reading["device_id"]] = reading
+                storage.persist_reading(reading)
+
+        # Алерты - только по последнему состоянию устройства, через очередь
+        # потребителя alerts (он есть только у лидера): движок правил
+        # однопоточный, пакет не обгоняет показания из MQTT
+        alerts = event_bus.consumer("alerts")
+        if alerts is not None:
+            for reading in latest.values():
+                alerts.put(reading)
+
+        self.batches += 1
+        self.accepted += len(readings)
+        self.backfilled += backfilled
+        return latest, backfilled
+
+    def stats(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "backfilled": self.backfilled,
+        }
+
+
+# Глобальный экземпляр сервиса
+ingest_service = IngestService()
@@ -1,14 +1,76 @@
 """
 MQTT сервис для получения данных от ESP32
+
+Топики задаются шаблонами (iot/microclimate/+/data): device_id берется из
+уровня первого '+'. С MQTT_SHARED_GROUP подписка идет как
+$share/<group>/<шаблон>, и брокер делит сообщения парка между
+экземплярами backend; client ID у каждого экземпляра свой.
 """
 import paho.mqtt.client as mqtt
-import json
+import logging
+import os
+import socket
 import ssl
 import asyncio
 import time
-from typing import Optional
+from typing import Dict, List, Optional
 from ..config import settings
+from ..core.event_bus import event_bus
+from ..core.log import get_logger, reading_sampler
+from ..core.metrics import MQTT_MESSAGES, MQTT_ON_MESSAGE_SECONDS, MQTT_PARSE_FAILURES
 from ..core.storage import storage
+from .payload_decoders import payload_decoders
+
+log = get_logger("mqtt")
+
+SHARE_PREFIX = "$share"
+# Предел кэша топик -> device_id (топиков столько же, сколько устройств)
+TOPIC_CACHE_SIZE = 100_000
+
+
+class TopicPattern:
+    """Шаблон подписки с '+' и '#'; device_id - уровень первого '+'"""
+
+    def __init__(self, pattern: str):
+        levels = pattern.split("/")
+        for i, level in enumerate(levels):
+            if ("+" in level or "#" in level) and len(level) > 1:
+                raise ValueError(f"Wildcard должен занимать весь уровень: {pattern}")
+            if level == "#" and i != len(levels) - 1:
+                raise ValueError(f"'#' допускается только последним уровнем: {pattern}")
+        if pattern.startswith(SHARE_PREFIX + "/"):
+            raise ValueError(f"Группа задается MQTT_SHARED_GROUP, а не в шаблоне: {pattern}")
+        self.pattern = pattern
+        self.levels = levels
+        self.device_level = levels.index("+") if "+" in levels else None
+
+    def matches(self, topic: str) -> bool:
+        return mqtt.topic_matches_sub(self.pattern, topic)
+
+    def device_id(self, topic: str) -> Optional[str]:
+        if self.device_level is None:
+            return None
+        parts = topic.split("/")
+        return parts[self.device_level] if len(parts) > self.device_level else None
+
+    def topic_for(self, device_id: str) -> str:
+        """Конкретный топик устройства по шаблону (для эмуляторов и тестов)."""
+        levels = [device_id if i == self.device_level else level for i, level in enumerate(self.levels)]
+        return "/".join("data" if level in ("+", "#") else level for level in levels)
+
+    def subscription(self, group: Optional[str]) -> str:
+        return f"{SHARE_PREFIX}/{group}/{self.pattern}" if group else self.pattern
+
+
+def configured_patterns() -> List[TopicPattern]:
+    return [TopicPattern(t) for t in (settings.MQTT_TOPICS or [settings.MQTT_TOPIC])]
+
+
+def make_client_id() -> str:
+    """Уникальный client ID: одинаковые ID выбивают друг друга с брокера."""
+    if settings.MQTT_CLIENT_ID:
+        return settings.MQTT_CLIENT_ID
+    return f"{settings.MQTT_CLIENT_ID_PREFIX}-{socket.gethostname()}-{os.getpid()}-{os.urandom(3).hex()}"
 
 
 class MQTTService:
@@ -17,15 +79,19 @@ class MQTTService:
     def __init__(self):
         self.client: Optional[mqtt.Client] = None
         self.event_loop: Optional[asyncio.AbstractEventLoop] = None
-        self._danger_state_by_device: dict[str, bool] = {}
-        self._last_alert_ts_by_device: dict[str, float] = {}
+        self.client_id: Optional[str] = None
+        self.patterns: List[TopicPattern] = configured_patterns()
+        self.qos = settings.MQTT_QOS
+        self.shared_group = settings.MQTT_SHARED_GROUP or None
+        self._topic_devices: Dict[str, Optional[str]] = {}
     
     def setup(self, event_loop: asyncio.AbstractEventLoop):
         """Настройка MQTT клиента"""
         self.event_loop = event_loop
+        self.client_id = make_client_id()
         
         self.client = mqtt.Client(
-            client_id="backend_microclimate_prod_v2",
+            client_id=self.client_id,
             protocol=mqtt.MQTTv311
         )
         
@@ -53,59 +119,26 @@ class MQTTService:
                 60
             )
             self.client.loop_start()
-            print(f"✅ MQTT подключен к {settings.MQTT_HOST}:{settings.MQTT_PORT}")
+            log.info("✅ MQTT подключен к %s:%s", settings.MQTT_HOST, settings.MQTT_PORT)
             return True
         except Exception as e:
-            print(f"❌ Ошибка MQTT: {e}")
+            log.error("❌ Ошибка MQTT: %s", e)
             return False
 
-    def _build_alert_message(self, data: dict, profile: dict, issues: list[str]) -> str:
-        """Формирует понятный текст уведомления по профилю и отклонениям."""
-        profile_name = profile.get("name", "Профиль")
-        parts: list[str] = []
-
-        temp = float(data.get("temperature", 0))
-        hum = float(data.get("humidity", 0))
-        co2 = float(data.get("co2_ppm", 0))
-        co = float(data.get("co_ppm", data.get("co", 0)))
-        lux = float(data.get("lux", 0))
-
-        if "temperature" in issues:
-            tmin = profile.get("temp_min")
-            tmax = profile.get("temp_max")
-            parts.append(f"температура {temp:.1f}°C (норма {tmin}-{tmax}°C)")
-        if "humidity" in issues:
-            hmax = profile.get("humidity_max")
-            parts.append(f"влажность {hum:.0f}% (макс {hmax}%)")
-        if "co2_ppm" in issues:
-            cmax = profile.get("co2_max")
-            parts.append(f"CO2 {co2:.0f} ppm (макс {cmax})")
-        if "co_ppm" in issues:
-            comax = profile.get("co_max")
-            parts.append(f"CO {co:.1f} ppm (макс {comax})")
-        if "lux" in issues:
-            lmin = profile.get("lux_min")
-            lmax = profile.get("lux_max")
-            parts.append(f"освещенность {lux:.0f} lx (норма {lmin}-{lmax})")
-
-        if not parts:
-            parts.append("есть отклонение параметров")
-
-        return f"{profile_name}: {', '.join(parts)}. Проверьте помещение."
-    
     def disconnect(self):
         """Отключение от MQTT"""
         if self.client:
             self.client.loop_stop()
             self.client.disconnect()
-            print("✅ MQTT отключен")
+            log.info("✅ MQTT отключен")
     
     def _on_connect(self, client, userdata, flags, rc):
         """Callback при подключении"""
         if rc == 0:
-            print("✅ MQTT подключен к HiveMQ Cloud!")
-            client.subscribe(settings.MQTT_TOPIC)
-            print(f"📡 Подписка на топик: {settings.MQTT_TOPIC}")
+            log.info("✅ MQTT подключен к HiveMQ Cloud!", extra={"client_id": self.client_id})
+            subscriptions = self.subscriptions()
+            client.subscribe([(topic, self.qos) for topic in subscriptions])
+            log.info("📡 Подписка: %s", ", ".join(subscriptions), extra={"qos": self.qos})
         else:
             error_msgs = {
                 1: "Неверная версия протокола",
@@ -114,98 +147,76 @@ class MQTTService:
                 4: "Неверный логин/пароль",
                 5: "Не авторизован"
             }
-            print(f"❌ MQTT ошибка: {error_msgs.get(rc, f'Код {rc}')}")
+            log.error("❌ MQTT ошибка: %s", error_msgs.get(rc, f"Код {rc}"))
     
+    def subscriptions(self) -> List[str]:
+        return [p.subscription(self.shared_group) for p in self.patterns]
+
+    def device_from_topic(self, topic: str) -> Optional[str]:
+        """device_id из топика по первому подходящему шаблону (с кэшем)."""
+        try:
+            return self._topic_devices[topic]
+        except KeyError:
+            pass
+        device_id = None
+        for pattern in self.patterns:
+            if pattern.device_level is not None and pattern.matches(topic):
+                device_id = pattern.device_id(topic) or None
+                break
+        if len(self._topic_devices) >= TOPIC_CACHE_SIZE:
+            self._topic_devices.clear()
+        self._topic_devices[topic] = device_id
+        return device_id
+
+    def describe(self) -> Dict:
+        return {
+            "broker": settings.MQTT_HOST,
+            "port": settings.MQTT_PORT,
+            "topics": self.subscriptions(),
+            "qos": self.qos,
+            "client_id": self.client_id,
+            "connected": self.client.is_connected() if self.client else False,
+            "payload_formats": payload_decoders.stats(),
+        }
+
     def _on_message(self, client, userdata, msg):
         """Callback при получении сообщения"""
+        started = time.perf_counter()
+        MQTT_MESSAGES.inc()
         try:
-            payload = json.loads(msg.payload.decode('utf-8'))
+            # JSON / msgpack / бинарный кадр -> одинаковый словарь показания
+            data = payload_decoders.decode(msg.topic, msg.payload)
+            # Устройство из топика (iot/microclimate/<id>/data), иначе из тела
+            data["device_id"] = self.device_from_topic(msg.topic) or data.get("device_id") or "esp32_main"
             
-            # Обработка разных ключей для освещенности
-            illuminance = payload.get("illuminance", 0.0)
-            if illuminance == 0:
-                illuminance = payload.get("lux", 0.0)
-            
-            # Подготовка данных
-            data = {
-                "temperature": float(payload.get("temperature", 0)),
-                "humidity": float(payload.get("humidity", 0)),
-                "co2_ppm": float(payload.get("co2_ppm", 0)),
-                "co_ppm": float(payload.get("co_ppm", payload.get("co", 0))),
-                "lux": float(illuminance),
-                "device_id": payload.get("device_id", "esp32_main")
-            }
-            
-            # Обновление хранилища
-            storage.update_current_data(data)
-            
-            print(f"📊 T={data['temperature']:.1f}°C, "
-                  f"H={data['humidity']:.0f}%, "
-                  f"CO2={data['co2_ppm']:.0f}ppm, "
-                  f"CO={data['co_ppm']:.1f}ppm, "
-                  f"LUX={data['lux']:.0f}lx")
-
-            # Push в FCM отправляем только при переходе в аварийное состояние.
-            latest = storage.data_history[-1] if storage.data_history else {}
-            is_danger = bool(latest.get("is_danger", False))
-            device_id = data["device_id"]
-            prev_state = self._danger_state_by_device.get(device_id, False)
-
-            # Отправляем push сразу при входе в danger и далее с интервалом reminder.
-            now_ts = time.time()
-            cooldown = max(0, int(settings.FCM_DANGER_REMINDER_SEC))
-            last_alert_ts = self._last_alert_ts_by_device.get(device_id, 0.0)
-            should_alert = is_danger and (
-                (not prev_state) or (cooldown == 0) or ((now_ts - last_alert_ts) >= cooldown)
-            )
-
-            if should_alert:
-                from ..services.firebase_service import firebase_service
-
-                issues = latest.get("issues", [])
-                profile = storage.active_profile or {}
-                issues_text = ", ".join(issues) if issues else "параметры"
-                message_body = self._build_alert_message(data, profile, issues)
-                target_user_id = settings.FCM_DEFAULT_USER_ID
-                delivered = 1 if firebase_service.send_push_to_user(
-                    user_id=target_user_id,
-                    title="Микроклимат: вне нормы",
-                    body=message_body,
-                    data={
-                        "type": "danger",
-                        "device_id": device_id,
-                        "profile_name": str(profile.get("name", "")),
-                        "issues": issues_text,
-                        "temperature": f"{data['temperature']:.1f}",
-                        "humidity": f"{data['humidity']:.0f}",
-                        "co2_ppm": f"{data['co2_ppm']:.0f}",
-                        "co_ppm": f"{data['co_ppm']:.1f}",
-                        "lux": f"{data['lux']:.0f}",
-                    },
-                ) else 0
-                self._last_alert_ts_by_device[device_id] = now_ts
-                print(
-                    f"🔔 FCM alert: device={device_id}, user_id={target_user_id}, "
-                    f"delivered_users={delivered}, issues={issues_text}"
-                )
-
-            self._danger_state_by_device[device_id] = is_danger
+            # Нормализация + оценка нормы, дальше - потребители шины
+            # (хранилище, алерты, рассылка, история) в своих потоках
+            reading = storage.build_reading(data)
+            event_bus.publish(reading)
             
-            # Broadcast через WebSocket
-            if self.event_loop:
-                from ..services.websocket_service import websocket_service
-                asyncio.run_coroutine_threadsafe(
-                    websocket_service.broadcast(storage.current_data),
-                    self.event_loop
-                )
+            # Рутинная строка: не чаще раза в LOG_READING_INTERVAL_SEC на устройство
+            if log.isEnabledFor(logging.INFO):
+                skipped = reading_sampler.allow(reading["device_id"])
+                if skipped is not None:
+                    log.info(
+                        "📊 T=%.1f°C, H=%.0f%%, CO2=%.0fppm, CO=%.1fppm, LUX=%.0flx",
+                        data["temperature"], data["humidity"], data["co2_ppm"], data["co_ppm"], data["lux"],
+                        extra={"device_id": reading["device_id"], "skipped": skipped},
+                    )
         
         except Exception as e:
-            print(f"❌ Ошибка обработки MQTT: {e}")
+            MQTT_PARSE_FAILURES.inc()
+            # Битые сообщения тоже прореживаются (по топику)
+            skipped = reading_sampler.allow(f"error:{msg.topic}")
+            if skipped is not None:
+                log.warning("❌ Ошибка обработки MQTT: %s", e, extra={"topic": msg.topic, "skipped": skipped})
+        finally:
+            MQTT_ON_MESSAGE_SECONDS.observe(time.perf_counter() - started)
     
     def _on_disconnect(self, client, userdata, rc):
         """Callback при отключении"""
         if rc != 0:
-            print(f"⚠️ MQTT отключен. Переподключение...")
+            log.warning("⚠️ MQTT отключен. Переподключение...", extra={"rc": rc})
 
 
 # Глобальный экземпляр сервиса
@@ -0,0 +1,180 @@
+"""
+Декодеры полезной нагрузки MQTT от устройств
+
+Формат выбирается по последнему уровню топика (.../json, .../msgpack,
+.../bin) или, если суффикс не задает формат, по первому байту сообщения:
+'{' - JSON, msgpack map - msgpack, байт версии 0x01/0x02 - бинарный кадр
+фиксированной структуры. Любой декодер возвращает одинаковый словарь
+(temperature, humidity, co2_ppm, co_ppm, lux и необязательный device_id).
+
+Бинарные кадры (little-endian), за ними необязательно: u8 длина + device_id (utf-8)
+    v1 (13 байт): u8 0x01, i16 temp*100, u16 hum*100, u16 co2, u16 co*10, u32 lux*10
+    v2 (21 байт): u8 0x02, f32 temp, f32 hum, f32 co2, f32 co, f32 lux
+"""
+import json
+import struct
+from typing import Callable, Dict, Iterable, Optional
+
+import msgpack
+
+PayloadData = Dict
+
+# Масштабы полей кадра v1: (поле, делитель)
+V1_FIELDS = (
+    ("temperature", 100.0),
+    ("humidity", 100.0),
+    ("co2_ppm", 1.0),
+    ("co_ppm", 10.0),
+    ("lux", 10.0),
+)
+V1 = struct.Struct("<BhHHHI")
+V2 = struct.Struct("<Bfffff")
+BINARY_V1 = 0x01
+BINARY_V2 = 0x02
+
+
+class PayloadError(ValueError):
+    """Сообщение не удалось разобрать"""
+
+
+def _from_mapping(payload) -> PayloadData:
+    """Ключи как в JSON прошивки (illuminance/lux, co_ppm/co), значения -> float."""
+    if not isinstance(payload, dict):
+        raise PayloadError("ожидался объект показания")
+    # Обработка разных ключей для освещенности
+    illuminance = payload.get("illuminance", 0.0)
+    if illuminance == 0:
+        illuminance = payload.get("lux", 0.0)
+    data = {
+        "temperature": float(payload.get("temperature", 0)),
+        "humidity": float(payload.get("humidity", 0)),
+        "co2_ppm": float(payload.get("co2_ppm", 0)),
+        "co_ppm": float(payload.get("co_ppm", payload.get("co", 0))),
+        "lux": float(illuminance),
+    }
+    device_id = payload.get("device_id")
+    if device_id:
+        data["device_id"] = str(device_id)
+    return data
+
+
+def decode_json(payload: bytes) -> PayloadData:
+    try:
+        return _from_mapping(json.loads(payload))
+    except PayloadError:
+        raise
+    except (ValueError, TypeError, UnicodeDecodeError) as e:
+        raise PayloadError(f"некорректный JSON: {e}")
+
+
+def decode_msgpack(payload: bytes) -> PayloadData:
+    try:
+        return _from_mapping(msgpack.unpackb(payload, raw=False))
+    except PayloadError:
+        raise
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise PayloadError(f"некорректный msgpack: {e}")
+
+
+def _device_tail(payload: bytes, offset: int) -> Optional[str]:
+    if len(payload) <= offset:
+        return None
+    size = payload[offset]
+    raw = payload[offset + 1:offset + 1 + size]
+    if len(raw) != size:
+        raise PayloadError("обрезан device_id в бинарном кадре")
+    return raw.decode("utf-8", errors="replace") or None
+
+
+def decode_binary(payload: bytes) -> PayloadData:
+    if not payload:
+        raise PayloadError("пустой бинарный кадр")
+    version = payload[0]
+    try:
+        if version == BINARY_V1:
+            _, *raw = V1.unpack_from(payload)
+            data = {name: value / scale for (name, scale), value in zip(V1_FIELDS, raw)}
+            device_id = _device_tail(payload, V1.size)
+        elif version == BINARY_V2:
+            _, *raw = V2.unpack_from(payload)
+            data = {name: float(value) for (name, _), value in zip(V1_FIELDS, raw)}
+            device_id = _device_tail(payload, V2.size)
+        else:
+            raise PayloadError(f"неизвестная версия бинарного кадра: {version}")
+    except struct.error as e:
+        raise PayloadError(f"короткий бинарный кадр v{version}: {e}")
+    if device_id:
+        data["device_id"] = device_id
+    return data
+
+
+def encode_binary(data: Dict, version: int = BINARY_V1, device_id: Optional[str] = None) -> bytes:
+    """Кадр как у прошивки (эмуляторы, нагрузочный тест)."""
+    values = [data[name] for name, _ in V1_FIELDS]
+    if version == BINARY_V1:
+        frame = V1.pack(BINARY_V1, *(int(round(v * scale)) for v, (_, scale) in zip(values, V1_FIELDS)))
+    elif version == BINARY_V2:
+        frame = V2.pack(BINARY_V2, *values)
+    else:
+        raise ValueError(f"неизвестная версия бинарного кадра: {version}")
+    if device_id:
+        raw = device_id.encode("utf-8")[:255]
+        frame += bytes((len(raw),)) + raw
+    return frame
+
+
+Decoder = Callable[[bytes], PayloadData]
+
+
+class DecoderRegistry:
+    """Выбор декодера по суффиксу топика или первому байту сообщения"""
+
+    def __init__(self):
+        self._by_suffix: Dict[str, str] = {}
+        self._by_byte: Dict[int, str] = {}
+        self._decoders: Dict[str, Decoder] = {}
+        self.counts: Dict[str, int] = {}
+
+    def register(
+        self,
+        name: str,
+        decoder: Decoder,
+        suffixes: Iterable[str] = (),
+        first_bytes: Iterable[int] = (),
+    ) -> None:
+        self._decoders[name] = decoder
+        self.counts.setdefault(name, 0)
+        for suffix in suffixes:
+            self._by_suffix[suffix] = name
+        for b in first_bytes:
+            self._by_byte[b] = name
+
+    def detect(self, topic: str, payload: bytes) -> str:
+        name = self._by_suffix.get(topic.rpartition("/")[2])
+        if name is not None:
+            return name
+        if not payload:
+            raise PayloadError("пустое сообщение")
+        name = self._by_byte.get(payload[0])
+        if name is None:
+            raise PayloadError(f"неизвестный формат (первый байт 0x{payload[0]:02x})")
+        return name
+
+    def decode(self, topic: str, payload: bytes) -> PayloadData:
+        name = self.detect(topic, payload)
+        self.counts[name] += 1
+        return self._decoders[name](payload)
+
+    def stats(self) -> Dict:
+        return dict(self.counts)
+
+
+# Первые байты JSON: '{', пробельные символы, BOM utf-8
+_JSON_BYTES = (0x7B, 0x20, 0x09, 0x0A, 0x0D, 0xEF)
+# msgpack map: fixmap, map16, map32
+_MSGPACK_BYTES = tuple(range(0x80, 0x90)) + (0xDE, 0xDF)
+
+payload_decoders = DecoderRegistry()
+payload_decoders.register("json", decode_json, suffixes=("json",), first_bytes=_JSON_BYTES)
+payload_decoders.register("msgpack", decode_msgpack, suffixes=("msgpack", "mp"), first_bytes=_MSGPACK_BYTES)
+payload_decoders.register("binary", decode_binary, suffixes=("bin",), first_bytes=(BINARY_V1, BINARY_V2))
@@ -0,0 +1,110 @@
+"""
+Сборка конвейера приема данных: потребители шины событий
+"""
+import asyncio
+from typing import Dict
+
+from ..core.event_bus import BLOCK, COALESCE, Consumer, event_bus
+from ..core.state_backend import MemoryBackend, state_backend
+from ..core.storage import CURRENT_FIELDS, storage
+from ..core.token_store import token_store
+from .alert_service import alert_service
+from .ingest_service import ingest_service
+from .websocket_service import websocket_service
+
+# Сколько ждать event loop при рассылке одного обновления
+FANOUT_TIMEOUT_SEC = 5.0
+# Сколько поток приема ждет место в очереди истории/алертов/репликации;
+# дальше событие отбрасывается и считается в dropped потребителя
+DURABLE_BLOCK_TIMEOUT_SEC = 0.05
+
+
+def _device_key(reading: Dict) -> str:
+    return reading["device_id"]
+
+
+def _make_fanout(loop: asyncio.AbstractEventLoop):
+    def fanout(reading: Dict) -> None:
+        payload = {k: reading[k] for k in CURRENT_FIELDS}
+        future = asyncio.run_coroutine_threadsafe(websocket_service.broadcast(payload), loop)
+        # Не больше одной рассылки в полете: пока loop занят, новые
+        # показания устройства схлопываются в очереди (coalesce)
+        future.result(timeout=FANOUT_TIMEOUT_SEC)
+
+    return fanout
+
+
+def _persist(reading: Dict) -> None:
+    # Ждет место в очереди писателя SQLite в потоке потребителя, не приема
+    storage.persist_reading(reading, wait=True)
+
+
+def _replicate(reading: Dict) -> None:
+    state_backend.publish({"type": "reading", "data": reading})
+
+
+def handle_cluster_event(event: Dict) -> None:
+    """Событие от другого воркера (см. state_backend)."""
+    kind = event.get("type")
+    if kind == "reading":
+        event_bus.publish(event["data"])
+    elif kind == "profile":
+        storage.update_profile(event["profile"], persist=False)
+    elif kind == "push_token":
+        if event["action"] == "register":
+            token_store.add(event["user_id"], event["token"], persist=False)
+        else:
+            token_store.remove(event["user_id"], event["token"], persist=False)
+    elif kind == "push_tokens_removed":
+        token_store.remove_many(event["tokens"], persist=False)
+    elif kind == "batch":
+        latest, _ = ingest_service.apply(event["readings"])
+        # Своим WebSocket-клиентам - последнее состояние устройств пакета
+        fanout = event_bus.consumer("fanout")
+        if fanout is not None:
+            for reading in latest.values():
+                fanout.put(reading)
+
+
+def setup_pipeline(loop: asyncio.AbstractEventLoop) -> None:
+    """
+    Подписывает потребителей, нужных каждому воркеру (один раз):
+    хранилище в памяти и рассылка своим WebSocket-клиентам.
+    """
+    if event_bus.consumer("storage") is not None:
+        return
+
+    # Хранилище в памяти - без потерь: только его отставание может задержать
+    # поток приема. Рассылке достаточно последней точки
+    event_bus.subscribe(
+        Consumer("storage", storage.apply_reading, maxsize=10_000, policy=BLOCK, block_timeout=None)
+    )
+    event_bus.subscribe(
+        Consumer("fanout", _make_fanout(loop), maxsize=10_000, policy=COALESCE, key=_device_key)
+    )
+    event_bus.start()
+
+
+def enable_leader_consumers() -> None:
+    """Потребители только процесса-лидера: история, алерты, репликация."""
+    if event_bus.consumer("persistence") is not None:
+        return
+
+    # SQLite, правила алертов и соседние воркеры могут отставать (диск,
+    # медленный сокет): поток приема ждет их не дольше DURABLE_BLOCK_TIMEOUT_SEC,
+    # потери видны в dropped/blocked потребителя
+    event_bus.subscribe(
+        Consumer("persistence", _persist, maxsize=50_000, policy=BLOCK, block_timeout=DURABLE_BLOCK_TIMEOUT_SEC)
+    )
+    event_bus.subscribe(
+        Consumer("alerts", alert_service.handle_reading, maxsize=10_000, policy=BLOCK, block_timeout=DURABLE_BLOCK_TIMEOUT_SEC)
+    )
+    if not isinstance(state_backend, MemoryBackend):
+        event_bus.subscribe(
+            Consumer("replication", _replicate, maxsize=10_000, policy=BLOCK, block_timeout=DURABLE_BLOCK_TIMEOUT_SEC)
+        )
+    event_bus.start()
+
+
+def shutdown_pipeline() -> None:
+    event_bus.stop()
@@ -0,0 +1,211 @@
+"""
+Асинхронная отправка push-алертов: очередь, пул воркеров, повторы с backoff
+
+Решение об алерте возвращается сразу, а блокирующий HTTPS-вызов FCM
+выполняется в отдельных потоках.
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from ..config import settings
+from ..core.log import get_logger
+
+log = get_logger("push")
+
+# sender(user_id, title, body, data) -> bool; исключение = временная ошибка (повтор)
+Sender = Callable[[str, str, str, Dict[str, str]], bool]
+
+
+class PushJob(NamedTuple):
+    user_id: str
+    title: str
+    body: str
+    data: Dict[str, str]
+    created_at: float
+    deadline: float
+    attempt: int
+
+
+def _default_sender(user_id: str, title: str, body: str, data: Dict[str, str]) -> bool:
+    from .firebase_service import firebase_service
+
+    return firebase_service.send_push_to_user(user_id, title, body, data, raise_errors=True)
+
+
+class PushDispatcher:
+    """Очередь push-уведомлений с воркерами и экспоненциальными повторами"""
+
+    def __init__(
+        self,
+        sender: Optional[Sender] = None,
+        workers: int = 2,
+        maxsize: int = 1000,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        deadline_sec: float = 60.0,
+    ):
+        self.sender = sender or _default_sender
+        self.workers = max(1, int(workers))
+        self.maxsize = max(1, int(maxsize))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline_sec = deadline_sec
+
+        self._cond = threading.Condition()
+        # (время готовности, порядковый номер, задача)
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+        self._in_flight = 0
+
+        self.submitted = 0
+        self.sent = 0
+        self.not_delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.expired = 0
+        self.dropped = 0
+        self._latency_sum = 0.0
+        self._latency_count = 0
+        self.max_latency = 0.0
+        self.last_error: Optional[str] = None
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"push-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads = []
+
+    def submit(self, user_id: str, title: str, body: str, data: Optional[Dict[str, str]] = None) -> bool:
+        """Ставит push в очередь. Возвращает False, если очередь переполнена."""
+        now = time.monotonic()
+        job = PushJob(user_id, title, body, data or {}, now, now + self.deadline_sec, 0)
+        with self._cond:
+            if len(self._heap) >= self.maxsize:
+                self.dropped += 1
+                return False
+            heapq.heappush(self._heap, (now, next(self._seq), job))
+            self.submitted += 1
+            self._cond.notify()
+        return True
+
+    def _next_job(self) -> Optional[PushJob]:
+        with self._cond:
+            while self._running:
+                if self._heap:
+                    due = self._heap[0][0]
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        self._in_flight += 1
+                        return heapq.heappop(self._heap)[2]
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+            return None
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _worker(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._process(job)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+
+    def _process(self, job: PushJob) -> None:
+        now = time.monotonic()
+        if now > job.deadline:
+            with self._cond:
+                self.expired += 1
+            return
+
+        started = time.monotonic()
+        try:
+            delivered = self.sender(job.user_id, job.title, job.body, job.data)
+        except Exception as e:
+            self._record_latency(time.monotonic() - started)
+            retry_at = time.monotonic() + self._backoff(job.attempt)
+            with self._cond:
+                self.last_error = str(e)
+                if job.attempt < self.max_retries and retry_at < job.deadline:
+                    self.retries += 1
+                    heapq.heappush(
+                        self._heap,
+                        (retry_at, next(self._seq), job._replace(attempt=job.attempt + 1)),
+                    )
+                    self._cond.notify()
+                    return
+                self.failed += 1
+            log.error(
+                "❌ Push не доставлен: %s", e,
+                extra={"user_id": job.user_id, "attempts": job.attempt + 1},
+            )
+            return
+
+        self._record_latency(time.monotonic() - started)
+        with self._cond:
+            if delivered:
+                self.sent += 1
+            else:
+                self.not_delivered += 1
+
+    def _record_latency(self, latency: float) -> None:
+        with self._cond:
+            self._latency_sum += latency
+            self._latency_count += 1
+            if latency > self.max_latency:
+                self.max_latency = latency
+
+    def stats(self) -> Dict:
+        with self._cond:
+            depth = len(self._heap)
+            in_flight = self._in_flight
+        avg = self._latency_sum / self._latency_count if self._latency_count else 0.0
+        return {
+            "queue_depth": depth,
+            "in_flight": in_flight,
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "not_delivered": self.not_delivered,
+            "failed": self.failed,
+            "retries": self.retries,
+            "expired": self.expired,
+            "dropped": self.dropped,
+            "send_latency_avg_sec": round(avg, 4),
+            "send_latency_max_sec": round(self.max_latency, 4),
+            "last_error": self.last_error,
+        }
+
+
+# Глобальный диспетчер push-уведомлений
+push_dispatcher = PushDispatcher(
+    workers=settings.PUSH_WORKERS,
+    maxsize=settings.PUSH_QUEUE_SIZE,
+    max_retries=settings.PUSH_MAX_RETRIES,
+    deadline_sec=settings.PUSH_DEADLINE_SEC,
+)
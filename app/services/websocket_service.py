@@ -1,31 +1,437 @@
 """
 WebSocket сервис для real-time обновлений
+
+Обновление кодируется один раз и раскладывается по ограниченным
+очередям клиентов; у каждого клиента своя задача-отправитель, поэтому
+зависший клиент не задерживает остальных.
+
+Клиент может подписаться на часть устройств и метрик:
+    {"type": "subscribe", "devices": ["esp32_lab"], "metrics": ["temperature", "co2_ppm"],
+     "format": "msgpack", "delta": true, "max_rate": 2}
+После этого он получает только изменившиеся поля (delta) своих устройств,
+в JSON (текст) или msgpack (бинарные кадры), не чаще max_rate раз в секунду.
+Поля аномалий (anomaly, anomalies, anomaly_score) входят в кадр всегда,
+в режиме delta - когда меняются.
+Лимит частоты без подписки: {"type": "rate", "max_rate": 2}.
 """
-from typing import Dict
-from ..core.storage import storage
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
+
+import msgpack
+from fastapi import WebSocket
+
+from ..core.constants import (
+    MAX_WEBSOCKET_CLIENTS,
+    WS_CLIENT_QUEUE_SIZE,
+    WS_MAX_RATE_HZ,
+    WS_MIN_RATE_HZ,
+    WS_SLOW_CLIENT_LAG_SEC,
+)
+from ..core.log import get_logger
+from ..core.metrics import WS_BROADCAST_SECONDS
+
+log = get_logger("websocket")
+
+Frame = Union[str, bytes]
+
+# Код закрытия: "Try Again Later" - достигнут лимит клиентов
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+# Код закрытия: клиент не успевает получать обновления
+WS_CLOSE_POLICY_VIOLATION = 1008
+
+
+# Метрики, на которые можно подписаться
+SUBSCRIBABLE_METRICS = ("temperature", "humidity", "co2_ppm", "co_ppm", "lux")
+# Поля аномалий идут каждому подписчику независимо от выбранных метрик
+ANOMALY_FIELDS = ("anomaly", "anomalies", "anomaly_score")
+SUPPORTED_FORMATS = ("json", "msgpack")
+
+
+def encode_json(data: Dict) -> str:
+    """Кодирование как в WebSocket.send_json."""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_frame(data: Dict, fmt: str) -> Frame:
+    if fmt == "msgpack":
+        return msgpack.packb(data, use_bin_type=True)
+    return encode_json(data)
+
+
+def _parse_rate(message: Dict) -> Optional[float]:
+    rate = message.get("max_rate")
+    if rate is None:
+        return None
+    try:
+        rate = float(rate)
+    except (TypeError, ValueError):
+        raise ValueError("max_rate должен быть числом (Гц)")
+    if rate < 0:
+        raise ValueError("max_rate должен быть неотрицательным")
+    return rate
+
+
+class Subscription:
+    """Фильтр устройств/метрик и формат кадров клиента"""
+
+    def __init__(
+        self,
+        devices: Optional[List[str]] = None,
+        metrics: Optional[List[str]] = None,
+        fmt: str = "json",
+        delta: bool = True,
+        max_rate: Optional[float] = None,
+    ):
+        self.devices = set(devices) if devices else None
+        self.metrics = tuple(metrics) if metrics else SUBSCRIBABLE_METRICS
+        self.fmt = fmt
+        self.delta = delta
+        self.max_rate = max_rate
+
+    @classmethod
+    def from_message(cls, message: Dict) -> "Subscription":
+        devices = message.get("devices")
+        metrics = message.get("metrics")
+        fmt = message.get("format", "json")
+        if devices is not None and not isinstance(devices, list):
+            raise ValueError("devices должен быть списком")
+        if metrics is not None:
+            if not isinstance(metrics, list):
+                raise ValueError("metrics должен быть списком")
+            unknown = [m for m in metrics if m not in SUBSCRIBABLE_METRICS]
+            if unknown:
+                raise ValueError(f"Неизвестные метрики: {', '.join(map(str, unknown))}")
+        if fmt not in SUPPORTED_FORMATS:
+            raise ValueError(f"Поддерживаемые форматы: {', '.join(SUPPORTED_FORMATS)}")
+        return cls(devices, metrics, fmt, bool(message.get("delta", True)), _parse_rate(message))
+
+    def wants(self, device_id: str) -> bool:
+        return self.devices is None or device_id in self.devices
+
+    def describe(self) -> Dict:
+        return {
+            "devices": sorted(self.devices) if self.devices is not None else None,
+            "metrics": list(self.metrics),
+            "format": self.fmt,
+            "delta": self.delta,
+        }
+
+
+class WebSocketClient:
+    """Подключенный клиент с собственной очередью отправки"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        maxsize: int = WS_CLIENT_QUEUE_SIZE,
+        on_close: Optional[Callable[["WebSocketClient"], None]] = None,
+    ):
+        self.websocket = websocket
+        self.id = id(websocket)
+        self.maxsize = maxsize
+        # Вызывается, когда отправитель закрывает клиента после ошибки отправки
+        self._on_close = on_close
+        # (время постановки, кадр)
+        self._queue: Deque[Tuple[float, Frame]] = deque()
+        # Последнее ожидающее отправки состояние каждого устройства:
+        # dict для подписки (delta строится при отправке) или готовый кадр
+        self.subscription: Optional[Subscription] = None
+        self._pending: "OrderedDict[str, Union[Dict, Frame]]" = OrderedDict()
+        self._last_sent: Dict[str, Dict] = {}
+        # Ограничение частоты: не чаще одного пакета обновлений в 1/max_rate сек
+        self.max_rate: Optional[float] = None
+        self._next_tick = 0.0
+        self._tick_scheduled = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # С какого момента у клиента есть недоставленные данные
+        # (не сбрасывается при вытеснении старых кадров)
+        self._pending_since: Optional[float] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._queue) + len(self._pending)
+
+    @property
+    def coalescing(self) -> bool:
+        """Обновления копятся по устройствам (подписка или лимит частоты)."""
+        return self.subscription is not None or self.max_rate is not None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._sender())
+
+    def offer(self, frame: Frame) -> None:
+        """Кладет кадр в очередь; при переполнении вытесняется самый старый."""
+        if self.closed:
+            return
+        if len(self._queue) >= self.maxsize:
+            self._queue.popleft()
+            self.dropped += 1
+        now = time.monotonic()
+        if self._pending_since is None:
+            self._pending_since = now
+        self._queue.append((now, frame))
+        self._wakeup.set()
+
+    def subscribe(self, subscription: Subscription) -> None:
+        self.subscription = subscription
+        self._pending.clear()
+        self._last_sent.clear()
+
+    def unsubscribe(self) -> None:
+        self.subscription = None
+        self._pending.clear()
+        self._last_sent.clear()
+
+    def set_rate(self, max_rate: Optional[float]) -> Optional[float]:
+        """Максимальная частота обновлений (Гц); None - без ограничения."""
+        if not max_rate:
+            self.max_rate = None
+        else:
+            self.max_rate = min(WS_MAX_RATE_HZ, max(WS_MIN_RATE_HZ, float(max_rate)))
+        self._pending.clear()
+        return self.max_rate
+
+    def update(self, device_id: str, item: Union[Dict, Frame]) -> None:
+        """Новое состояние устройства: между тиками побеждает последнее."""
+        if self.closed:
+            return
+        if self.subscription is not None and not self.subscription.wants(device_id):
+            return
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        if device_id in self._pending:
+            self.coalesced += 1
+        self._pending[device_id] = item
+        self._wakeup.set()
+
+    def _build_update(self, device_id: str, data: Dict) -> Optional[Dict]:
+        sub = self.subscription
+        last = self._last_sent.get(device_id)
+        frame = {"device_id": device_id, "timestamp": data.get("timestamp")}
+        changed = False
+        for field in sub.metrics + ANOMALY_FIELDS:
+            value = data.get(field)
+            if not sub.delta or last is None or last.get(field) != value:
+                frame[field] = value
+                changed = True
+        if not changed:
+            return None
+        self._last_sent[device_id] = data
+        return frame
+
+    def lag(self, now: float) -> float:
+        """Сколько клиент ждет доставки данных (ожидание своего тика не считается)."""
+        if self._pending_since is None:
+            return 0.0
+        return max(0.0, now - max(self._pending_since, self._next_tick))
+
+    async def _send(self, frame: Frame) -> None:
+        if isinstance(frame, bytes):
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+        self.sent += 1
+
+    def _tick(self) -> None:
+        self._tick_scheduled = False
+        self._wakeup.set()
+
+    async def _sender(self) -> None:
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._queue:
+                    _, frame = self._queue[0]
+                    await self._send(frame)
+                    # Снимаем кадр только после отправки (его могли уже вытеснить)
+                    if self._queue and self._queue[0][1] is frame:
+                        self._queue.popleft()
+
+                if self._pending:
+                    delay = self._next_tick - time.monotonic()
+                    if delay > 0:
+                        # Ждем тика; до него новые показания схлопываются в _pending
+                        if not self._tick_scheduled:
+                            self._tick_scheduled = True
+                            asyncio.get_running_loop().call_later(delay, self._tick)
+                        continue
+                    while self._pending:
+                        device_id, item = self._pending.popitem(last=False)
+                        if isinstance(item, dict):
+                            if self.subscription is None:
+                                continue
+                            update = self._build_update(device_id, item)
+                            if update is None:
+                                continue
+                            item = encode_frame(update, self.subscription.fmt)
+                        await self._send(item)
+                    if self.max_rate is not None:
+                        self._next_tick = time.monotonic() + 1.0 / self.max_rate
+
+                if not self._queue and not self._pending:
+                    self._pending_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.closed = True
+            self._queue.clear()
+            self._pending.clear()
+            if self._on_close is not None:
+                self._on_close(self)
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        self.closed = True
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), timeout=1.0)
+        except Exception:
+            pass
 
 
 class WebSocketService:
     """Сервис для WebSocket"""
-    
+
+    def __init__(self, max_clients: int = MAX_WEBSOCKET_CLIENTS):
+        self.max_clients = max_clients
+        self.clients: Dict[int, WebSocketClient] = {}
+        self.evicted = 0
+        self.rejected = 0
+
+    def client_count(self) -> int:
+        return len(self.clients)
+
+    async def connect(self, websocket: WebSocket) -> Optional[WebSocketClient]:
+        """
+        Принимает соединение, если не превышен лимит клиентов
+
+        Returns:
+            Клиент или None, если соединение отклонено
+        """
+        await websocket.accept()
+        if len(self.clients) >= self.max_clients:
+            self.rejected += 1
+            await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER, reason="too many clients")
+            return None
+        client = WebSocketClient(websocket, on_close=self._forget)
+        self.clients[client.id] = client
+        client.start()
+        return client
+
+    def _forget(self, client: WebSocketClient) -> None:
+        """Убирает клиента, у которого оборвалась отправка."""
+        if self.clients.get(client.id) is client:
+            del self.clients[client.id]
+
+    async def disconnect(self, client: WebSocketClient) -> None:
+        self.clients.pop(client.id, None)
+        if not client.closed:
+            await client.close()
+
+    async def _evict(self, client: WebSocketClient) -> None:
+        self.evicted += 1
+        self.clients.pop(client.id, None)
+        log.warning("⚠️ WebSocket отключен: не успевает получать обновления", extra={"client": client.id})
+        await client.close(code=WS_CLOSE_POLICY_VIOLATION, reason="slow consumer")
+
+    def handle_message(self, client: WebSocketClient, message: str) -> Optional[Dict]:
+        """
+        Управляющее сообщение клиента (subscribe/unsubscribe)
+
+        Returns:
+            Ответ клиенту или None, если сообщение не управляющее
+        """
+        try:
+            payload = json.loads(message)
+        except ValueError:
+            return None
+        if not isinstance(payload, dict):
+            return None
+
+        kind = payload.get("type")
+        if kind == "subscribe":
+            try:
+                subscription = Subscription.from_message(payload)
+            except ValueError as e:
+                return {"type": "error", "message": str(e)}
+            client.subscribe(subscription)
+            max_rate = client.set_rate(subscription.max_rate)
+            return {"type": "subscribed", **subscription.describe(), "max_rate": max_rate}
+        if kind == "unsubscribe":
+            client.unsubscribe()
+            return {"type": "unsubscribed", "max_rate": client.max_rate}
+        if kind == "rate":
+            try:
+                max_rate = client.set_rate(_parse_rate(payload))
+            except ValueError as e:
+                return {"type": "error", "message": str(e)}
+            return {"type": "rate", "max_rate": max_rate}
+        return {"type": "error", "message": f"Неизвестный тип сообщения: {kind}"}
+
+    def publish(self, data: Dict) -> None:
+        """
+        Раскладывает обновление по клиентам (без ожидания)
+
+        Клиенты без подписки получают полный JSON, закодированный один раз;
+        подписанные - последнее состояние устройства для delta-кадра.
+        При лимите частоты между тиками остается только последнее
+        состояние каждого устройства.
+        """
+        started = time.perf_counter()
+        now = time.monotonic()
+        device_id = data.get("device_id")
+        frame: Optional[Frame] = None
+        slow: List[WebSocketClient] = []
+        for client in list(self.clients.values()):
+            if client.closed:
+                self.clients.pop(client.id, None)
+                continue
+            if client.subscription is not None:
+                client.update(device_id, data)
+            else:
+                if frame is None:
+                    frame = encode_json(data)
+                if client.coalescing:
+                    client.update(device_id, frame)
+                else:
+                    client.offer(frame)
+            if client.lag(now) > WS_SLOW_CLIENT_LAG_SEC:
+                slow.append(client)
+        for client in slow:
+            asyncio.create_task(self._evict(client))
+        WS_BROADCAST_SECONDS.observe(time.perf_counter() - started)
+
     async def broadcast(self, data: Dict):
         """
         Рассылка данных всем WebSocket клиентам
-        
+
         Args:
             data: Данные для отправки
         """
-        disconnected = []
-        
-        for websocket in storage.active_websockets:
-            try:
-                await websocket.send_json(data)
-            except:
-                disconnected.append(websocket)
-        
-        # Удаление отключенных клиентов
-        for ws in disconnected:
-            storage.remove_websocket(ws)
+        self.publish(data)
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        lags = [c.lag(now) for c in self.clients.values()]
+        return {
+            "clients": len(self.clients),
+            "subscribed": sum(1 for c in self.clients.values() if c.subscription is not None),
+            "max_clients": self.max_clients,
+            "max_lag_sec": round(max(lags), 4) if lags else 0.0,
+            "queued_frames": sum(len(c) for c in self.clients.values()),
+            "dropped_frames": sum(c.dropped for c in self.clients.values()),
+            "coalesced_updates": sum(c.coalesced for c in self.clients.values()),
+            "evicted": self.evicted,
+            "rejected": self.rejected,
+        }
 
 
 # Глобальный экземпляр сервиса
@@ -0,0 +1,102 @@
+"""
+Подделки внешних зависимостей и вспомогательные функции для тестов
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Set
+
+
+def wait_until(condition: Callable[[], bool], timeout: float = 5.0) -> bool:
+    """Ждет, пока условие (проверяемое в фоновых потоках) станет истинным."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.005)
+    return condition()
+
+
+class FakeFcmError(Exception):
+    """Ошибка FCM с кодом, как у firebase_admin.exceptions"""
+
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.code = code
+
+
+def _record(**kwargs) -> SimpleNamespace:
+    return SimpleNamespace(**kwargs)
+
+
+class FakeMessaging:
+    """
+    Модуль firebase_admin.messaging с тем же API, что использует сервис.
+
+    transient - сколько следующих вызовов send_each_for_multicast упадут
+    целиком (временная ошибка транспорта); token_errors - код ошибки по токену.
+    """
+
+    MulticastMessage = staticmethod(_record)
+    Notification = staticmethod(_record)
+    AndroidConfig = staticmethod(_record)
+    AndroidNotification = staticmethod(_record)
+    APNSConfig = staticmethod(_record)
+    APNSPayload = staticmethod(_record)
+    Aps = staticmethod(_record)
+
+    def __init__(self):
+        self.transient = 0
+        self.token_errors: Dict[str, str] = {}
+        self.calls: List[List[str]] = []
+        self.delivered: Set[str] = set()
+
+    def send_each_for_multicast(self, message) -> SimpleNamespace:
+        tokens = list(message.tokens)
+        self.calls.append(tokens)
+        if self.transient > 0:
+            self.transient -= 1
+            raise FakeFcmError("unavailable")
+        responses = []
+        for token in tokens:
+            code = self.token_errors.get(token)
+            if code is None:
+                self.delivered.add(token)
+                responses.append(SimpleNamespace(success=True, exception=None))
+            else:
+                responses.append(SimpleNamespace(success=False, exception=FakeFcmError(code)))
+        return SimpleNamespace(responses=responses)
+
+
+class FakeWebSocket:
+    """
+    Клиент с API starlette WebSocket.
+
+    Пока gate сброшен, отправка висит (зависший клиент); fail - отправка
+    падает, как на оборванном соединении.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.frames: List = []
+        self.fail = fail
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.closed_code: Optional[int] = None
+
+    async def accept(self) -> None:
+        pass
+
+    async def _deliver(self, frame) -> None:
+        await self.gate.wait()
+        if self.fail or self.closed_code is not None:
+            raise RuntimeError("websocket closed")
+        self.frames.append(frame)
+
+    async def send_text(self, data: str) -> None:
+        await self._deliver(data)
+
+    async def send_bytes(self, data: bytes) -> None:
+        await self._deliver(data)
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        self.closed_code = code
@@ -0,0 +1,98 @@
+"""
+Тесты движка правил алертов: гистерезис, debounce, cooldown, скорость роста
+"""
+import math
+
+from app.core.alert_rules import AlertEngine, compile_rules
+
+PROFILE = {"name": "test", "temp_max": 30.0, "co2_max": 1000.0}
+NORMAL = (25.0, 40.0, 600.0, 1.0, 300.0)
+
+
+def _engine(debounce: float = 0.0, cooldown: float = 0.0, profile: dict = PROFILE) -> AlertEngine:
+    engine = AlertEngine(debounce_sec=debounce, cooldown_sec=cooldown)
+    engine.set_profile(profile, 1)
+    return engine
+
+
+def _temp(t: float) -> tuple:
+    return (t,) + NORMAL[1:]
+
+
+def _names(fired) -> list:
+    return [r.name for r in fired] if fired else []
+
+
+def test_rules_without_threshold_are_disabled():
+    rules = {r.name: r for r in compile_rules(PROFILE, 0.0, 0.0)}
+    assert rules["temperature_high"].limit == 30.0
+    assert rules["humidity_high"].limit == math.inf
+    assert rules["temperature_low"].limit == -math.inf
+
+
+def test_hysteresis_band():
+    engine = _engine()
+    assert _names(engine.process("d", 1, _temp(30.5))) == ["temperature_high"]
+    # Ниже порога, но в полосе гистерезиса (0.5) - нарушение остается активным
+    engine.process("d", 2, _temp(29.8))
+    assert engine.active_rules("d") == ["temperature_high"]
+    engine.process("d", 3, _temp(29.4))
+    assert engine.active_rules("d") == []
+    assert _names(engine.process("d", 4, _temp(30.5))) == ["temperature_high"]
+
+
+def test_debounce_requires_sustained_breach():
+    engine = _engine(debounce=60)
+    assert engine.process("d", 0, _temp(31)) is None
+    assert engine.process("d", 30, _temp(31)) is None
+    # Короткий выход из нарушения сбрасывает отсчет
+    engine.process("d", 40, _temp(25))
+    assert engine.process("d", 50, _temp(31)) is None
+    assert engine.process("d", 100, _temp(31)) is None
+    assert _names(engine.process("d", 110, _temp(31))) == ["temperature_high"]
+
+
+def test_cooldown_limits_reminders():
+    engine = _engine(cooldown=300)
+    assert engine.process("d", 0, _temp(31))
+    assert engine.process("d", 100, _temp(31)) is None
+    assert engine.process("d", 299, _temp(31)) is None
+    assert _names(engine.process("d", 300, _temp(31))) == ["temperature_high"]
+    assert engine.stats()["suppressed"] == 2
+
+
+def test_profile_overrides_alert_settings():
+    profile = {**PROFILE, "alerts": {"debounce_sec": 10, "hysteresis": {"temperature": 2.0}}}
+    engine = _engine(profile=profile)
+    assert engine.process("d", 0, _temp(31)) is None
+    assert engine.process("d", 10, _temp(31))
+    engine.process("d", 11, _temp(28.5))
+    assert engine.active_rules("d") == ["temperature_high"]
+
+
+def test_rate_rule_fires_on_fast_rise():
+    engine = _engine()
+    co = list(NORMAL)
+    fired = []
+    for minute in range(10):
+        co[3] = 1.0 + minute * 20.0
+        fired += _names(engine.process("d", minute * 60, tuple(co)))
+    assert "co_rising" in fired
+    assert engine.rate_of("d", "co_ppm") > 5.0
+
+
+def test_devices_are_independent():
+    engine = _engine()
+    engine.process("a", 1, _temp(31))
+    engine.process("b", 1, _temp(25))
+    assert engine.active_rules("a") == ["temperature_high"]
+    assert engine.active_rules("b") == []
+
+
+def test_stale_readings_are_skipped():
+    engine = _engine(debounce=60)
+    engine.process("d", 100, _temp(31))
+    assert engine.process("d", 50, _temp(31)) is None
+    assert engine.process("d", 100, _temp(31)) is None
+    assert engine.stats()["stale"] == 2
+    assert _names(engine.process("d", 160, _temp(31))) == ["temperature_high"]
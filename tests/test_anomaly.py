@@ -0,0 +1,83 @@
+"""
+Тесты потоковых детекторов аномалий: z-оценка, скачок, залипание, прогрев
+"""
+import random
+
+from app.core.anomaly import AnomalyStore
+from app.core.ring_buffer import anomaly_fields
+
+BASE = (22.0, 45.0, 600.0, 1.0, 300.0)
+NOISE = (0.1, 0.5, 10.0, 0.2, 5.0)
+
+
+def _noisy(rng: random.Random) -> tuple:
+    return tuple(b + rng.gauss(0, s) for b, s in zip(BASE, NOISE))
+
+
+def _warm(store: AnomalyStore, rng: random.Random, n: int = 200) -> float:
+    ts = 0.0
+    for _ in range(n):
+        ts += 5
+        store.update("d", ts, _noisy(rng))
+    return ts
+
+
+def test_no_flags_during_warmup():
+    store = AnomalyStore(warmup=20)
+    for i in range(20):
+        mask, score = store.update("d", i, (22.0 + i * 10, 45, 600, 1, 300))
+        assert (mask, score) == (0, 0.0)
+
+
+def test_spike_and_zscore_flagged():
+    rng = random.Random(1)
+    store = AnomalyStore()
+    ts = _warm(store, rng)
+    mask, score = store.update("d", ts + 5, (27.0,) + _noisy(rng)[1:])
+    fields = anomaly_fields(mask, score)
+    assert fields["anomaly"]
+    assert "temperature:zscore" in fields["anomalies"]
+    assert "temperature:spike" in fields["anomalies"]
+    assert score > store.z_threshold
+
+
+def test_stuck_nonzero_value_flagged_zero_is_not():
+    rng = random.Random(2)
+    store = AnomalyStore(stuck_count=30)
+    ts = _warm(store, rng)
+    fields = None
+    for _ in range(30):
+        ts += 5
+        values = list(_noisy(rng))
+        values[1] = 45.0   # влажность залипла
+        values[4] = 0.0    # освещенность ночью - не залипание
+        fields = anomaly_fields(*store.update("d", ts, tuple(values)))
+    assert "humidity:stuck" in fields["anomalies"]
+    assert not any(a.startswith("lux:stuck") for a in fields["anomalies"])
+
+
+def test_noise_rarely_flags():
+    rng = random.Random(3)
+    store = AnomalyStore()
+    flagged = sum(store.update("d", i, _noisy(rng))[0] != 0 for i in range(5000))
+    assert flagged / 5000 < 0.01
+
+
+def test_out_of_order_reading_not_scored():
+    rng = random.Random(4)
+    store = AnomalyStore()
+    ts = _warm(store, rng)
+    assert store.update("d", ts - 100, (100.0, 0, 0, 0, 0)) == (0, 0.0)
+    assert store.update("d", ts, (100.0, 0, 0, 0, 0)) == (0, 0.0)
+    assert store.devices["d"].last_ts == ts
+
+
+def test_stats_count_flags_by_kind():
+    rng = random.Random(5)
+    store = AnomalyStore()
+    ts = _warm(store, rng)
+    store.update("d", ts + 5, (40.0,) + _noisy(rng)[1:])
+    stats = store.stats()
+    assert stats["devices"] == 1
+    assert stats["flagged"]["zscore"] >= 1
+    assert stats["flagged"]["spike"] >= 1
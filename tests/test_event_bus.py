@@ -0,0 +1,185 @@
+"""
+Тесты шины событий: политики переполнения, счетчики потерь и задержки
+"""
+import threading
+import time
+
+import pytest
+
+from app.core.event_bus import BLOCK, COALESCE, DROP_OLDEST, Consumer, EventBus
+from tests.fakes import wait_until
+
+
+class Gate:
+    """Обработчик, который держит поток потребителя, пока его не откроют"""
+
+    def __init__(self):
+        self.opened = threading.Event()
+        self.entered = threading.Event()
+        self.seen = []
+
+    def __call__(self, event):
+        self.entered.set()
+        self.opened.wait(5)
+        self.seen.append(event)
+
+
+@pytest.fixture
+def consumers():
+    created = []
+    yield created
+    for c in created:
+        c.stop()
+
+
+def _consumer(consumers: list, *args, **kwargs) -> Consumer:
+    c = Consumer(*args, **kwargs)
+    consumers.append(c)
+    return c
+
+
+def _stalled(consumers: list, gate: Gate, first=-1, **kwargs) -> Consumer:
+    """Потребитель, поток которого занят первым событием."""
+    c = _consumer(consumers, "t", gate, **kwargs)
+    c.start()
+    c.put(first)
+    assert gate.entered.wait(5)
+    return c
+
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        Consumer("t", print, policy="fifo")
+    with pytest.raises(ValueError):
+        Consumer("t", print, policy=COALESCE)
+
+
+def test_drop_oldest_keeps_newest(consumers):
+    gate = Gate()
+    c = _stalled(consumers, gate, maxsize=3, policy=DROP_OLDEST)
+    for i in range(10):
+        c.put(i)
+    stats = c.stats()
+    assert stats["depth"] == 3
+    assert stats["dropped"] == 7
+    gate.opened.set()
+    assert wait_until(lambda: c.processed == 4)
+    assert gate.seen == [-1, 7, 8, 9]
+
+
+def test_block_without_timeout_is_lossless(consumers):
+    seen = []
+    c = _consumer(consumers, "t", lambda e: (time.sleep(0.0005), seen.append(e)),
+                  maxsize=2, policy=BLOCK, block_timeout=None)
+    c.start()
+    for i in range(200):
+        c.put(i)
+    assert wait_until(lambda: c.processed == 200)
+    assert seen == list(range(200))
+    assert c.dropped == 0
+    assert c.blocked > 0
+
+
+def test_block_timeout_bounds_publisher_wait(consumers):
+    gate = Gate()
+    c = _stalled(consumers, gate, maxsize=2, policy=BLOCK, block_timeout=0.02)
+    c.put(0)
+    c.put(1)
+    started = time.monotonic()
+    for i in range(2, 7):
+        c.put(i)
+    elapsed = time.monotonic() - started
+    assert 0.1 <= elapsed < 1.0
+    stats = c.stats()
+    assert stats["dropped"] == 5
+    assert stats["blocked"] == 5
+    assert stats["blocked_sec"] >= 0.1
+    gate.opened.set()
+    assert wait_until(lambda: c.processed == 3)
+    # Отбрасываются новые события, очередь сохраняет порядок
+    assert gate.seen == [-1, 0, 1]
+
+
+def test_block_waits_until_room(consumers):
+    gate = Gate()
+    c = _stalled(consumers, gate, maxsize=1, policy=BLOCK, block_timeout=None)
+    c.put(0)
+    publisher = threading.Thread(target=c.put, args=(1,))
+    publisher.start()
+    publisher.join(0.1)
+    assert publisher.is_alive()
+    gate.opened.set()
+    publisher.join(5)
+    assert not publisher.is_alive()
+    assert wait_until(lambda: c.processed == 3)
+    assert c.dropped == 0
+
+
+def test_full_block_queue_does_not_hang_when_consumer_stopped(consumers):
+    c = _consumer(consumers, "t", lambda e: None, maxsize=1, policy=BLOCK, block_timeout=None)
+    c.put(0)
+    started = time.monotonic()
+    c.put(1)
+    assert time.monotonic() - started < 0.5
+    assert c.dropped == 1
+
+
+def test_coalesce_keeps_last_per_key_in_first_position(consumers):
+    gate = Gate()
+    c = _stalled(consumers, gate, first=("-", 0), maxsize=10, policy=COALESCE, key=lambda e: e[0])
+    for event in [("a", 1), ("b", 1), ("a", 2), ("a", 3), ("c", 1)]:
+        c.put(event)
+    stats = c.stats()
+    assert stats["depth"] == 3
+    assert stats["coalesced"] == 2
+    gate.opened.set()
+    assert wait_until(lambda: c.processed == 4)
+    assert gate.seen == [("-", 0), ("a", 3), ("b", 1), ("c", 1)]
+
+
+def test_coalesce_drops_oldest_key_when_full(consumers):
+    gate = Gate()
+    c = _stalled(consumers, gate, maxsize=2, policy=COALESCE, key=lambda e: e)
+    for key in ("a", "b", "c"):
+        c.put(key)
+    assert c.dropped == 1
+    gate.opened.set()
+    assert wait_until(lambda: c.processed == 3)
+    assert gate.seen == [-1, "b", "c"]
+
+
+def test_lag_and_error_counters(consumers):
+    gate = Gate()
+    c = _stalled(consumers, gate, maxsize=10, policy=DROP_OLDEST)
+    c.put(0)
+    time.sleep(0.05)
+    assert c.stats()["lag_sec"] >= 0.05
+    gate.opened.set()
+    assert wait_until(lambda: c.processed == 2)
+    assert c.max_lag >= 0.05
+
+    def fail(event):
+        raise RuntimeError("boom")
+
+    bad = _consumer(consumers, "bad", fail)
+    bad.start()
+    bad.put(1)
+    assert wait_until(lambda: bad.processed == 1)
+    assert bad.errors == 1
+
+
+def test_bus_publishes_to_every_consumer(consumers):
+    bus = EventBus()
+    a, b = [], []
+    consumers.extend([
+        bus.subscribe(Consumer("a", a.append)),
+        bus.subscribe(Consumer("b", b.append, policy=COALESCE, key=lambda e: e)),
+    ])
+    bus.start()
+    for i in range(5):
+        bus.publish(i)
+    assert wait_until(lambda: len(a) == 5 and len(b) == 5)
+    bus.stop()
+    assert bus.consumer("b") is consumers[1]
+    assert bus.stats()["published"] == 5
+    assert set(bus.stats()["consumers"]) == {"a", "b"}
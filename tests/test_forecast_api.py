@@ -0,0 +1,40 @@
+"""
+Тесты маршрута пакетного прогноза: разбор горизонтов и моделей
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes import climate
+from app.core.storage import storage
+
+app = FastAPI()
+app.include_router(climate.router)
+client = TestClient(app)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def device():
+    storage.update_current_data({"temperature": 21, "humidity": 40, "co2_ppm": 600, "co_ppm": 2,
+                                 "lux": 300, "device_id": "forecast_test"})
+
+
+@pytest.mark.parametrize("horizons", ["inf", "infm", "-inf", "nan", "1e400s", "abc", "0m"])
+def test_bad_horizon(horizons):
+    body = client.get("/api/forecast", params={"devices": "forecast_test", "horizons": horizons}).json()
+    assert body["error"] == "bad_horizon"
+
+
+def test_bad_model():
+    body = client.get("/api/forecast", params={"devices": "forecast_test", "models": "arima"}).json()
+    assert body["error"] == "bad_model"
+
+
+def test_horizons_and_models():
+    body = client.get("/api/forecast", params={
+        "devices": "forecast_test,missing", "horizons": "30m,90m", "models": "linear,ewma",
+    }).json()
+    assert body["missing"] == ["missing"]
+    assert body["horizons"]["90m"] == {"minutes": 90, "steps_ahead": 18}
+    assert set(body["devices"]["forecast_test"]) == {"linear", "ewma"}
+    assert body["devices"]["forecast_test"]["ewma"]["30m"]["temperature"] == 21.0
@@ -0,0 +1,170 @@
+"""
+Тесты SQLite истории: пакетный писатель, миграции схемы, постраничное чтение
+"""
+import sqlite3
+
+import pytest
+
+from app.core.history_db import HistoryStore
+from tests.fakes import wait_until
+
+T0 = 1_700_000_000.0
+
+
+def _record(i: int, ts: float = None, device_id: str = "d") -> tuple:
+    return (device_id, T0 + i if ts is None else ts, 20.0 + i, 40.0, 600.0, 1.0, 300.0, 0, "p", 0, 0.0)
+
+
+class _RecordingConnection:
+    """Обертка соединения писателя: размеры пачек executemany"""
+
+    def __init__(self, conn: sqlite3.Connection, batches: list):
+        self._conn = conn
+        self._batches = batches
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        self._batches.append(len(rows))
+        return self._conn.executemany(sql, rows)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class RecordingStore(HistoryStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches: list = []
+
+    def _connect(self):
+        return _RecordingConnection(super()._connect(), self.batches)
+
+
+@pytest.fixture
+def stores():
+    created = []
+    yield created
+    for store in created:
+        store.stop()
+
+
+def _store(stores: list, path, cls=HistoryStore, **kwargs) -> HistoryStore:
+    store = cls(str(path), **kwargs)
+    stores.append(store)
+    return store
+
+
+def test_writer_flushes_in_batches_of_batch_size(stores, tmp_path):
+    store = _store(stores, tmp_path / "h.db", RecordingStore, batch_size=10, flush_interval=5.0)
+    # Очередь заполнена до старта писателя - он разбирает ее пачками
+    for i in range(25):
+        store._queue.put(_record(i))
+    assert store.start()
+    assert wait_until(lambda: store.written == 25)
+    assert store.batches == [10, 10, 5]
+
+
+def test_single_records_written_without_waiting_for_full_batch(stores, tmp_path):
+    store = _store(stores, tmp_path / "h.db", batch_size=100, flush_interval=0.05)
+    assert store.start()
+    for i in range(3):
+        store.append(_record(i))
+    assert wait_until(lambda: store.written == 3, timeout=1.0)
+    assert [r["temp"] for r in store.query("d", limit=10)] == [20.0, 21.0, 22.0]
+
+
+def test_stop_flushes_queue(tmp_path):
+    store = HistoryStore(str(tmp_path / "h.db"), batch_size=7, flush_interval=10.0)
+    assert store.start()
+    for i in range(50):
+        store.append(_record(i))
+    store.stop()
+    assert store.written == 50
+    assert not store.running
+    store.append(_record(99))   # после остановки - молча игнорируется
+
+
+def test_append_without_wait_drops_when_full(tmp_path):
+    store = HistoryStore(str(tmp_path / "h.db"), queue_size=2)
+    assert store.start(writer=False)
+    store._thread = _AliveThread()
+    try:
+        for i in range(5):
+            store.append(_record(i))
+        assert store.dropped == 3
+    finally:
+        store._thread = None
+        store.stop()
+
+
+class _AliveThread:
+    """Писатель "работает", но очередь не разбирает"""
+
+    def is_alive(self) -> bool:
+        return True
+
+
+def test_append_with_wait_is_lossless(stores, tmp_path):
+    store = _store(stores, tmp_path / "h.db", queue_size=1, batch_size=5, flush_interval=0.05)
+    assert store.start()
+    for i in range(300):
+        store.append(_record(i), wait=True)
+    assert wait_until(lambda: store.written == 300)
+    assert store.dropped == 0
+
+
+def test_iter_range_pages_across_equal_timestamps(stores, tmp_path):
+    store = _store(stores, tmp_path / "h.db", batch_size=500)
+    assert store.start()
+    for i in range(25):
+        store.append(_record(i, ts=T0))
+    for i in range(25, 30):
+        store.append(_record(i, ts=T0 + 1))
+    store.append(_record(0, device_id="other"))
+    assert wait_until(lambda: store.written == 31)
+
+    rows = list(store.iter_range("d", page_size=10))
+    assert [r[1] for r in rows] == [20.0 + i for i in range(30)]
+    assert len(list(store.iter_range("d", T0 + 1, None, page_size=2))) == 5
+    assert len(list(store.iter_range("d", None, T0, page_size=3))) == 25
+    assert list(store.iter_range("missing")) == []
+
+
+def test_query_and_aggregate(stores, tmp_path):
+    store = _store(stores, tmp_path / "h.db")
+    assert store.start()
+    for i in range(120):
+        store.append(_record(i))
+    assert wait_until(lambda: store.written == 120)
+    rows = store.query("d", T0 + 10, T0 + 50, limit=5)
+    assert [r["temp"] for r in rows] == [66.0, 67.0, 68.0, 69.0, 70.0]
+    buckets = store.aggregate("d", 60, T0)
+    assert sum(count for _, count, _ in buckets) == 120
+    assert sorted(store.device_ids()) == ["d"]
+    assert [r[0] for r in store.recent_raw("d", 3)] == [T0 + 117, T0 + 118, T0 + 119]
+
+
+def test_reopen_migrates_old_schema(stores, tmp_path):
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(str(path))
+    conn.executescript(
+        "CREATE TABLE readings (device_id TEXT NOT NULL, ts REAL NOT NULL, temp REAL NOT NULL, "
+        "hum REAL NOT NULL, co2 REAL NOT NULL, co REAL NOT NULL, lux REAL NOT NULL, "
+        "issues INTEGER NOT NULL, profile TEXT);"
+    )
+    conn.execute("INSERT INTO readings VALUES ('d', ?, 21, 40, 600, 1, 300, 0, 'p')", (T0,))
+    conn.commit()
+    conn.close()
+
+    store = _store(stores, path)
+    assert store.start()
+    assert store.recent_raw("d", 10) == [(T0, 21.0, 40.0, 600.0, 1.0, 300.0, 0, "p", 0, 0.0)]
+    store.append(_record(1))
+    store.stop()
+
+    # Повторное открытие уже обновленной базы
+    reopened = _store(stores, path)
+    assert reopened.start()
+    assert len(reopened.recent_raw("d", 10)) == 2
+    columns = [row[1] for row in sqlite3.connect(str(path)).execute("PRAGMA table_info(readings)")]
+    assert columns[-2:] == ["anomaly", "anomaly_score"]
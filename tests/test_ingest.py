@@ -0,0 +1,116 @@
+"""
+Тесты пакетной загрузки: разбор, проверка, порядок вставки и догрузка
+"""
+import json
+import threading
+import time
+import uuid
+
+import pytest
+
+from app.core.storage import storage
+from app.services.ingest_service import BatchDecoder, BatchTooLarge, IngestService
+
+
+@pytest.fixture
+def device() -> str:
+    return f"test_{uuid.uuid4().hex[:8]}"
+
+
+def _record(device_id: str, ts: float, temp: float = 21.0) -> dict:
+    return {"temperature": temp, "humidity": 40, "co2_ppm": 600, "co_ppm": 2, "lux": 300,
+            "device_id": device_id, "ts": ts}
+
+
+def _readings(service: IngestService, records: list) -> list:
+    return service.validate(records, {})
+
+
+def _buffer_ts(device_id: str) -> list:
+    return list(storage.get_history_view(None, device_id).iter_column("ts"))
+
+
+def test_decoder_joins_lines_split_across_chunks():
+    body = b"\n".join(json.dumps(_record("a", i)).encode() for i in range(3)) + b"\n{bad"
+    decoder = BatchDecoder("ndjson", 10)
+    for i in range(0, len(body), 7):
+        decoder.feed(body[i:i + 7])
+    decoder.close()
+    assert len(decoder.records) == 4
+    assert decoder.records[3] is None
+    assert decoder.errors == {3: ["некорректный JSON"]}
+
+
+def test_decoder_limits_rows():
+    decoder = BatchDecoder("ndjson", 2)
+    with pytest.raises(BatchTooLarge):
+        decoder.feed(b"{}\n{}\n{}\n")
+
+
+def test_validate_sorts_by_time_and_reports_bad_rows(device):
+    now = time.time()
+    records = [
+        _record(device, now - 10),
+        _record(device, (now - 30) * 1000),   # миллисекунды
+        _record(device, now - 20, temp="abc"),
+        None,
+        _record(device, now + 3600),
+    ]
+    errors = {3: ["некорректный JSON"]}
+    readings = IngestService().validate(records, errors)
+    assert [r["ts"] for r in readings] == pytest.approx([now - 30, now - 10])
+    assert sorted(errors) == [2, 3, 4]
+    assert errors[2][0].startswith("temperature")
+    assert errors[4] == ["ts: некорректная метка времени"]
+
+
+def test_overlapping_batch_is_backfilled(device):
+    service = IngestService()
+    now = time.time()
+    latest, backfilled = service.apply(_readings(service, [_record(device, now - 100 + i) for i in range(10)]))
+    assert backfilled == 0
+    assert latest[device]["ts"] == now - 91
+
+    batch = [_record(device, now - 105 + i) for i in range(10)] + [_record(device, now - 50)]
+    latest, backfilled = service.apply(_readings(service, batch))
+    assert backfilled == 10
+    assert latest[device]["ts"] == now - 50
+    assert _buffer_ts(device) == [now - 100 + i for i in range(10)] + [now - 50]
+    # Догруженные показания попадают в агрегаты
+    _, rows, _ = storage.rollups.query(device, 86400, now - 200, now, ["count"], now_ts=now)
+    assert sum(r["count"] for r in rows) == 21
+
+
+def test_backfill_of_new_device_keeps_current_data(device):
+    service = IngestService()
+    now = time.time()
+    live = f"{device}_live"
+    service.apply(_readings(service, [_record(live, now)]))
+    service.apply(_readings(service, [_record(device, now - 3600 + i) for i in range(5)]))
+    assert storage.current_data["device_id"] == live
+    assert storage.get_current(device)["timestamp"] is not None
+    assert storage.last_ts(device) == now - 3596
+
+
+def test_concurrent_live_readings_keep_buffer_order(device):
+    service = IngestService()
+    now = time.time()
+    stop = threading.Event()
+
+    def live():
+        i = 0
+        while not stop.is_set():
+            storage.apply_reading(storage.build_reading(_record(device, 0), ts=now + i))
+            i += 1
+
+    thread = threading.Thread(target=live)
+    thread.start()
+    try:
+        for k in range(20):
+            batch = [_record(device, now - 5000 + k * 100 + j) for j in range(100)]
+            service.apply(_readings(service, batch))
+    finally:
+        stop.set()
+        thread.join()
+    ts = _buffer_ts(device)
+    assert all(a < b for a, b in zip(ts, ts[1:]))
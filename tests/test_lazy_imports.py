@@ -0,0 +1,106 @@
+"""
+Тесты отложенной загрузки: импорт app.main не трогает firebase_admin/grpc,
+SDK загружается только включенной интеграцией при первом обращении
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from app.core.integrations import IntegrationRegistry
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY = ("firebase_admin", "grpc", "google.cloud")
+
+# Отдельный процесс: в этом sys.modules уже все, что импортировали другие тесты.
+# Finder только записывает попытки импорта, сам ничего не загружает.
+_PROBE = """
+import importlib.abc, json, sys
+
+HEAVY = %r
+attempts = []
+
+def heavy(name):
+    return any(name == p or name.startswith(p + ".") for p in HEAVY)
+
+class Watch(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path=None, target=None):
+        if heavy(name):
+            attempts.append(name)
+        return None
+
+sys.meta_path.insert(0, Watch())
+import app.main
+result = {"imported": [m for m in sys.modules if heavy(m)], "on_import": list(attempts)}
+if %r:
+    from app.services.firebase_service import firebase_sdk
+    firebase_sdk.get()
+result["attempts"] = attempts
+print(json.dumps(result))
+"""
+
+
+def _probe(tmp_path, fcm_enabled: bool, load_sdk: bool = False) -> dict:
+    env = {
+        **os.environ,
+        "HISTORY_DB_PATH": str(tmp_path / "history.db"),
+        "PUSH_TOKENS_DB_PATH": str(tmp_path / "tokens.db"),
+        "MQTT_HOST": "127.0.0.1",
+        "MQTT_PORT": "1",
+        "LOG_LEVEL": "ERROR",
+        "FCM_ENABLED": "true" if fcm_enabled else "false",
+    }
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE % (HEAVY, load_sdk)],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=60, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("fcm_enabled", [False, True])
+def test_app_import_skips_firebase_stack(tmp_path, fcm_enabled):
+    result = _probe(tmp_path, fcm_enabled)
+    assert result["imported"] == []
+    assert result["on_import"] == []
+
+
+def test_sdk_imported_on_first_use_when_enabled(tmp_path):
+    result = _probe(tmp_path, fcm_enabled=True, load_sdk=True)
+    assert result["on_import"] == []
+    assert result["attempts"][0] == "firebase_admin"
+
+
+def test_sdk_not_imported_when_disabled(tmp_path):
+    result = _probe(tmp_path, fcm_enabled=False, load_sdk=True)
+    assert result["attempts"] == []
+
+
+def test_integration_loads_once_and_records_errors():
+    registry = IntegrationRegistry()
+    enabled = {"value": False}
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return "module"
+
+    def broken():
+        calls.append(2)
+        raise ImportError("No module named 'sdk'")
+
+    item = registry.register("sdk", lambda: enabled["value"], loader)
+    assert registry.get("sdk") is None and calls == []
+    enabled["value"] = True
+    assert registry.get("sdk") == "module" and registry.get("sdk") == "module"
+    assert calls == [1] and item.loaded and item.load_sec is not None
+
+    failed = registry.register("missing", lambda: True, broken)
+    assert failed.get() is None and failed.get() is None
+    assert calls == [1, 2]
+    assert registry.stats()["missing"] == {
+        "enabled": True, "loaded": False, "load_sec": failed.stats()["load_sec"], "error": "No module named 'sdk'",
+    }
+    assert registry.get("unknown") is None
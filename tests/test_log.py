@@ -0,0 +1,139 @@
+"""
+Тесты логирования через очередь: отбрасывание при переполнении,
+форматирование на стороне потока записи, прореживание по устройствам
+"""
+import io
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueListener
+from types import SimpleNamespace
+
+import pytest
+
+from app.core import log as log_module
+from app.core.log import DeviceSampler, DroppingQueueHandler, JsonFormatter, TextFormatter
+
+
+@pytest.fixture
+def logger():
+    lg = logging.getLogger("test.log.queue")
+    lg.setLevel(logging.DEBUG)
+    lg.propagate = False
+    yield lg
+    for handler in list(lg.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            lg.removeHandler(handler)
+
+
+def _listen(handler: DroppingQueueHandler, formatter: logging.Formatter):
+    stream = io.StringIO()
+    output = logging.StreamHandler(stream)
+    output.setFormatter(formatter)
+    listener = QueueListener(handler.queue, output, respect_handler_level=False)
+    listener.start()
+    return listener, stream
+
+
+def test_full_queue_drops_and_counts(logger):
+    handler = DroppingQueueHandler(queue.Queue(maxsize=3))
+    logger.addHandler(handler)
+    for i in range(10):
+        logger.info("строка %d", i)
+    assert handler.queue.qsize() == 3
+    assert handler.dropped == 7
+    assert [r.args for r in list(handler.queue.queue)] == [(0,), (1,), (2,)]
+
+
+def test_record_enqueued_unformatted():
+    handler = DroppingQueueHandler(queue.Queue())
+    try:
+        raise ValueError("сбой")
+    except ValueError:
+        exc_info = sys.exc_info()
+    record = logging.makeLogRecord({
+        "name": "test.log.queue", "levelno": logging.ERROR, "levelname": "ERROR",
+        "msg": "ошибка %s", "args": ("x",), "exc_info": exc_info, "device_id": "d1",
+    })
+    handler.handle(record)
+    queued = handler.queue.get_nowait()
+    # Вызывающий поток ничего не форматирует - это делает поток записи
+    assert queued is record
+    assert queued.msg == "ошибка %s" and queued.args == ("x",)
+    assert queued.exc_info is exc_info and queued.exc_text is None
+    assert not hasattr(queued, "message")
+    assert "ошибка x | device_id=d1" in TextFormatter().format(queued)
+
+
+def test_text_formatted_by_listener(logger):
+    handler = DroppingQueueHandler(queue.Queue())
+    logger.addHandler(handler)
+    listener, stream = _listen(handler, TextFormatter())
+    try:
+        logger.warning("⚠️ показание %s: %.1f", "d1", 21.456, extra={"device_id": "d1", "n": 3})
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.error("❌ сбой", exc_info=True)
+    finally:
+        listener.stop()
+    lines = stream.getvalue().splitlines()
+    assert lines[0].endswith("WARNING test.log.queue: ⚠️ показание d1: 21.5 | device_id=d1 n=3")
+    assert "ERROR   test.log.queue: ❌ сбой" in lines[1]
+    assert lines[2] == "Traceback (most recent call last):"
+    assert lines[-1] == "ZeroDivisionError: division by zero"
+
+
+def test_json_formatted_by_listener(logger):
+    handler = DroppingQueueHandler(queue.Queue())
+    logger.addHandler(handler)
+    listener, stream = _listen(handler, JsonFormatter())
+    try:
+        logger.info("📨 отправлено %d", 5, extra={"user_id": "u", "tokens": 7})
+        try:
+            raise KeyError("k")
+        except KeyError:
+            logger.exception("❌ ошибка")
+    finally:
+        listener.stop()
+    first, second = map(json.loads, stream.getvalue().splitlines())
+    assert {k: first[k] for k in ("level", "logger", "msg", "user_id", "tokens")} == {
+        "level": "info", "logger": "test.log.queue", "msg": "📨 отправлено 5", "user_id": "u", "tokens": 7,
+    }
+    assert "exc" not in first
+    assert second["level"] == "error" and "KeyError: 'k'" in second["exc"]
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_device_sampler_rate(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(log_module, "time", SimpleNamespace(monotonic=clock.monotonic))
+    sampler = DeviceSampler(interval=1.0)
+
+    def at(t: float, key: str = "a"):
+        clock.now = t
+        return sampler.allow(key)
+
+    assert at(0.0) == 0
+    assert at(0.3) is None
+    assert at(0.6) is None
+    assert at(0.6, "b") == 0        # у каждого устройства свой интервал
+    assert at(1.0) == 2             # в строке - сколько пропущено
+    assert at(1.5) is None
+    assert at(2.1) == 1
+    assert at(2.2, "b") == 0
+    assert sampler.sampled_out == 3
+
+
+def test_device_sampler_disabled():
+    sampler = DeviceSampler(interval=0)
+    assert [sampler.allow("a") for _ in range(3)] == [0, 0, 0]
+    assert sampler.sampled_out == 0
@@ -0,0 +1,165 @@
+"""
+Тесты текстового формата Prometheus: HELP/TYPE, суффиксы серий, корзины,
+экранирование меток (вывод разбирается обратно)
+"""
+import math
+import re
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes import metrics as metrics_route
+from app.core.metrics import MetricsRegistry
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$")
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"(,|$)')
+_UNESCAPE = {"\\\\": "\\", "\\n": "\n", '\\"': '"'}
+
+
+def _unescape(value: str) -> str:
+    return re.sub(r'\\[\\n"]', lambda m: _UNESCAPE[m.group(0)], value)
+
+
+def _parse_labels(text: str) -> dict:
+    body, labels, pos = text[1:-1], {}, 0
+    while pos < len(body):
+        m = _LABEL.match(body, pos)
+        assert m, f"метки не разобраны: {text}"
+        labels[m.group(1)] = _unescape(m.group(2))
+        pos = m.end()
+    return labels
+
+
+def _parse_value(text: str) -> float:
+    return {"+Inf": math.inf, "-Inf": -math.inf, "NaN": math.nan}.get(text) or float(text)
+
+
+def parse(text: str) -> dict:
+    """Семейства {имя: {"help", "type", "samples": [(серия, метки, значение)]}}"""
+    families: dict = {}
+    current = None
+    assert text.endswith("\n")
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name, _, doc = line[7:].partition(" ")
+            assert name not in families, f"повтор семейства {name}"
+            current = families[name] = {"help": _unescape(doc), "type": None, "samples": []}
+        elif line.startswith("# TYPE "):
+            name, _, kind = line[7:].partition(" ")
+            assert current is families.get(name), f"TYPE без HELP: {name}"
+            current["type"] = kind
+        elif line.startswith("#") or not line:
+            continue
+        else:
+            m = _SAMPLE.match(line)
+            assert m, f"строка не разобрана: {line!r}"
+            labels = _parse_labels(m.group(2)) if m.group(2) else {}
+            current["samples"].append((m.group(1), labels, _parse_value(m.group(3))))
+    return families
+
+
+def check_family(name: str, family: dict) -> None:
+    kind = family["type"]
+    assert kind in ("counter", "gauge", "histogram", "untyped")
+    names = {s[0] for s in family["samples"]}
+    if kind == "counter":
+        assert name.endswith("_total") and names <= {name}
+    elif kind == "gauge":
+        assert names <= {name}
+    elif kind == "histogram":
+        assert names <= {name + "_bucket", name + "_sum", name + "_count"}
+        series: dict = {}
+        for sample, labels, value in family["samples"]:
+            key = tuple(sorted((k, v) for k, v in labels.items() if k != "le"))
+            series.setdefault(key, {"buckets": []})
+            if sample == name + "_bucket":
+                series[key]["buckets"].append((_parse_value(labels["le"]), value))
+            else:
+                series[key][sample[len(name) + 1:]] = value
+        for s in series.values():
+            bounds = [b for b, _ in s["buckets"]]
+            counts = [c for _, c in s["buckets"]]
+            assert bounds == sorted(bounds) and bounds[-1] == math.inf
+            assert counts == sorted(counts)
+            assert counts[-1] == s["count"]
+            assert "sum" in s
+
+
+@pytest.fixture
+def registry():
+    reg = MetricsRegistry()
+    requests = reg.counter("http_requests", "Запросы", ("method", "path"))
+    requests.labels("GET", '/a"b\\c\nd').inc()
+    requests.labels("GET", '/a"b\\c\nd').inc(2)
+    requests.labels("POST", "/x").inc()
+    reg.counter("plain", 'Описание с "кавычками" и \\ слешем').inc(0.5)
+    reg.gauge("temp", "Температура").set(21.5)
+    latency = reg.histogram("latency_seconds", "Задержка", ("route",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 2.0, 30.0):
+        latency.labels("r1").observe(v)
+    reg.register_collector(lambda: [("queue_depth", "gauge", "Глубина", [({"q": "a"}, 3), ({"q": "b"}, 0)])])
+    return reg
+
+
+def test_exposition_round_trip(registry):
+    families = parse(registry.render())
+    for name, family in families.items():
+        check_family(name, family)
+
+    assert families["http_requests_total"]["type"] == "counter"
+    assert families["http_requests_total"]["samples"] == [
+        ("http_requests_total", {"method": "GET", "path": '/a"b\\c\nd'}, 3.0),
+        ("http_requests_total", {"method": "POST", "path": "/x"}, 1.0),
+    ]
+    assert families["plain_total"]["help"] == 'Описание с "кавычками" и \\ слешем'
+    assert families["plain_total"]["samples"] == [("plain_total", {}, 0.5)]
+    assert families["temp"]["samples"] == [("temp", {}, 21.5)]
+    assert families["queue_depth"]["samples"][0] == ("queue_depth", {"q": "a"}, 3.0)
+
+
+def test_histogram_buckets(registry):
+    samples = parse(registry.render())["latency_seconds"]["samples"]
+    buckets = {s[1]["le"]: s[2] for s in samples if s[0] == "latency_seconds_bucket"}
+    # Граница корзины включительная: 0.1 попадает в le="0.1"
+    assert buckets == {"0.1": 2, "1": 3, "+Inf": 5}
+    assert ("latency_seconds_count", {"route": "r1"}, 5.0) in samples
+    assert ("latency_seconds_sum", {"route": "r1"}, pytest.approx(32.65)) in samples
+
+
+def test_label_escaping_in_raw_text(registry):
+    text = registry.render()
+    assert 'http_requests_total{method="GET",path="/a\\"b\\\\c\\nd"} 3' in text.splitlines()
+    assert "\n\n" not in text
+
+
+def test_labels_arity_checked(registry):
+    reg = MetricsRegistry()
+    counter = reg.counter("c", "c", ("a",))
+    with pytest.raises(ValueError):
+        counter.labels("x", "y")
+    with pytest.raises(ValueError):
+        reg.counter("c", "повтор")
+
+
+def test_failing_collector_does_not_break_render(registry):
+    def broken():
+        raise RuntimeError("нет данных")
+
+    registry.register_collector(broken)
+    families = parse(registry.render())
+    assert "temp" in families
+
+
+def test_metrics_endpoint_is_valid_exposition():
+    app = FastAPI()
+    app.include_router(metrics_route.router)
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    families = parse(response.text)
+    for name, family in families.items():
+        check_family(name, family)
+    assert families["mqtt_messages_total"]["type"] == "counter"
+    assert families["event_loop_lag_seconds"]["type"] == "histogram"
+    assert families["websocket_clients"]["type"] == "gauge"
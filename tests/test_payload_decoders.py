@@ -0,0 +1,79 @@
+"""
+Тесты декодеров полезной нагрузки MQTT: JSON, msgpack и бинарные кадры
+"""
+import json
+
+import msgpack
+import pytest
+
+from app.services.payload_decoders import (
+    BINARY_V1,
+    BINARY_V2,
+    V1,
+    PayloadError,
+    decode_binary,
+    encode_binary,
+    payload_decoders,
+)
+
+DATA = {"temperature": 22.5, "humidity": 45.25, "co2_ppm": 612.0, "co_ppm": 1.5, "lux": 320.7}
+
+
+def test_json_keys_and_aliases():
+    payload = json.dumps({"temperature": 22.5, "humidity": "45", "co": 3, "lux": 100, "device_id": 7}).encode()
+    data = payload_decoders.decode("sensors/room/data", payload)
+    assert data == {"temperature": 22.5, "humidity": 45.0, "co2_ppm": 0.0, "co_ppm": 3.0,
+                    "lux": 100.0, "device_id": "7"}
+
+
+def test_illuminance_preferred_over_lux():
+    data = payload_decoders.decode("t/json", b'{"illuminance": 50, "lux": 10}')
+    assert data["lux"] == 50.0
+
+
+def test_msgpack():
+    data = payload_decoders.decode("t/data", msgpack.packb({**DATA, "device_id": "esp"}))
+    assert data == {**DATA, "device_id": "esp"}
+
+
+@pytest.mark.parametrize("version", [BINARY_V1, BINARY_V2])
+def test_binary_round_trip(version):
+    frame = encode_binary(DATA, version, device_id="esp32_lab")
+    data = payload_decoders.decode("t/data", frame)
+    assert data.pop("device_id") == "esp32_lab"
+    assert data == pytest.approx(DATA, abs=0.05)
+
+
+def test_binary_v1_size_and_scaling():
+    frame = encode_binary(DATA, BINARY_V1)
+    assert len(frame) == V1.size == 13
+    assert decode_binary(frame)["temperature"] == 22.5
+    assert "device_id" not in decode_binary(frame)
+
+
+@pytest.mark.parametrize("topic, payload, name", [
+    ("t/json", b"  {}", "json"),
+    ("t/msgpack", b"\x80", "msgpack"),
+    ("t/mp", b"\x80", "msgpack"),
+    ("t/bin", b"{", "binary"),
+    ("t/data", b"\xef\xbb\xbf{}", "json"),
+    ("t/data", b"\xde\x00\x00", "msgpack"),
+    ("t/data", b"\x02", "binary"),
+])
+def test_detect(topic, payload, name):
+    assert payload_decoders.detect(topic, payload) == name
+
+
+@pytest.mark.parametrize("topic, payload", [
+    ("t/data", b""),
+    ("t/data", b"\x7f"),
+    ("t/json", b"{bad"),
+    ("t/json", b"[1, 2]"),
+    ("t/msgpack", b"\xc1"),
+    ("t/bin", b"\x01\x00"),
+    ("t/bin", b"\x09" + bytes(20)),
+    ("t/bin", encode_binary(DATA, BINARY_V1) + b"\x05ab"),
+])
+def test_malformed_payloads_raise_payload_error(topic, payload):
+    with pytest.raises(PayloadError):
+        payload_decoders.decode(topic, payload)
@@ -0,0 +1,154 @@
+"""
+Тесты диспетчера push: повторы с backoff, дедлайн, порядок очереди,
+удаление недействительных токенов (транспорт FCM - подделка)
+"""
+import time
+
+import pytest
+
+from app.core.token_store import TokenStore
+from app.services.firebase_service import FirebaseService
+from app.services.push_dispatcher import PushDispatcher
+from tests.fakes import FakeMessaging, wait_until
+
+
+@pytest.fixture
+def service(tmp_path):
+    store = TokenStore(str(tmp_path / "tokens.db"))
+    assert store.start()
+    svc = FirebaseService()
+    svc.tokens = store
+    svc.messaging = FakeMessaging()
+    svc._initialized = True
+    yield svc
+    svc.stop()
+    store.stop()
+
+
+@pytest.fixture
+def dispatchers():
+    created = []
+    yield created
+    for d in created:
+        d.stop()
+
+
+def _dispatcher(dispatchers: list, sender, **kwargs) -> PushDispatcher:
+    d = PushDispatcher(sender=sender, **kwargs)
+    dispatchers.append(d)
+    return d
+
+
+def _fcm_sender(service: FirebaseService):
+    return lambda user_id, title, body, data: service.send_push_to_user(user_id, title, body, data, raise_errors=True)
+
+
+def test_transient_errors_are_retried_with_backoff(service, dispatchers):
+    service.tokens.add("u", "t1")
+    service.messaging.transient = 2
+    d = _dispatcher(dispatchers, _fcm_sender(service), backoff_base=0.02, max_retries=3)
+    d.start()
+    started = time.monotonic()
+    assert d.submit("u", "title", "body")
+    assert wait_until(lambda: d.sent == 1)
+    # Пауза перед повторами: не меньше половины base * 2^attempt
+    assert time.monotonic() - started >= 0.01 + 0.02
+    assert d.retries == 2
+    assert d.failed == 0
+    assert len(service.messaging.calls) == 3
+    assert d.stats()["last_error"] == "unavailable"
+
+
+def test_retries_stop_after_max_retries(service, dispatchers):
+    service.tokens.add("u", "t1")
+    service.messaging.transient = 100
+    d = _dispatcher(dispatchers, _fcm_sender(service), backoff_base=0.001, max_retries=2)
+    d.start()
+    d.submit("u", "title", "body")
+    assert wait_until(lambda: d.failed == 1)
+    assert d.retries == 2
+    assert len(service.messaging.calls) == 3
+
+
+def test_backoff_is_exponential_and_capped():
+    d = PushDispatcher(sender=lambda *a: True, backoff_base=0.5, backoff_max=3.0)
+    for attempt, full in enumerate([0.5, 1.0, 2.0, 3.0, 3.0]):
+        delay = d._backoff(attempt)
+        assert full * 0.5 <= delay <= full
+
+
+def test_retry_past_deadline_is_dropped(service, dispatchers):
+    service.tokens.add("u", "t1")
+    service.messaging.transient = 100
+    # Повтор не раньше чем через 0.5 с - позже дедлайна
+    d = _dispatcher(dispatchers, _fcm_sender(service), backoff_base=1.0, deadline_sec=0.2)
+    d.start()
+    d.submit("u", "title", "body")
+    assert wait_until(lambda: d.failed == 1)
+    assert d.retries == 0
+    assert len(service.messaging.calls) == 1
+
+
+def test_job_past_deadline_expires_without_sending(service, dispatchers):
+    service.tokens.add("u", "t1")
+    d = _dispatcher(dispatchers, _fcm_sender(service), deadline_sec=0.05)
+    d.submit("u", "title", "body")
+    time.sleep(0.1)
+    d.start()
+    assert wait_until(lambda: d.expired == 1)
+    assert service.messaging.calls == []
+
+
+def test_heap_orders_by_ready_time_then_submission(dispatchers):
+    order = []
+    failed_once = set()
+
+    def sender(user_id, title, body, data):
+        order.append(user_id)
+        if user_id == "a" and user_id not in failed_once:
+            failed_once.add(user_id)
+            raise RuntimeError("timeout")
+        return True
+
+    d = _dispatcher(dispatchers, sender, workers=1, backoff_base=0.05)
+    for user_id in ("a", "b", "c"):
+        d.submit(user_id, "title", "body")
+    d.start()
+    assert wait_until(lambda: d.sent == 3)
+    # Повтор "a" ждет backoff и уходит после уже готовых задач
+    assert order == ["a", "b", "c", "a"]
+
+
+def test_full_queue_drops(dispatchers):
+    d = _dispatcher(dispatchers, lambda *a: True, maxsize=1)
+    assert d.submit("u", "t", "b")
+    assert not d.submit("u", "t", "b")
+    assert d.stats()["dropped"] == 1
+
+
+def test_invalid_tokens_removed_after_send(service, dispatchers, tmp_path):
+    for token in ("ok", "gone", "flaky"):
+        service.tokens.add("u", token)
+    service.messaging.token_errors = {"gone": "registration-token-not-registered", "flaky": "internal"}
+    d = _dispatcher(dispatchers, _fcm_sender(service))
+    d.start()
+    d.submit("u", "title", "body")
+    assert wait_until(lambda: d.sent == 1)
+    # Удаляется только токен с явным признаком "не зарегистрирован"
+    assert sorted(service.tokens.tokens_of("u")) == ["flaky", "ok"]
+
+    reopened = TokenStore(str(tmp_path / "tokens.db"))
+    assert reopened.start()
+    assert sorted(reopened.tokens_of("u")) == ["flaky", "ok"]
+    reopened.stop()
+
+
+def test_all_tokens_invalid_is_not_delivered(service, dispatchers):
+    service.tokens.add("u", "gone")
+    service.messaging.token_errors = {"gone": "registration-token-not-registered"}
+    d = _dispatcher(dispatchers, _fcm_sender(service))
+    d.start()
+    d.submit("u", "title", "body")
+    assert wait_until(lambda: d.not_delivered == 1)
+    assert service.tokens.tokens_of("u") == []
+    assert d.retries == 0
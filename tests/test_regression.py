@@ -0,0 +1,104 @@
+"""
+Тесты потоковой регрессии: суммы окна против numpy.polyfit, кэш прогнозов
+"""
+import random
+
+import numpy as np
+import pytest
+
+from app.core.regression import RegressionState, RegressionStore
+from app.services.ai_service import AIService
+
+
+def _fit(snapshot) -> tuple:
+    """slope, intercept по суммам среза (x = 0..n-1)."""
+    n = snapshot.n
+    sum_x = n * (n - 1) / 2
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6
+    slope = (n * snapshot.sum_xy - sum_x * snapshot.sum_y) / (n * sum_xx - sum_x * sum_x)
+    return slope, (snapshot.sum_y - slope * sum_x) / n
+
+
+@pytest.mark.parametrize("seed, window", [(1, 2), (2, 7), (3, 100), (4, 288)])
+def test_sliding_fit_matches_polyfit(seed, window):
+    rng = random.Random(seed)
+    state = RegressionState(window)
+    values = []
+    y = 400.0
+    for i in range(window * 5 + 3):
+        y += rng.gauss(0.5, 3.0)
+        state.add(y)
+        values.append(y)
+        tail = values[-window:]
+        if len(tail) >= 2 and (i % 11 == 0 or i > window * 5 - 2):
+            slope, intercept = _fit(state.snapshot())
+            expected_slope, expected_intercept = np.polyfit(np.arange(len(tail)), tail, 1)
+            assert slope == pytest.approx(expected_slope, rel=1e-6, abs=1e-6)
+            assert intercept == pytest.approx(expected_intercept, rel=1e-6, abs=1e-6)
+    snapshot = state.snapshot()
+    assert snapshot.n == window
+    assert snapshot.last == values[-1]
+    assert snapshot.sum_y == pytest.approx(sum(values[-window:]))
+
+
+def test_long_stream_does_not_drift():
+    rng = random.Random(9)
+    state = RegressionState(50)
+    values = [rng.uniform(1e4, 1e4 + 1) for _ in range(100_000)]
+    for v in values:
+        state.add(v)
+    snapshot = state.snapshot()
+    assert snapshot.sum_y == pytest.approx(sum(values[-50:]), rel=1e-12)
+    assert snapshot.sum_xy == pytest.approx(sum(i * v for i, v in enumerate(values[-50:])), rel=1e-12)
+
+
+def test_prediction_from_state_matches_full_recomputation():
+    rng = random.Random(3)
+    state = RegressionState(60)
+    values = []
+    for _ in range(200):
+        values.append(rng.uniform(20, 25))
+        state.add(values[-1])
+    for steps in (1, 6, 36):
+        expected = AIService.predict_linear(values[-60:], steps)
+        assert AIService.predict_from_state(state.snapshot(), steps) == expected
+        slope, intercept = np.polyfit(np.arange(60), values[-60:], 1)
+        assert expected == pytest.approx(slope * (60 + steps) + intercept, abs=0.051)
+
+
+def test_short_window_returns_last_value():
+    state = RegressionState(10)
+    assert AIService.predict_from_state(state.snapshot(), 3) == 0.0
+    for v in (1.0, 2.0, 3.0):
+        state.add(v)
+    assert AIService.predict_from_state(state.snapshot(), 3) == 3.0
+
+
+def test_forecast_cache_invalidated_by_version():
+    service = AIService()
+    store = RegressionStore(20)
+    for i in range(10):
+        store.add("d", (float(i),) * 5)
+    states = store.snapshot("d")
+    first = service.forecast("d", states, 2)
+    assert first["temp"] == AIService.predict_linear([float(i) for i in range(10)], 2)
+
+    # Та же версия - значение из кэша, даже если суммы другие
+    stale = {m: s._replace(sum_y=0.0, sum_xy=0.0) for m, s in states.items()}
+    assert service.forecast("d", stale, 2) == first
+
+    store.add("d", (100.0,) * 5)
+    fresh = service.forecast("d", store.snapshot("d"), 2)
+    assert fresh["temp"] != first["temp"]
+    assert fresh["temp"] == AIService.predict_from_state(store.snapshot("d")["temp"], 2)
+    # Другой горизонт - отдельный ключ кэша
+    assert service.forecast("d", store.snapshot("d"), 5)["temp"] != fresh["temp"]
+
+
+def test_store_keeps_devices_apart():
+    store = RegressionStore(5)
+    store.add("a", (1.0, 2.0, 3.0, 4.0, 5.0))
+    assert store.snapshot("b") is None
+    snapshot = store.snapshot("a")
+    assert [s.last for s in snapshot.values()] == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert all(s.version == 1 for s in snapshot.values())
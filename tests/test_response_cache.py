@@ -0,0 +1,123 @@
+"""
+Тесты кэша ответов: ETag/304 на маршруте, смена версии, single-flight
+"""
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.response_cache import ResponseCache, make_etag
+from app.api.routes import climate
+from app.core.storage import storage
+
+DEVICE = "etag_test"
+
+app = FastAPI()
+app.include_router(climate.router)
+client = TestClient(app)
+
+
+def _reading(temperature: float) -> dict:
+    return {"temperature": temperature, "humidity": 40, "co2_ppm": 600, "co_ppm": 2,
+            "lux": 300, "device_id": DEVICE}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def device():
+    storage.update_current_data(_reading(21))
+
+
+def _now(**headers):
+    return client.get("/api/now", params={"device_id": DEVICE}, headers=headers)
+
+
+def test_if_none_match_returns_304():
+    first = _now()
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+    assert first.json()["current"]["temp"] == 21.0
+
+    for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        cached = _now(**{"If-None-Match": header})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["etag"] == etag
+    assert _now(**{"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_etag_changes_after_new_reading():
+    etag = _now().headers["etag"]
+    storage.update_current_data(_reading(25))
+
+    fresh = _now(**{"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["etag"] != etag
+    assert fresh.json()["current"]["temp"] == 25.0
+    assert _now(**{"If-None-Match": fresh.headers["etag"]}).status_code == 304
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResponseCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {"value": len(calls)}
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get("k", ("d", 1), compute) for _ in range(5)))
+
+    entries = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(entry is entries[0] for entry in entries)
+    assert entries[0].body == b'{"value":1}'
+    assert entries[0].etag == make_etag("k", ("d", 1))
+    assert cache.stats() == {"entries": 1, "hits": 0, "misses": 1, "not_modified": 0, "shared": 4}
+
+
+def test_version_change_recomputes():
+    cache = ResponseCache()
+    calls = []
+
+    async def scenario():
+        for version in (1, 1, 2, 2):
+            await cache.get("k", (version,), lambda: calls.append(version) or {"v": version})
+
+    asyncio.run(scenario())
+    assert calls == [1, 2]
+    assert cache.hits == 2 and cache.misses == 2
+
+
+def test_compute_error_shared_and_not_cached():
+    cache = ResponseCache()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def scenario():
+        results = await asyncio.gather(*(cache.get("k", (1,), failing) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert len(calls) == 1
+        entry = await cache.get("k", (1,), lambda: {"ok": True})
+        assert entry.body == b'{"ok":true}'
+
+    asyncio.run(scenario())
+    assert cache.stats()["entries"] == 1
+
+
+def test_lru_eviction():
+    cache = ResponseCache(maxsize=2)
+
+    async def scenario():
+        for key in ("a", "b", "a", "c"):
+            await cache.get(key, (1,), lambda: {"key": key})
+
+    asyncio.run(scenario())
+    assert list(cache._entries) == ["a", "c"]
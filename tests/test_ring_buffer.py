@@ -0,0 +1,73 @@
+"""
+Тесты колоночного кольцевого буфера: рост, заворачивание кольца, срезы по времени
+"""
+from app.core.ring_buffer import INITIAL_SLOTS, DeviceRingBuffer
+
+
+def _fill(buf: DeviceRingBuffer, start: int, count: int) -> None:
+    for ts in range(start, start + count):
+        buf.append(float(ts), 20.0, 40.0, 600.0, 1.0, 300.0, 0, 0)
+
+
+def _ts(view) -> list:
+    return list(view.iter_column("ts"))
+
+
+def test_grows_lazily_up_to_capacity():
+    buf = DeviceRingBuffer(1000)
+    assert buf.slots == INITIAL_SLOTS
+    _fill(buf, 0, INITIAL_SLOTS + 1)
+    assert buf.slots == INITIAL_SLOTS * 2
+    _fill(buf, INITIAL_SLOTS + 1, 2000)
+    assert buf.slots == 1000
+    assert len(buf) == 1000
+
+
+def test_wraparound_keeps_last_records_in_order():
+    buf = DeviceRingBuffer(100)
+    _fill(buf, 0, 250)
+    assert len(buf) == 100
+    assert _ts(buf.tail()) == [float(t) for t in range(150, 250)]
+    assert _ts(buf.tail(5)) == [245.0, 246.0, 247.0, 248.0, 249.0]
+    assert buf.last_row()["time"] is not None
+    assert buf.columns["ts"][buf.last_index()] == 249.0
+
+
+def test_view_segments_cross_ring_boundary():
+    buf = DeviceRingBuffer(100)
+    _fill(buf, 0, 130)
+    segments = buf.tail().column("ts")
+    assert len(segments) == 2
+    assert sum(len(s) for s in segments) == 100
+
+
+def test_between_is_inclusive_and_handles_wrap():
+    buf = DeviceRingBuffer(100)
+    _fill(buf, 0, 130)
+    view = buf.tail()
+    assert _ts(view.between(95, 105)) == [float(t) for t in range(95, 106)]
+    assert _ts(view.between(None, 31)) == [30.0, 31.0]
+    assert _ts(view.between(128)) == [128.0, 129.0]
+    assert len(view.between(200, 300)) == 0
+    assert len(view.between(10, 20)) == 0
+
+
+def test_last_of_between():
+    buf = DeviceRingBuffer(100)
+    _fill(buf, 0, 130)
+    assert _ts(buf.tail().between(40, 60).last(3)) == [58.0, 59.0, 60.0]
+
+
+def test_resize_keeps_newest_records():
+    buf = DeviceRingBuffer(100)
+    _fill(buf, 0, 130)
+    buf.resize(10)
+    assert _ts(buf.tail()) == [float(t) for t in range(120, 130)]
+    _fill(buf, 130, 3)
+    assert _ts(buf.tail()) == [float(t) for t in range(123, 133)]
+
+    buf.resize(500)
+    assert len(buf) == 10
+    _fill(buf, 133, 100)
+    assert _ts(buf.tail())[0] == 123.0
+    assert _ts(buf.tail())[-1] == 232.0
@@ -0,0 +1,105 @@
+"""
+Тесты агрегатов: выбор уровня, границы бакетов, хранение и усечение диапазона
+"""
+import pytest
+
+from app.core.rollups import ROLLUP_PAGE, DeviceRollups, RollupStore, RollupTier, parse_duration
+
+# Начало суток UTC: границы всех уровней совпадают
+T0 = 1_700_006_400.0
+
+
+def _values(v: float) -> tuple:
+    return (v, v, v, v, v)
+
+
+@pytest.mark.parametrize("bucket_sec, tier", [
+    (60, "1m"),
+    (120, "1m"),
+    (300, "5m"),
+    (900, "5m"),
+    (3600, "1h"),
+    (7200, "1h"),
+    (86400, "1d"),
+    (604800, "1d"),
+    (30, None),
+    (90, None),
+])
+def test_choose_tier(bucket_sec, tier):
+    chosen = DeviceRollups().choose_tier(bucket_sec)
+    assert (chosen.name if chosen else None) == tier
+
+
+def test_parse_duration():
+    assert parse_duration("15m") == 900
+    assert parse_duration("1d") == 86400
+    assert parse_duration("45") == 45
+    for bad in ("0m", "", "abc", "inf", "infm", "-inf", "nan", "1e400s"):
+        with pytest.raises(ValueError):
+            parse_duration(bad)
+
+
+def test_bucket_boundaries_are_half_open():
+    store = RollupStore()
+    store.add("d", T0 + 59.9, _values(1.0))
+    store.add("d", T0 + 60.0, _values(3.0))
+    store.add("d", T0 + 61.0, _values(5.0))
+    tier, rows, _ = store.query("d", 60, T0, T0 + 120, ["min", "max", "avg", "count"], now_ts=T0 + 120)
+    assert tier == "1m"
+    assert [r["ts"] for r in rows] == [T0, T0 + 60]
+    assert rows[0]["count"] == 1
+    assert rows[1]["count"] == 2
+    assert rows[1]["temp"] == {"min": 3.0, "max": 5.0, "avg": 4.0}
+
+
+def test_reaggregates_finer_tier_into_requested_bucket():
+    store = RollupStore()
+    for minute in range(10):
+        store.add("d", T0 + minute * 60, _values(float(minute)))
+    tier, rows, _ = store.query("d", 120, T0, T0 + 599, ["avg", "count"], now_ts=T0 + 600)
+    assert tier == "1m"
+    assert [r["count"] for r in rows] == [2] * 5
+    assert [r["co2"]["avg"] for r in rows] == [0.5, 2.5, 4.5, 6.5, 8.5]
+
+
+def test_late_reading_updates_its_bucket():
+    store = RollupStore()
+    store.add("d", T0 + 600, _values(10.0))
+    store.add("d", T0 + 30, _values(2.0))
+    _, rows, _ = store.query("d", 60, T0, T0 + 600, ["count"], now_ts=T0 + 600)
+    assert [(r["ts"], r["count"]) for r in rows] == [(T0, 1), (T0 + 600, 1)]
+
+
+def test_available_from_reports_tier_retention():
+    store = RollupStore()
+    now = T0 + 10 * 86400
+    store.add("d", now, _values(1.0))
+    # 5m хранит 48 часов: запрос за 5 суток усечен
+    tier, _, available_from = store.query("d", 900, now - 5 * 86400, now, ["avg"], now_ts=now)
+    assert tier == "5m"
+    assert available_from == now - 48 * 3600 + 300
+    tier, _, available_from = store.query("d", 3600, now - 5 * 86400, now, ["avg"], now_ts=now)
+    assert tier == "1h"
+    assert available_from < now - 5 * 86400
+
+
+def test_overwritten_bucket_is_not_returned():
+    tier = RollupTier("1m", 60, 360)
+    tier.add(T0, _values(1.0))
+    tier.add(T0 + 360 * 60, _values(2.0))
+    # Слот старого бакета занят новым: более старые данные отбрасываются
+    tier.add(T0 + 1, _values(3.0))
+    assert [b for b, _, _ in tier.iter_buckets(T0, T0 + 360 * 60)] == [int(T0 // 60) + 360]
+
+
+def test_pages_allocated_on_first_write():
+    tier = RollupTier("1m", 60, 360)
+    assert tier.memory_bytes() == 0
+    tier.add(T0, _values(1.0))
+    assert sum(page is not None for page in tier.pages) == 1
+    tier.add(T0 + ROLLUP_PAGE * 60, _values(1.0))
+    assert sum(page is not None for page in tier.pages) == 2
+
+
+def test_unknown_device():
+    assert RollupStore().query("nope", 60, T0, T0 + 60, ["avg"]) == (None, [], None)
@@ -0,0 +1,99 @@
+"""
+Тесты SharedBackend: выборы лидера по flock, рассылка через Unix-сокет, смена лидера
+"""
+import threading
+
+import pytest
+
+from app.core.state_backend import MemoryBackend, SharedBackend
+from tests.fakes import wait_until
+
+
+class Worker:
+    """Воркер с собственным backend на общих путях блокировки и сокета"""
+
+    def __init__(self, tmp_path):
+        self.backend = SharedBackend(str(tmp_path / "state.lock"), str(tmp_path / "state.sock"))
+        self.events: list = []
+        self.promoted = 0
+        self._lock = threading.Lock()
+
+    def _on_event(self, event: dict) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def _on_leader(self) -> None:
+        self.promoted += 1
+
+    def start(self) -> "Worker":
+        self.backend.start(self._on_event, self._on_leader)
+        return self
+
+
+@pytest.fixture
+def workers(tmp_path):
+    created = []
+
+    def spawn() -> Worker:
+        worker = Worker(tmp_path).start()
+        created.append(worker)
+        return worker
+
+    yield spawn
+    for worker in created:
+        worker.backend.stop()
+
+
+def _connected(leader: Worker, peers: int) -> bool:
+    return leader.backend.stats()["peers"] == peers
+
+
+def test_exactly_one_leader(workers):
+    group = [workers() for _ in range(3)]
+    leaders = [w for w in group if w.backend.is_leader]
+    assert len(leaders) == 1
+    assert leaders[0].promoted == 1
+    assert wait_until(lambda: _connected(leaders[0], 2))
+    followers = [w for w in group if not w.backend.is_leader]
+    assert all(w.promoted == 0 for w in followers)
+    assert all(w.backend.stats()["connected"] for w in followers)
+
+
+def test_events_relayed_between_workers(workers):
+    leader, a, b = workers(), workers(), workers()
+    assert wait_until(lambda: _connected(leader, 2))
+
+    leader.backend.publish({"type": "reading", "n": 1})
+    assert wait_until(lambda: len(a.events) == 1 and len(b.events) == 1)
+    assert a.events == b.events == [{"type": "reading", "n": 1}]
+
+    # Событие воркера получает лидер и пересылает остальным, но не отправителю
+    a.backend.publish({"type": "reading", "n": 2, "text": "привет"})
+    assert wait_until(lambda: len(leader.events) == 1 and len(b.events) == 2)
+    assert leader.events == [{"type": "reading", "n": 2, "text": "привет"}]
+    assert b.events[-1] == leader.events[0]
+    assert a.events == [{"type": "reading", "n": 1}]
+
+
+def test_failover_when_leader_stops(workers):
+    leader, a, b = workers(), workers(), workers()
+    assert wait_until(lambda: _connected(leader, 2))
+
+    leader.backend.stop()
+    assert wait_until(lambda: a.backend.is_leader or b.backend.is_leader)
+    new_leader, follower = (a, b) if a.backend.is_leader else (b, a)
+    assert not follower.backend.is_leader
+    assert new_leader.promoted == 1
+
+    # Оставшийся воркер переподключается к новому лидеру
+    assert wait_until(lambda: _connected(new_leader, 1))
+    new_leader.backend.publish({"type": "reading", "n": 3})
+    assert wait_until(lambda: follower.events == [{"type": "reading", "n": 3}])
+
+
+def test_memory_backend_is_always_leader():
+    backend = MemoryBackend()
+    promoted = []
+    backend.start(lambda event: None, lambda: promoted.append(True))
+    assert backend.is_leader and promoted == [True]
+    backend.publish({"type": "reading"})
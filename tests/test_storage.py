@@ -0,0 +1,68 @@
+"""
+Тесты хранилища в памяти: оценка истории и выгрузка при параллельном приеме
+"""
+import threading
+
+from app.core.constants import PROFILES
+from app.core.storage import DataStorage
+
+T0 = 1_700_000_000.0
+
+
+def _storage() -> DataStorage:
+    storage = DataStorage()
+    storage.update_profile(PROFILES[0], persist=False)
+    return storage
+
+
+def _reading(storage: DataStorage, i: int) -> dict:
+    # Чередование нормы и выхода за temp_max
+    data = {"temperature": 22.0 if i % 2 else 30.0, "humidity": 40, "co2_ppm": 600,
+            "co_ppm": 2, "lux": 400, "device_id": "d"}
+    return storage.build_reading(data, ts=T0 + i)
+
+
+def _writer(storage: DataStorage, count: int, errors: list) -> threading.Thread:
+    def run():
+        try:
+            for i in range(count):
+                storage.apply_reading(_reading(storage, i))
+        except Exception as e:  # IndexError из _evaluate_last при гонке с кэшем
+            errors.append(e)
+
+    return threading.Thread(target=run)
+
+
+def test_evaluated_history_while_buffer_grows():
+    storage = _storage()
+    errors: list = []
+    writer = _writer(storage, 5000, errors)
+    writer.start()
+    checked = 0
+    while writer.is_alive() or not checked:
+        rows = storage.query_history(100_000, "d", evaluate=True)
+        expected = storage.evaluate_rows([dict(row) for row in rows])
+        assert [r["mc_score"] for r in rows] == [r["mc_score"] for r in expected]
+        assert [r["is_danger"] for r in rows] == [r["is_danger"] for r in expected]
+        checked += 1
+    writer.join()
+    assert not errors
+    # После приема кэш оценки покрывает все строки, включая добавленные
+    rows = storage.query_history(100_000, "d", evaluate=True)
+    assert len(rows) == 5000
+    assert [r["is_danger"] for r in rows[-4:]] == [True, False, True, False]
+
+
+
+def test_iter_history_is_a_snapshot():
+    storage = _storage()
+    storage.set_device_capacity("d", 100)
+    for i in range(100):
+        storage.apply_reading(_reading(storage, i))
+    rows = storage.iter_history("d")
+    first = next(rows)
+    # Кольцо заворачивается во время выгрузки - выгрузка его не видит
+    for i in range(100, 250):
+        storage.apply_reading(_reading(storage, i))
+    ts = [first[0]] + [row[0] for row in rows]
+    assert ts == [T0 + i for i in range(100)]
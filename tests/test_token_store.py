@@ -0,0 +1,147 @@
+"""
+Тесты реестра FCM токенов и multicast-рассылки: пакеты по 500 токенов,
+частичные ошибки, пакетное удаление недействительных токенов, SQLite
+"""
+import pytest
+
+from app.core.token_store import TokenStore
+from app.services.firebase_service import FCM_MULTICAST_LIMIT, FirebaseService, _chunks
+from tests.fakes import FakeMessaging
+
+NOT_REGISTERED = "registration-token-not-registered"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "tokens.db")
+
+
+@pytest.fixture
+def store(db_path):
+    s = TokenStore(db_path)
+    assert s.start()
+    yield s
+    s.stop()
+
+
+@pytest.fixture
+def service(store):
+    svc = FirebaseService()
+    svc.tokens = store
+    svc.messaging = FakeMessaging()
+    svc._initialized = True
+    yield svc
+    svc.stop()
+
+
+def _reopen(db_path) -> TokenStore:
+    reopened = TokenStore(db_path)
+    assert reopened.start()
+    return reopened
+
+
+@pytest.mark.parametrize("count, sizes", [
+    (0, []),
+    (1, [1]),
+    (FCM_MULTICAST_LIMIT, [FCM_MULTICAST_LIMIT]),
+    (1201, [500, 500, 201]),
+])
+def test_chunks(count, sizes):
+    tokens = [f"t{i}" for i in range(count)]
+    chunks = _chunks(tokens)
+    assert [len(c) for c in chunks] == sizes
+    assert [t for c in chunks for t in c] == tokens
+
+
+def test_store_persists_across_reopen(store, db_path):
+    assert store.add("alice", "a1") == 1
+    assert store.add("alice", "a2", platform="ios") == 2
+    assert store.add("bob", "b1") == 1
+    # Токен переходит к другому пользователю
+    assert store.add("bob", "a2") == 2
+    assert store.remove("bob", "b1") == 1
+    assert store.remove("alice", "a2") == 1    # чужой токен не удаляется
+    store.add("carol", "c1", persist=False)
+
+    reopened = _reopen(db_path)
+    try:
+        assert reopened.tokens_of("alice") == ["a1"]
+        assert reopened.tokens_of("bob") == ["a2"]
+        assert reopened.user_of("a2") == "bob"
+        assert reopened.tokens_of("carol") == []
+        assert (reopened.users_count(), reopened.tokens_count()) == (2, 2)
+    finally:
+        reopened.stop()
+
+
+def test_remove_many_counts_known_tokens(store, db_path):
+    for i in range(5):
+        store.add(f"u{i % 2}", f"t{i}")
+    assert store.remove_many(["t0", "t3", "unknown", "t3"]) == 2
+    assert sorted(store.all_tokens()) == ["t1", "t2", "t4"]
+    assert store.tokens_of("u1") == ["t1"]
+    reopened = _reopen(db_path)
+    try:
+        assert sorted(reopened.all_tokens()) == ["t1", "t2", "t4"]
+    finally:
+        reopened.stop()
+
+
+def test_broadcast_chunks_and_mixed_failures(service, store, db_path, monkeypatch):
+    # 1201 токен у 401 пользователя (по 3 у каждого, у последнего - 1)
+    tokens = [f"t{i:04d}" for i in range(1201)]
+    for i, token in enumerate(tokens):
+        store.add(f"u{i // 3}", token)
+    invalid = {t for t in tokens[::7]}
+    failed = {t for t in tokens[3::7]}
+    messaging = service.messaging
+    messaging.token_errors = {**{t: NOT_REGISTERED for t in invalid}, **{t: "internal" for t in failed}}
+
+    removals = []
+    remove_many = store.remove_many
+    monkeypatch.setattr(store, "remove_many", lambda ts: removals.append(list(ts)) or remove_many(ts))
+
+    users = service.send_push_to_all_users("title", "body", {"k": "v"})
+
+    assert sorted(len(c) for c in messaging.calls) == [201, 500, 500]
+    assert sorted(t for c in messaging.calls for t in c) == tokens
+    assert messaging.delivered == set(tokens) - invalid - failed
+    # Все недействительные токены удаляются одним пакетом после рассылки
+    assert len(removals) == 1 and set(removals[0]) == invalid
+    assert store.tokens_count() == 1201 - len(invalid)
+    assert failed <= set(store.all_tokens())
+    assert users == len({f"u{tokens.index(t) // 3}" for t in messaging.delivered})
+
+    reopened = _reopen(db_path)
+    try:
+        assert set(reopened.all_tokens()) == set(tokens) - invalid
+    finally:
+        reopened.stop()
+
+
+def test_send_to_user_partial_delivery(service, store):
+    for token in ("a", "b", "c"):
+        store.add("u", token)
+    service.messaging.token_errors = {"a": NOT_REGISTERED, "b": "internal"}
+    assert service.send_push_to_user("u", "title", "body") is True
+    assert sorted(store.tokens_of("u")) == ["b", "c"]
+    assert service.messaging.delivered == {"c"}
+
+
+def test_send_to_user_all_invalid(service, store):
+    store.add("u", "a")
+    store.add("u", "b")
+    service.messaging.token_errors = {"a": NOT_REGISTERED, "b": NOT_REGISTERED}
+    assert service.send_push_to_user("u", "title", "body") is False
+    assert store.count("u") == 0
+    assert service.send_push_to_user("u", "title", "body") is False
+    assert len(service.messaging.calls) == 1
+
+
+def test_transport_error_raised_only_when_requested(service, store):
+    store.add("u", "a")
+    service.messaging.transient = 2
+    assert service.send_push_to_user("u", "title", "body") is False
+    with pytest.raises(Exception, match="unavailable"):
+        service.send_push_to_user("u", "title", "body", raise_errors=True)
+    assert store.tokens_of("u") == ["a"]
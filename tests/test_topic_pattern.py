@@ -0,0 +1,100 @@
+"""
+Тесты шаблонов MQTT топиков: wildcard-уровни, device_id из '+',
+общие подписки $share/<group>/, topic_for
+"""
+import pytest
+
+from app.services.mqtt_service import MQTTService, TopicPattern
+
+
+@pytest.mark.parametrize("pattern", [
+    "iot/+/data",
+    "iot/microclimate/+/data",
+    "site/+/+/telemetry",
+    "iot/+/#",
+    "iot/#",
+    "iot/fixed/data",
+])
+def test_valid_patterns(pattern):
+    assert TopicPattern(pattern).pattern == pattern
+
+
+@pytest.mark.parametrize("pattern", [
+    "iot/dev+/data",
+    "iot/#/data",
+    "iot/a#",
+    "$share/group/iot/+/data",
+])
+def test_invalid_patterns(pattern):
+    with pytest.raises(ValueError):
+        TopicPattern(pattern)
+
+
+@pytest.mark.parametrize("pattern, topic, device_id", [
+    ("iot/microclimate/+/data", "iot/microclimate/esp32_lab/data", "esp32_lab"),
+    ("iot/+/data", "iot/esp32_a/data", "esp32_a"),
+    ("site/+/+/telemetry", "site/kitchen/dev7/telemetry", "kitchen"),     # первый '+'
+    ("iot/+/#", "iot/dev1/sensors/air", "dev1"),
+    ("iot/#", "iot/dev1/data", None),
+    ("iot/fixed/data", "iot/fixed/data", None),
+])
+def test_device_id_from_plus_level(pattern, topic, device_id):
+    p = TopicPattern(pattern)
+    assert p.matches(topic)
+    assert p.device_id(topic) == device_id
+
+
+@pytest.mark.parametrize("pattern, topic", [
+    ("iot/microclimate/+/data", "iot/microclimate/esp32_lab/status"),
+    ("iot/microclimate/+/data", "iot/microclimate/data"),
+    ("iot/+/data", "iot/a/b/data"),
+    ("iot/fixed/data", "iot/other/data"),
+])
+def test_non_matching_topics(pattern, topic):
+    assert not TopicPattern(pattern).matches(topic)
+
+
+@pytest.mark.parametrize("pattern, expected", [
+    ("iot/microclimate/+/data", "iot/microclimate/dev9/data"),
+    ("site/+/+/telemetry", "site/dev9/data/telemetry"),
+    ("iot/+/#", "iot/dev9/data"),
+    ("iot/fixed/data", "iot/fixed/data"),
+])
+def test_topic_for(pattern, expected):
+    p = TopicPattern(pattern)
+    topic = p.topic_for("dev9")
+    assert topic == expected
+    assert p.matches(topic)
+    if p.device_level is not None:
+        assert p.device_id(topic) == "dev9"
+
+
+@pytest.mark.parametrize("group, expected", [
+    (None, "iot/microclimate/+/data"),
+    ("", "iot/microclimate/+/data"),
+    ("workers", "$share/workers/iot/microclimate/+/data"),
+])
+def test_shared_subscription(group, expected):
+    assert TopicPattern("iot/microclimate/+/data").subscription(group) == expected
+
+
+def _service(patterns, group=None) -> MQTTService:
+    service = MQTTService()
+    service.patterns = [TopicPattern(p) for p in patterns]
+    service.shared_group = group
+    return service
+
+
+def test_service_subscriptions_and_device_lookup():
+    service = _service(["iot/microclimate/+/data", "legacy/#", "site/+/telemetry"], group="g1")
+    assert service.subscriptions() == [
+        "$share/g1/iot/microclimate/+/data", "$share/g1/legacy/#", "$share/g1/site/+/telemetry",
+    ]
+    # Брокер доставляет сообщения общей подписки с исходным топиком
+    assert service.device_from_topic("iot/microclimate/dev1/data") == "dev1"
+    assert service.device_from_topic("site/dev2/telemetry") == "dev2"
+    assert service.device_from_topic("legacy/dev3/data") is None
+    assert service.device_from_topic("other/topic") is None
+    # Повторный топик берется из кэша
+    assert service._topic_devices["iot/microclimate/dev1/data"] == "dev1"
+    assert service.device_from_topic("iot/microclimate/dev1/data") == "dev1"
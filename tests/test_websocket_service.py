@@ -0,0 +1,298 @@
+"""
+Тесты WebSocket рассылки на фейковых сокетах: очереди клиентов, вытеснение, лимиты
+"""
+import asyncio
+import json
+import time
+
+import msgpack
+
+from app.services import websocket_service as ws_module
+from app.services.websocket_service import (
+    WS_CLOSE_POLICY_VIOLATION,
+    WS_CLOSE_TRY_AGAIN_LATER,
+    WebSocketService,
+)
+from tests.fakes import FakeWebSocket
+
+
+def _reading(i: int, device_id: str = "d1", **fields) -> dict:
+    data = {
+        "device_id": device_id, "timestamp": f"t{i}", "temperature": 20.0 + i,
+        "humidity": 40.0, "co2_ppm": 600.0, "co_ppm": 1.0, "lux": 300.0,
+        "anomaly": False, "anomalies": [], "anomaly_score": 0.0,
+    }
+    data.update(fields)
+    return data
+
+
+async def _settle(seconds: float = 0.02) -> None:
+    await asyncio.sleep(seconds)
+
+
+def test_slow_client_does_not_delay_others():
+    async def scenario():
+        service = WebSocketService()
+        fast, slow = FakeWebSocket(), FakeWebSocket()
+        slow.gate.clear()
+        await service.connect(fast)
+        slow_client = await service.connect(slow)
+
+        for i in range(40):
+            service.publish(_reading(i))
+            await _settle(0)
+        await _settle()
+        assert [json.loads(f)["timestamp"] for f in fast.frames] == [f"t{i}" for i in range(40)]
+        assert slow.frames == []
+        # Очередь зависшего клиента ограничена: старые кадры вытеснены
+        assert len(slow_client) == ws_module.WS_CLIENT_QUEUE_SIZE
+        assert slow_client.dropped == 40 - ws_module.WS_CLIENT_QUEUE_SIZE
+
+        slow.gate.set()
+        await _settle()
+        received = [json.loads(f)["timestamp"] for f in slow.frames]
+        # Первый кадр уже отправлялся, дальше - самые свежие
+        assert received == ["t0"] + [f"t{i}" for i in range(40 - ws_module.WS_CLIENT_QUEUE_SIZE, 40)]
+        for client in list(service.clients.values()):
+            await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_frame_encoded_once_for_all_clients():
+    async def scenario():
+        service = WebSocketService()
+        sockets = [FakeWebSocket() for _ in range(3)]
+        for ws in sockets:
+            await service.connect(ws)
+        service.publish(_reading(1))
+        await _settle()
+        frames = [ws.frames[0] for ws in sockets]
+        assert frames[0] is frames[1] is frames[2]
+        for client in list(service.clients.values()):
+            await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_lagging_client_evicted(monkeypatch):
+    monkeypatch.setattr(ws_module, "WS_SLOW_CLIENT_LAG_SEC", 0.05)
+
+    async def scenario():
+        service = WebSocketService()
+        fast, slow = FakeWebSocket(), FakeWebSocket()
+        slow.gate.clear()
+        await service.connect(fast)
+        await service.connect(slow)
+
+        service.publish(_reading(0))
+        await _settle(0.1)
+        service.publish(_reading(1))
+        await _settle()
+
+        assert service.evicted == 1
+        assert slow.closed_code == WS_CLOSE_POLICY_VIOLATION
+        assert service.client_count() == 1
+        assert len(fast.frames) == 2
+        for client in list(service.clients.values()):
+            await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_connection_cap_rejects_extra_clients():
+    async def scenario():
+        service = WebSocketService(max_clients=2)
+        accepted = [await service.connect(FakeWebSocket()) for _ in range(2)]
+        extra = FakeWebSocket()
+        assert await service.connect(extra) is None
+        assert extra.closed_code == WS_CLOSE_TRY_AGAIN_LATER
+        assert service.rejected == 1
+        assert service.client_count() == 2
+
+        # После отключения место освобождается
+        await service.disconnect(accepted[0])
+        assert await service.connect(FakeWebSocket()) is not None
+        for client in list(service.clients.values()):
+            await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_failed_sender_removes_client():
+    async def scenario():
+        service = WebSocketService()
+        broken, healthy = FakeWebSocket(fail=True), FakeWebSocket()
+        broken_client = await service.connect(broken)
+        await service.connect(healthy)
+
+        service.publish(_reading(0))
+        await _settle()
+        assert broken_client.closed
+        assert broken_client.id not in service.clients
+        assert service.stats()["clients"] == 1
+        assert service.stats()["queued_frames"] == 0
+
+        service.publish(_reading(1))
+        await _settle()
+        assert len(healthy.frames) == 2
+        for client in list(service.clients.values()):
+            await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def _subscribe(service: WebSocketService, client, **message) -> dict:
+    return service.handle_message(client, json.dumps({"type": "subscribe", **message}))
+
+
+def test_subscription_sends_delta_frames():
+    async def scenario():
+        service = WebSocketService()
+        ws = FakeWebSocket()
+        client = await service.connect(ws)
+        reply = _subscribe(service, client, devices=["d1"], metrics=["temperature", "co2_ppm"])
+        assert reply["type"] == "subscribed" and reply["delta"] is True
+
+        service.publish(_reading(0))
+        await _settle()
+        service.publish(_reading(0, humidity=55.0))          # неподписанная метрика
+        await _settle()
+        service.publish(_reading(1, device_id="d2"))         # чужое устройство
+        await _settle()
+        service.publish(_reading(0, co2_ppm=900.0))
+        await _settle()
+        service.publish(_reading(0, co2_ppm=900.0, anomaly=True, anomaly_score=4.2))
+        await _settle()
+
+        frames = [json.loads(f) for f in ws.frames]
+        assert frames[0] == {
+            "device_id": "d1", "timestamp": "t0", "temperature": 20.0, "co2_ppm": 600.0,
+            "anomaly": False, "anomalies": [], "anomaly_score": 0.0,
+        }
+        assert frames[1:] == [
+            {"device_id": "d1", "timestamp": "t0", "co2_ppm": 900.0},
+            {"device_id": "d1", "timestamp": "t0", "anomaly": True, "anomaly_score": 4.2},
+        ]
+        await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_subscription_full_frames_in_msgpack():
+    async def scenario():
+        service = WebSocketService()
+        ws = FakeWebSocket()
+        client = await service.connect(ws)
+        _subscribe(service, client, metrics=["lux"], format="msgpack", delta=False)
+
+        service.publish(_reading(0))
+        await _settle()
+        service.publish(_reading(1))
+        await _settle()
+
+        assert all(isinstance(f, bytes) for f in ws.frames)
+        frames = [msgpack.unpackb(f, raw=False) for f in ws.frames]
+        assert [f["lux"] for f in frames] == [300.0, 300.0]
+        assert all("temperature" not in f for f in frames)
+        await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_unsubscribe_restores_full_json():
+    async def scenario():
+        service = WebSocketService()
+        ws = FakeWebSocket()
+        client = await service.connect(ws)
+        _subscribe(service, client, metrics=["lux"])
+        reply = service.handle_message(client, json.dumps({"type": "unsubscribe"}))
+        assert reply == {"type": "unsubscribed", "max_rate": None}
+
+        service.publish(_reading(0))
+        await _settle()
+        assert json.loads(ws.frames[0]) == _reading(0)
+        await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_invalid_subscription_rejected():
+    async def scenario():
+        service = WebSocketService()
+        client = await service.connect(FakeWebSocket())
+        for message in (
+            {"metrics": ["pressure"]},
+            {"metrics": "temperature"},
+            {"devices": "d1"},
+            {"format": "xml"},
+            {"max_rate": "fast"},
+            {"max_rate": -1},
+        ):
+            assert _subscribe(service, client, **message)["type"] == "error"
+        assert client.subscription is None
+        assert service.handle_message(client, "not json") is None
+        assert service.handle_message(client, json.dumps({"type": "nope"}))["type"] == "error"
+        await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_max_rate_coalesces_to_latest_value():
+    async def scenario():
+        service = WebSocketService()
+        ws = FakeWebSocket()
+        client = await service.connect(ws)
+        reply = service.handle_message(client, json.dumps({"type": "rate", "max_rate": 10}))
+        assert reply == {"type": "rate", "max_rate": 10.0}
+
+        service.publish(_reading(0))
+        await _settle(0.01)
+        for i in range(1, 10):
+            service.publish(_reading(i))
+            service.publish(_reading(i, device_id="d2"))
+            await _settle(0)
+        # До тика отправлен только первый кадр; ожидание тика - не отставание
+        assert [json.loads(f)["timestamp"] for f in ws.frames] == ["t0"]
+        assert client.lag(time.monotonic()) == 0.0
+        assert client.coalesced == 16
+
+        await _settle(0.15)
+        latest = {(f["device_id"], f["timestamp"]) for f in map(json.loads, ws.frames[1:])}
+        assert latest == {("d1", "t9"), ("d2", "t9")}
+        await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_subscription_rate_limit_applies_to_delta_frames():
+    async def scenario():
+        service = WebSocketService()
+        ws = FakeWebSocket()
+        client = await service.connect(ws)
+        reply = _subscribe(service, client, metrics=["temperature"], max_rate=10)
+        assert reply["max_rate"] == 10.0
+
+        for i in range(5):
+            service.publish(_reading(i))
+            await _settle(0)
+        await _settle(0.15)
+        frames = [json.loads(f) for f in ws.frames]
+        assert [f["temperature"] for f in frames] == [20.0, 24.0]
+        await service.disconnect(client)
+
+    asyncio.run(scenario())
+
+
+def test_max_rate_is_clamped():
+    async def scenario():
+        service = WebSocketService()
+        client = await service.connect(FakeWebSocket())
+        assert client.set_rate(1000) == ws_module.WS_MAX_RATE_HZ
+        assert client.set_rate(0.001) == ws_module.WS_MIN_RATE_HZ
+        assert client.set_rate(0) is None
+        assert client.set_rate(None) is None
+        assert not client.coalescing
+        await service.disconnect(client)
+
+    asyncio.run(scenario())
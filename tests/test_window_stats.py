@@ -0,0 +1,124 @@
+"""
+Тесты скользящей статистики: Уэлфорд и монотонные очереди против пересчета
+"""
+import random
+import statistics
+
+import pytest
+
+from app.core.ring_buffer import METRIC_COLUMNS
+from app.core.window_stats import SlidingWindow, WindowStatsStore, parse_window
+
+
+def _brute(items: list) -> dict:
+    result = {}
+    for k, name in enumerate(METRIC_COLUMNS):
+        column = [values[k] for _, values in items]
+        result[name] = {
+            "min": min(column),
+            "max": max(column),
+            "avg": statistics.fmean(column),
+            "std": statistics.pstdev(column),
+        }
+    return result
+
+
+def _assert_matches(window: SlidingWindow, items: list) -> None:
+    assert len(window) == len(items)
+    got = window.summary()
+    expected = _brute(items)
+    for name in METRIC_COLUMNS:
+        assert got[name]["min"] == expected[name]["min"]
+        assert got[name]["max"] == expected[name]["max"]
+        # summary() округляет avg до 0.1 и std до 0.01
+        assert got[name]["avg"] == pytest.approx(expected[name]["avg"], abs=0.05 + 1e-9)
+        assert got[name]["std"] == pytest.approx(expected[name]["std"], abs=0.005 + 1e-9)
+
+
+def _values(rng: random.Random) -> tuple:
+    return (
+        round(rng.uniform(15, 30), 2),
+        round(rng.uniform(20, 80), 2),
+        float(rng.randint(400, 2000)),
+        round(rng.expovariate(1.0), 2),
+        float(rng.choice([0, 0, 150, 300, 300, 450])),
+    )
+
+
+def test_parse_window():
+    assert parse_window("100") == (100, None)
+    assert parse_window(" 1h ") == (None, 3600.0)
+    assert parse_window("0") == (1, None)
+
+
+@pytest.mark.parametrize("seed, max_count", [(1, 1), (2, 5), (3, 100), (4, 257)])
+def test_count_window_matches_brute_force(seed, max_count):
+    rng = random.Random(seed)
+    window = SlidingWindow(max_count=max_count)
+    items = []
+    for i in range(2000):
+        values = _values(rng)
+        window.add(float(i), values)
+        items = (items + [(float(i), values)])[-max_count:]
+        if i % 37 == 0 or i < max_count + 2:
+            _assert_matches(window, items)
+    _assert_matches(window, items)
+
+
+@pytest.mark.parametrize("seed", [5, 6, 7])
+def test_age_window_matches_brute_force(seed):
+    rng = random.Random(seed)
+    max_age = 600.0
+    window = SlidingWindow(max_age=max_age)
+    items = []
+    ts = 0.0
+    for i in range(3000):
+        # Неравномерный шаг, иногда длинные паузы (окно пустеет почти целиком)
+        ts += rng.choice([1, 5, 10, 30]) if rng.random() > 0.01 else 900
+        values = _values(rng)
+        window.add(ts, values)
+        items = [(t, v) for t, v in items + [(ts, values)] if t >= ts - max_age]
+        if i % 29 == 0:
+            _assert_matches(window, items)
+    _assert_matches(window, items)
+
+
+def test_eviction_at_boundary_is_inclusive():
+    window = SlidingWindow(max_age=60.0)
+    window.add(0.0, (1.0,) * 5)
+    window.add(30.0, (2.0,) * 5)
+    window.evict(60.0)
+    # Точка ровно на границе окна (ts == now - max_age) остается
+    assert len(window) == 2
+    window.evict(60.001)
+    assert len(window) == 1
+    assert window.summary()["temp"]["min"] == 2.0
+    window.evict(1000.0)
+    assert len(window) == 0
+    window.add(1000.0, (5.0,) * 5)
+    assert window.summary()["temp"] == {"min": 5.0, "max": 5.0, "avg": 5.0, "std": 0.0}
+
+
+def test_duplicate_extremes_survive_eviction():
+    window = SlidingWindow(max_count=3)
+    for v in (5.0, 5.0, 1.0, 5.0):
+        window.add(0.0, (v,) * 5)
+    # Окно [5, 1, 5]: вытеснение первой пятерки не теряет максимум
+    assert window.summary()["temp"]["max"] == 5.0
+    assert window.summary()["temp"]["min"] == 1.0
+
+
+def test_store_windows_per_device():
+    store = WindowStatsStore(["3", "1m"])
+    assert store.default_window == "3"
+    for i in range(5):
+        store.add("a", 100.0 + i * 20, (float(i),) * 5)
+    count, summary = store.summary("a", "3", 200.0)
+    assert count == 3
+    assert summary["co2"]["min"] == 2.0
+    # 1m на момент 190: точки с ts >= 130 (140, 160, 180)
+    count, summary = store.summary("a", "1m", 190.0)
+    assert count == 3
+    assert summary["co2"]["avg"] == 3.0
+    assert store.summary("a", "1m", 10_000.0) == (0, None)
+    assert store.summary("b", "3", 200.0) == (0, None)